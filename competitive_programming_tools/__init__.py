@@ -1,10 +1,13 @@
 '''Competitive programming tools'''
 import click
 
+from .bench import bench
+from .cache import cache
 from .expand import expand
 from .listen import listen
 from .mkpch import mkpch
 from .run import run
+from .scale import scale
 from .stress import stress
 from .submit import submit
 
@@ -29,9 +32,12 @@ def flush() -> None:
     shutil.rmtree(utils.TMP_DIR)
 
 
+main.command()(bench)
+main.add_command(cache)
 main.command()(expand)
 main.command()(listen)
 main.command()(mkpch)
 main.command()(run)
+main.command()(scale)
 main.command()(stress)
 main.command()(submit)
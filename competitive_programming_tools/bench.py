@@ -0,0 +1,357 @@
+'''
+Provides :py:func:`bench`, for timing solutions precisely.
+'''
+
+import click
+
+from .auto_path import AutoPath
+
+
+def percentile(values, fraction):
+    '''
+    Get the value below which `fraction` of
+    the `values` are (by the nearest rank).
+    '''
+    import math
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(values):
+    '''
+    Get the min, median, 95th percentile and
+    standard deviation of some times, in ms.
+    '''
+    import statistics
+    return (
+        1000 * min(values),
+        1000 * statistics.median(values),
+        1000 * percentile(values, 0.95),
+        1000 * statistics.stdev(values) if len(values) > 1 else 0.0,
+    )
+
+
+def format_stats(stats):
+    '''Format the result of :py:func:`summarize`.'''
+    return ''.join(f' {value:>9.1f}' for value in stats)
+
+
+def sign_test(pairs):
+    '''
+    Get the two-sided p-value of the sign test, for whether
+    the first values in `pairs` tend to differ from the second.
+    '''
+    import math
+    wins = sum(first < second for first, second in pairs)
+    losses = sum(first > second for first, second in pairs)
+    count = wins + losses
+    if count == 0:
+        return 1.0
+    tail = sum(math.comb(count, k) for k in range(min(wins, losses) + 1))
+    return min(1.0, 2 * tail / 2**count)
+
+
+def time_test(executable, argv, input_path, counters=False):
+    '''
+    Run `executable` once on a test without showing the output,
+    counting hardware events if `counters` is set.
+
+    Returns the exit code, the :py:class:`Usage`
+    and the standard output.
+    '''
+    from .execute import OutputCapture, execute
+
+    capture = OutputCapture()
+    with open(input_path, encoding='utf-8') as file:
+        returncode, usage = execute(executable, argv, file, capture, counters=counters)
+    return returncode, usage, capture.stdout
+
+
+def median_count(usages, name):
+    '''Get the median count of a hardware event over some runs.'''
+    import statistics
+    return round(statistics.median((usage.counters or {}).get(name, 0) for usage in usages))
+
+
+def counted_names(usages):
+    '''Get the names of the hardware events counted in any of the runs.'''
+    from .spawn import COUNTER_NAMES
+    return [
+        name for name in COUNTER_NAMES
+        if any(name in (usage.counters or {}) for usage in usages)
+    ]
+
+
+def compare(executables, argv, test_dir, test_names, runs, warmup, counters=False):
+    '''
+    Time two executables on the tests in alternating order, check
+    that their outputs are accepted, and report their speedups,
+    and how the hardware event counts change if `counters` is set.
+    '''
+    from .lenient_checker import LenientChecker
+    from .run import test_paths, warn_no_counters
+    from .utils import warn
+
+    cpu_times = {test_name: ([], []) for test_name in test_names}
+    usages = {test_name: ([], []) for test_name in test_names}
+    rejected = set()
+
+    with click.progressbar(range(warmup + runs), label='Timing', file=click.get_text_stream('stderr')) as rounds:
+        for round_index in rounds:
+            for test_name in test_names:
+                input_path, answer_path = test_paths(test_dir, test_name)
+                # Alternate which build goes first, so neither
+                # is favored by running on a warmer machine.
+                order = (0, 1) if round_index % 2 == 0 else (1, 0)
+                outputs = [None, None]
+                for index in order:
+                    returncode, usage, outputs[index] = time_test(
+                        executables[index], argv, input_path, counters)
+                    if returncode:
+                        rejected.add((test_name, index))
+                    if round_index >= warmup:
+                        cpu_times[test_name][index].append(usage.cpu_time)
+                        usages[test_name][index].append(usage)
+
+                if round_index > 0:
+                    continue
+                outputs = [output.decode(errors='replace') for output in outputs]
+                try:
+                    with open(answer_path, encoding='utf-8') as file:
+                        answers = [file.read()] * 2
+                except FileNotFoundError:
+                    # Without an answer, the second build is checked against the first.
+                    answers = [outputs[0]] * 2
+                for index, (output, answer) in enumerate(zip(outputs, answers)):
+                    if not LenientChecker(output, answer).accept:
+                        rejected.add((test_name, index))
+
+    for test_name, index in sorted(rejected):
+        warn(f'{"AB"[index]} did not pass {test_name!r} in some of the runs.')
+
+    name_width = max(len('total'), *map(len, test_names)) + 4
+    click.echo(' ' * name_width + ''.join(
+        f' {title:>10}' for title in ('A cpu ms', 'B cpu ms', 'speedup', 'p-value')))
+
+    def show(name, a_times, b_times):
+        import statistics
+        a_median = statistics.median(a_times)
+        b_median = statistics.median(b_times)
+        p_value = sign_test(zip(a_times, b_times))
+        speedup = b_median / a_median if a_median else float('inf')
+        click.echo(''.join((
+            click.style(f'  [{name}]'.ljust(name_width), fg='yellow'),
+            f' {1000 * a_median:>10.1f} {1000 * b_median:>10.1f}',
+            click.style(
+                f' {speedup:>9.3f}x',
+                fg=(None if p_value >= 0.05 else 'green' if speedup > 1 else 'red'),
+            ),
+            f' {p_value:>10.3g}',
+        )))
+
+    for test_name in test_names:
+        show(test_name, *cpu_times[test_name])
+
+    if len(test_names) > 1:
+        show(
+            'total',
+            *([sum(times) for times in zip(*(cpu_times[test_name][index]
+                                             for test_name in test_names))]
+              for index in range(2)),
+        )
+
+    click.echo('The speedup is how many times faster A is than B, '
+               'it is colored if the p-value is below 0.05.', err=True)
+
+    if not counters:
+        return
+
+    all_usages = [
+        usage for test_usages in usages.values()
+        for build_usages in test_usages for usage in build_usages
+    ]
+    names = counted_names(all_usages)
+    if not names:
+        warn_no_counters(all_usages)
+        return
+
+    click.echo('\n' + ' ' * name_width + ''.join(f' {name:>13}' for name in names) +
+               '  (change of the medians from A to B)')
+    for test_name in test_names:
+        changes = []
+        for name in names:
+            a_count, b_count = (median_count(build_usages, name)
+                                for build_usages in usages[test_name])
+            changes.append(f'{(b_count - a_count) / a_count:+.1%}' if a_count else '-')
+        click.echo(click.style(f'  [{test_name}]'.ljust(name_width), fg='yellow') +
+                   ''.join(f' {change:>13}' for change in changes))
+
+
+@click.argument('source', type=AutoPath())
+@click.argument('argv', nargs=-1)
+@click.option('-d', '--debug-level', type=click.IntRange(0), default=0,
+              help=(
+                  '\b\n'
+                  'How paranoid should the debugging be?\n'
+                  ' 0: As close to the average contest\n'
+                  '    environment as possible.\n'
+                  ' 1: Default balance between compilation\n'
+                  '    speed and information.\n'
+                  '>1: Higher levels may exist\n'
+                  '    depending on language.\n\b\n'
+              ))
+@click.option('-fr', '--force-recompile', is_flag=True,
+              help='If this flag is set, the program will '
+                   'be recompiled even if unneccesary.')
+@click.option('-e', '--extra-flags', default='',
+              help='Pass extra arguments in the compilation.')
+@click.option('-T', '--testset', type=str,
+              help=('Select which tests to time, '
+                    "with the pattern 'some/directory/prefix' like for `run`. "
+                    "The default is 'samples/{source_filename_without_suffix}'"))
+@click.option('-n', '--runs', type=click.IntRange(1), default=10,
+              help='How many timed runs to do of each test.')
+@click.option('-wu', '--warmup', type=click.IntRange(0), default=1,
+              help='How many untimed runs to do of each test first.')
+@click.option('--cpu', type=click.IntRange(0),
+              help='Pin the runs to this cpu, to reduce the noise.')
+@click.option('--counters', is_flag=True,
+              help=('Also report the medians of hardware event counts, '
+                    'or how they change when comparing, '
+                    'where perf events are permitted.'))
+@click.option('-a', '--against', type=AutoPath(),
+              help=('Compare the speed with another source '
+                    '(or with the same source built differently).'))
+@click.option('-ad', '--against-debug-level', type=click.IntRange(0),
+              help='The debug level to compare with, the default is the same.')
+@click.option('-ae', '--against-extra-flags',
+              help='The extra flags to compare with, the default is the same.')
+def bench(source, argv, debug_level, force_recompile, extra_flags, testset, runs, warmup, cpu,
+          counters, against, against_debug_level, against_extra_flags):
+    '''
+    Time a program from source on tests repeatedly.
+
+    Each round runs every test once, and the min, median,
+    95th percentile and standard deviation of the times
+    are reported per test, and of the total time of a round.
+
+    When comparing against another build, both run on each
+    test in alternating order, their outputs are checked,
+    and the speedups of the median cpu times are reported,
+    with the p-value of a sign test over the rounds.
+    '''
+    import os
+    from .get_executable import CompileError, get_executables
+    from .limits import default_testset
+    from .run import find_tests, format_count, test_paths, warn_no_counters
+    from .utils import error, warn
+
+    if testset is None:
+        testset = default_testset(source)
+
+    test_dir, test_names = find_tests(testset)
+    if not test_names:
+        error(f'no tests match {testset!r}.')
+        return
+
+    builds = [(source, debug_level, extra_flags)]
+    if (against, against_debug_level, against_extra_flags) != (None, None, None):
+        builds.append((
+            against or source,
+            debug_level if against_debug_level is None else against_debug_level,
+            extra_flags if against_extra_flags is None else against_extra_flags,
+        ))
+        if builds[0] == builds[1]:
+            error('nothing to compare, both builds are the same.')
+            return
+
+    try:
+        executables = get_executables([
+            dict(
+                source_path=build_source,
+                debug_level=build_debug_level,
+                extra_flags=build_extra_flags,
+                force_recompile=force_recompile,
+            )
+            for build_source, build_debug_level, build_extra_flags in builds
+        ])
+    except CompileError:
+        error('failed compiling.')
+        return
+
+    if cpu is not None:
+        # Inherited by all the processes started from now on.
+        try:
+            os.sched_setaffinity(0, {cpu})
+        except OSError as exc:
+            error(f'cannot pin to cpu {cpu} ({exc.strerror}).')
+            return
+
+    if len(executables) == 2:
+        for name, (build_source, build_debug_level, build_extra_flags) in zip('AB', builds):
+            click.echo(
+                f'{name}: {build_source} -d {build_debug_level}' +
+                (f' -e {build_extra_flags!r}' if build_extra_flags else ''),
+                err=True,
+            )
+        compare(executables, argv, test_dir, test_names, runs, warmup, counters)
+        return
+    executable, = executables
+
+    input_paths = [test_paths(test_dir, test_name)[0] for test_name in test_names]
+    wall_times = {test_name: [] for test_name in test_names}
+    cpu_times = {test_name: [] for test_name in test_names}
+    counts = {test_name: [] for test_name in test_names}
+    crashed = set()
+
+    with click.progressbar(range(warmup + runs), label='Timing', file=click.get_text_stream('stderr')) as rounds:
+        for round_index in rounds:
+            for test_name, input_path in zip(test_names, input_paths):
+                returncode, usage, _ = time_test(executable, argv, input_path, counters)
+                if returncode:
+                    crashed.add(test_name)
+                if round_index >= warmup:
+                    wall_times[test_name].append(usage.wall_time)
+                    cpu_times[test_name].append(usage.cpu_time)
+                    counts[test_name].append(usage)
+
+    for test_name in sorted(crashed):
+        warn(f'{test_name!r} crashed in some of the runs.')
+
+    header = ''.join(f' {title:>9}' for title in ('min', 'median', 'p95', 'stddev'))
+    name_width = max(len('total'), *map(len, test_names)) + 4
+    click.echo(' ' * name_width + 'cpu ms'.center(len(header)) + '  ' + 'wall ms'.center(len(header)))
+    click.echo(' ' * name_width + header + '  ' + header)
+
+    def show(name, test_cpu_times, test_wall_times):
+        click.echo(''.join((
+            click.style(f'  [{name}]'.ljust(name_width), fg='yellow'),
+            format_stats(summarize(test_cpu_times)),
+            '  ', format_stats(summarize(test_wall_times)),
+        )))
+
+    for test_name in test_names:
+        show(test_name, cpu_times[test_name], wall_times[test_name])
+
+    if len(test_names) > 1:
+        show(
+            'total',
+            [sum(times) for times in zip(*cpu_times.values())],
+            [sum(times) for times in zip(*wall_times.values())],
+        )
+
+    if not counters:
+        return
+
+    usages = [usage for test_usages in counts.values() for usage in test_usages]
+    names = counted_names(usages)
+    if not names:
+        warn_no_counters(usages)
+        return
+
+    click.echo('\n' + ' ' * name_width + ''.join(f' {name:>13}' for name in names) + '  (medians)')
+    for test_name in test_names:
+        click.echo(click.style(f'  [{test_name}]'.ljust(name_width), fg='yellow') + ''.join(
+            f' {format_count(median_count(counts[test_name], name)):>13}'
+            for name in names
+        ))
@@ -0,0 +1,235 @@
+'''
+Provides the bookkeeping of the builds made by
+:py:func:`get_executable`: what they are, how often
+they are reused, and evicting them when they take
+more space than allowed.
+'''
+
+import os
+
+from .utils import TMP_DIR
+
+BUILD_DIR = os.path.join(TMP_DIR, 'builds')
+'''Where builds are stored, named by the hash of everything they depend on.'''
+STATS_PATH = os.path.join(BUILD_DIR, 'stats.json')
+TOKEN_DIR = os.path.join(BUILD_DIR, 'tokens')
+'''Which build each preprocessed token stream was compiled to, if CPT_TOKEN_CACHE is set.'''
+DEFAULT_MAX_SIZE = '1G'
+'''Bytes the builds may use, unless CPT_BUILD_CACHE_SIZE is set.'''
+SIZE_SUFFIXES = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+
+def parse_size(size_str):
+    '''
+    Converts a size like '512M' or '1G'
+    (or a plain number of bytes) to bytes.
+    '''
+    size_str = size_str.strip().upper().rstrip('B')
+    suffix = size_str[-1:] if size_str[-1:] in SIZE_SUFFIXES else ''
+    return int(float(size_str[:len(size_str) - len(suffix)]) * SIZE_SUFFIXES[suffix])
+
+
+def max_size():
+    '''Get how many bytes the builds may use.'''
+    from .utils import warn
+    size_str = os.environ.get('CPT_BUILD_CACHE_SIZE', DEFAULT_MAX_SIZE)
+    try:
+        return parse_size(size_str)
+    except ValueError:
+        warn(f'CPT_BUILD_CACHE_SIZE={size_str!r} is not a size, using {DEFAULT_MAX_SIZE}.')
+        return parse_size(DEFAULT_MAX_SIZE)
+
+
+def token_cache_enabled():
+    '''
+    Get whether builds may be reused for sources which only
+    differ in comments and whitespace, as set by CPT_TOKEN_CACHE.
+    '''
+    return os.environ.get('CPT_TOKEN_CACHE', '') not in ('', '0')
+
+
+def _read_json(path, default):
+    import json
+    try:
+        with open(path, encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return default
+
+
+def _write_json(path, data):
+    import json
+    partial_path = f'{path}.{os.getpid()}.partial'
+    with open(partial_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+    os.replace(partial_path, path)
+
+
+def metadata_path(build_path):
+    '''Get the path of the file describing a build.'''
+    return f'{os.path.splitext(build_path)[0]}.json'
+
+
+def record_build(build_path, lang, debug_level, source_path):
+    '''Describe a new build, for the statistics.'''
+    _write_json(metadata_path(build_path), {
+        'language': lang.name,
+        'debug_level': debug_level,
+        'source': os.path.abspath(source_path),
+        'links': [],
+    })
+
+
+def record_link(build_path, executable_path):
+    '''
+    Remember that `executable_path` is a link to a build,
+    so it is removed with the build.
+    '''
+    metadata = _read_json(metadata_path(build_path), None)
+    if metadata is None or executable_path in metadata['links']:
+        return
+    metadata['links'].append(executable_path)
+    _write_json(metadata_path(build_path), metadata)
+
+
+def record_use(build_path, lang, debug_level, hit):
+    '''
+    Count a use of a build, which was already built if `hit`
+    is set, and mark it as used now for the eviction.
+    '''
+    import fcntl
+    if hit:
+        try:
+            os.utime(build_path)
+        except FileNotFoundError:
+            pass
+    # Builds made at once by several processes would
+    # otherwise lose each other's counts.
+    fd = os.open(f'{STATS_PATH}.lock', os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        stats = _read_json(STATS_PATH, {})
+        hits, misses = stats.get(f'{lang.name} {debug_level}', (0, 0))
+        stats[f'{lang.name} {debug_level}'] = (hits + hit, misses + (not hit))
+        _write_json(STATS_PATH, stats)
+    finally:
+        os.close(fd)
+
+
+def equivalent_build(token_key):
+    '''
+    Get the path of the build of the token
+    stream `token_key`, or None if there is none.
+    '''
+    try:
+        with open(os.path.join(TOKEN_DIR, token_key), encoding='utf-8') as file:
+            build_path = os.path.join(BUILD_DIR, file.read())
+    except FileNotFoundError:
+        return None
+    return build_path if os.path.exists(build_path) else None
+
+
+def record_tokens(token_key, build_path):
+    '''Remember that the token stream `token_key` was compiled to a build.'''
+    from .utils import ensure_dir
+    ensure_dir(TOKEN_DIR)
+    path = os.path.join(TOKEN_DIR, token_key)
+    partial_path = f'{path}.{os.getpid()}.partial'
+    with open(partial_path, 'w', encoding='utf-8') as file:
+        file.write(os.path.basename(build_path))
+    os.replace(partial_path, path)
+
+
+def builds():
+    '''
+    Get the builds as (last use, size,
+    build path, metadata), least recently used first.
+    '''
+    entries = []
+    try:
+        with os.scandir(BUILD_DIR) as scan:
+            for entry in scan:
+                if entry.name.endswith('.exe'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((
+                        stat.st_mtime, stat.st_size, entry.path,
+                        _read_json(metadata_path(entry.path), {}),
+                    ))
+    except FileNotFoundError:
+        pass
+    return sorted(entries, key=lambda entry: entry[0])
+
+
+def remove_build(build_path, metadata):
+    '''Remove a build, its description, and the links to it.'''
+    for link_path in metadata.get('links', ()):
+        try:
+            if os.path.samefile(link_path, build_path):
+                os.remove(link_path)
+        except FileNotFoundError:
+            pass
+    for path in (build_path, metadata_path(build_path), f'{build_path}.lock'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def evict(size=None, keep=None):
+    '''
+    Remove the least recently used builds, except `keep`, until
+    they take at most `size` bytes (by default :py:func:`max_size`).
+
+    Also removes the copies of sources and the executables
+    left in TMP_DIR by versions before the builds were shared,
+    and the token streams whose build was removed.
+    '''
+    import collections
+    import re
+    if size is None:
+        size = max_size()
+
+    entries = builds()
+
+    # The executables of current builds are named like the legacy ones,
+    # but are recorded as links of a build, even when they are copies.
+    linked = {path for *_, metadata in entries for path in metadata.get('links', ())}
+    legacy = re.compile(r'[0-9a-f]{16}-[0-9a-f]{16}\.(src|exe)')
+    with os.scandir(TMP_DIR) as scan:
+        for entry in scan:
+            if legacy.fullmatch(entry.name) and entry.path not in linked and (
+                    entry.name.endswith('.src') or entry.stat().st_nlink == 1):
+                os.remove(entry.path)
+
+    def file_id(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return path
+        return stat.st_dev, stat.st_ino
+
+    # Builds reused by the token cache are hard links to the same
+    # file, which only takes space once, until its last link is removed.
+    entries = [(*entry, file_id(entry[2])) for entry in entries]
+    links = collections.Counter(entry_id for *_, entry_id in entries)
+    total_size = sum({entry_id: entry_size for _, entry_size, _, _, entry_id in entries}.values())
+    for _, entry_size, build_path, metadata, entry_id in entries:
+        if total_size <= size:
+            break
+        if build_path == keep:
+            continue
+        remove_build(build_path, metadata)
+        links[entry_id] -= 1
+        if not links[entry_id]:
+            total_size -= entry_size
+
+    try:
+        with os.scandir(TOKEN_DIR) as scan:
+            for entry in scan:
+                if not entry.name.endswith('.partial') and equivalent_build(entry.name) is None:
+                    os.remove(entry.path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,63 @@
+'''
+Provides :py:func:`cache`, commands for
+inspecting the cache of builds.
+'''
+
+import click
+
+
+@click.group()
+def cache():
+    '''
+    Inspect the cache of compiled builds.
+    '''
+
+
+def format_size(size):
+    '''Format a number of bytes with a binary suffix.'''
+    for suffix in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return f'{size:.0f} {suffix}' if suffix == 'B' else f'{size:.1f} {suffix}'
+        size /= 1024
+    return f'{size:.1f} GiB'
+
+
+@cache.command()
+def stats():
+    '''
+    Show how many builds are cached, how much space they take,
+    and how often builds were found in the cache,
+    by language and debug level.
+    '''
+    import collections
+    import json
+    from .build_cache import BUILD_DIR, STATS_PATH, builds, max_size
+
+    try:
+        with open(STATS_PATH, encoding='utf-8') as file:
+            uses = json.load(file)
+    except (OSError, ValueError):
+        uses = {}
+
+    entries = collections.Counter()
+    sizes = collections.Counter()
+    for _, size, _, metadata in builds():
+        group = f'{metadata.get("language", "?")} {metadata.get("debug_level", "?")}'
+        entries[group] += 1
+        sizes[group] += size
+
+    click.echo(f'{"language":>10} {"level":>5} {"builds":>8} {"size":>11} {"hits":>8} {"misses":>8} {"hit rate":>9}')
+
+    def show(language, level, group_entries, group_size, hits, misses):
+        rate = f'{100 * hits / (hits + misses):.1f}%' if hits + misses else '-'
+        click.echo(f'{language:>10} {level:>5} {group_entries:>8} {format_size(group_size):>11} '
+                   f'{hits:>8} {misses:>8} {rate:>9}')
+
+    for group in sorted(set(entries) | set(uses)):
+        language, level = group.rsplit(' ', 1)
+        show(language, level, entries[group], sizes[group], *uses.get(group, (0, 0)))
+
+    show('total', '', sum(entries.values()), sum(sizes.values()),
+         *(sum(counts) for counts in zip((0, 0), *uses.values())))
+    click.echo(f'\nThe builds in {BUILD_DIR!r} may use up to {format_size(max_size())} '
+               '(set with CPT_BUILD_CACHE_SIZE).', err=True)
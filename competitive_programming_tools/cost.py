@@ -0,0 +1,98 @@
+'''
+Provides functions for measuring the cost of tests in
+instructions, which unlike time is reproducible,
+and for storing it as a baseline to compare against.
+'''
+
+import re
+
+CACHEGRIND_REFS = re.compile(r'I\s+refs:\s+([\d,]+)')
+
+
+def instruction_counter():
+    '''
+    Get how instructions can be counted here,
+    'perf' or 'cachegrind', or None if they cannot.
+    '''
+    import asyncio
+    import shutil
+    from .spawn import DEVNULL, spawn
+
+    async def probe():
+        proc = await spawn(['true'], stdout=DEVNULL, stderr=DEVNULL, counters=True)
+        await proc.wait()
+        return proc.usage
+
+    if 'instructions' in (asyncio.run(probe()).counters or {}):
+        return 'perf'
+    if shutil.which('valgrind'):
+        return 'cachegrind'
+    return None
+
+
+def cachegrind_instructions(executable, argv, input_path):
+    '''
+    Count the instructions `executable` runs on a test with cachegrind,
+    or return None if it did not finish.
+    '''
+    import os
+    import subprocess
+    from .spawn import split_command
+
+    with open(input_path, 'rb') as file:
+        result = subprocess.run(
+            ['valgrind', '--tool=cachegrind', '--cache-sim=no',
+             f'--cachegrind-out-file={os.devnull}',
+             *split_command(executable), *argv],
+            stdin=file,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            check=False,
+        )
+    match = CACHEGRIND_REFS.search(result.stderr.decode(errors='replace'))
+    if result.returncode or match is None:
+        return None
+    return int(match[1].replace(',', ''))
+
+
+def baseline_path(testset):
+    '''
+    Get the path of the file storing the baseline
+    costs of the tests matching `testset`.
+    '''
+    return f'{testset}.cost.json'
+
+
+def load_baseline(testset):
+    '''
+    Get the baseline instruction counts
+    by test name, empty if there is none.
+    '''
+    import json
+    try:
+        with open(baseline_path(testset), encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_baseline(testset, costs):
+    '''Store instruction counts by test name as the baseline.'''
+    import json
+    with open(baseline_path(testset), 'w', encoding='utf-8') as file:
+        json.dump(costs, file, indent=2, sort_keys=True)
+
+
+def format_change(cost, baseline_cost, width=8):
+    '''
+    Format the change of a cost relative to
+    the baseline, colored if it is noticeable.
+    '''
+    import click
+    if baseline_cost is None:
+        return click.style('(new)'.rjust(width), fg='yellow')
+    change = (cost - baseline_cost) / baseline_cost if baseline_cost else 0.0
+    return click.style(
+        f'{100 * change:+.2f}%'.rjust(width),
+        fg='red' if change > 0.005 else 'green' if change < -0.005 else None,
+    )
@@ -5,60 +5,314 @@ programs from source code and testing them.
 import click
 
 
+class OutputEcho:
+    '''
+    Echoes the standard output and standard error
+    of a program to the terminal, a batch of lines at a time.
+
+    If `preview_lines` is given, the full output is written
+    to files in the temporary directory, and only that many
+    lines from the start and from the end are echoed,
+    followed by the size of the output.
+    '''
+    CHUNK_SIZE = 1 << 16
+    STREAMS = ('stdout', 'stderr')
+
+    def __init__(self, style_stderr, preview_lines=None, name='output'):
+        import collections
+        import os
+        from .utils import TMP_DIR, ensure_dir
+
+        self.style_stderr = style_stderr
+        self.preview_lines = preview_lines
+        self.was_err = False
+
+        self.carry = dict.fromkeys(self.STREAMS, b'')
+        self.byte_counts = dict.fromkeys(self.STREAMS, 0)
+        self.line_counts = dict.fromkeys(self.STREAMS, 0)
+
+        self.shown_lines = 0
+        self.omitted_lines = 0
+        self.tail = collections.deque(maxlen=preview_lines or 0)
+
+        self.paths = {}
+        self.files = {}
+        if preview_lines is not None:
+            output_dir = os.path.join(TMP_DIR, 'output')
+            ensure_dir(output_dir)
+            for stream, suffix in zip(self.STREAMS, ('out', 'err')):
+                self.paths[stream] = os.path.join(output_dir, f'{name}.{suffix}')
+                # pylint: disable=consider-using-with
+                self.files[stream] = open(self.paths[stream], 'wb')
+
+    def _show(self, stream, lines):
+        if not lines:
+            return
+
+        if stream == 'stdout':
+            self.was_err = False
+            click.echo(''.join(lines), nl=False)
+            return
+
+        if not self.style_stderr:
+            self.was_err = True
+            click.echo(''.join(lines), nl=False, err=True)
+            return
+
+        parts = []
+        for line in lines:
+            parts.append(click.style(
+                '       | ' if self.was_err else 'STDERR | ',
+                bold=True, fg='magenta',
+            ))
+            parts.append(line)
+            self.was_err = True
+        click.echo(''.join(parts), nl=False, err=True)
+
+    def _add_lines(self, stream, lines):
+        if self.preview_lines is None:
+            self._show(stream, lines)
+            return
+
+        head = lines[:max(0, self.preview_lines - self.shown_lines)]
+        self.shown_lines += len(head)
+        self._show(stream, head)
+
+        for line in lines[len(head):]:
+            if len(self.tail) == self.tail.maxlen:
+                self.omitted_lines += 1
+            self.tail.append((stream, line))
+
+    def write(self, stream, data):
+        '''
+        Handle the next chunk of bytes from `stream`
+        ('stdout' or 'stderr').
+        '''
+        self.byte_counts[stream] += len(data)
+        self.line_counts[stream] += data.count(b'\n')
+        if stream in self.files:
+            self.files[stream].write(data)
+
+        data = self.carry[stream] + data
+        end = data.rfind(b'\n') + 1
+        if len(data) - end > self.CHUNK_SIZE:
+            # Do not wait forever for the end of a huge line.
+            end = len(data)
+        self.carry[stream] = data[end:]
+
+        if end:
+            text = data[:end].decode(errors='replace')
+            lines = [f'{line}\n' for line in text.split('\n')]
+            lines[-1] = lines[-1][:-1]
+            if not lines[-1]:
+                lines.pop()
+            self._add_lines(stream, lines)
+
+    def finish(self):
+        '''
+        Echo what remains after the program has exited.
+        '''
+        for stream in self.STREAMS:
+            if self.carry[stream]:
+                self.line_counts[stream] += 1
+                self._add_lines(stream, [self.carry[stream].decode(errors='replace')])
+                self.carry[stream] = b''
+
+        if self.preview_lines is None:
+            return
+
+        for file in self.files.values():
+            file.close()
+
+        if self.omitted_lines:
+            click.secho(f'... {self.omitted_lines} lines omitted ...',
+                        fg='yellow', err=True)
+
+        batch_stream, batch = None, []
+        for stream, line in self.tail:
+            if stream != batch_stream:
+                self._show(batch_stream, batch)
+                batch_stream, batch = stream, []
+            batch.append(line)
+        self._show(batch_stream, batch)
+
+        click.secho('; '.join(
+            f'{stream}: {self.byte_counts[stream]} bytes, '
+            f'{self.line_counts[stream]} lines'
+            for stream in self.STREAMS
+        ), fg='blue', err=True)
+        click.secho('Full output saved to ' +
+                    ' and '.join(map(repr, self.paths.values())),
+                    fg='blue', err=True)
+
+
+class OutputCapture:
+    '''
+    Used in place of an :py:class:`OutputEcho`
+    to keep the standard output instead of showing it.
+    The standard error is discarded.
+    '''
+
+    def __init__(self):
+        self.chunks = []
+
+    @property
+    def stdout(self):
+        '''All of the standard output so far.'''
+        return b''.join(self.chunks)
+
+    def write(self, stream, data):
+        '''Keep `data` if it is from the standard output.'''
+        if stream == 'stdout':
+            self.chunks.append(data)
+
+    def finish(self):
+        '''Nothing to do, the output is only kept.'''
+
+
+class CheckerThread:
+    '''
+    Feeds the standard output of a program to a checker
+    (like :py:class:`StreamingChecker`) from a thread of its own,
+    through a spill file, so the output is read as fast as
+    it is produced, however long checking it takes.
+
+    `on_reject` is called in the thread
+    as soon as the checker rejects the output.
+    '''
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, checker, on_reject):
+        import tempfile
+        import threading
+        from .utils import TMP_DIR
+
+        self.checker = checker
+        self.on_reject = on_reject
+        # pylint: disable=consider-using-with
+        self.spill = tempfile.TemporaryFile(dir=TMP_DIR)
+        self.size = 0
+        self.done = False
+        self.changed = threading.Condition()
+        self.thread = threading.Thread(target=self._check, daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        '''Queue the next chunk of output for checking.'''
+        import os
+        if self.checker.rejected:
+            return
+        os.pwrite(self.spill.fileno(), data, self.size)
+        with self.changed:
+            self.size += len(data)
+            self.changed.notify()
+
+    def _check(self):
+        import os
+        offset = 0
+        while True:
+            with self.changed:
+                self.changed.wait_for(lambda: self.size > offset or self.done)
+                size = self.size
+            if size == offset:
+                return
+            while offset < size:
+                data = os.pread(self.spill.fileno(), min(size - offset, self.CHUNK_SIZE), offset)
+                offset += len(data)
+                if not self.checker.feed(data):
+                    self.on_reject()
+                    return
+
+    async def finish(self):
+        '''Wait until all of the output queued is checked.'''
+        import asyncio
+        with self.changed:
+            self.done = True
+            self.changed.notify()
+        await asyncio.get_running_loop().run_in_executor(None, self.thread.join)
+        self.spill.close()
+
+
 async def execute_impl(executable,
                        argv,
                        input_file,
-                       style_stderr):
+                       echo,
+                       limits=None,
+                       checker=None,
+                       counters=False):
     '''
     Run an executable with the given argv and input file,
-    and return the exit code and standard output.
+    and return the exit code and the :py:class:`Usage` of the process.
+
+    The output is shown through `echo` (an :py:class:`OutputEcho`),
+    or kept by it (an :py:class:`OutputCapture`).
+    The standard output is fed to `checker`
+    (like :py:class:`StreamingChecker`) as it is produced,
+    through a :py:class:`CheckerThread`, and the process is
+    killed as soon as the checker rejects it (setting the
+    checker's `killed`), or it exceeds the given :py:class:`Limits`.
+    If `counters` is set, the usage includes hardware event counts.
     '''
     import asyncio
+    from .spawn import PIPE, spawn, split_command
 
-    output_chunks = []
-
-    proc = await asyncio.create_subprocess_shell(
-        ' '.join((executable, *argv)),
-        limit=128*1024**2,  # 128 MiB
+    proc = await spawn(
+        [*split_command(executable), *argv],
         stdin=input_file,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
+        stdout=PIPE,
+        stderr=PIPE,
+        limits=limits,
+        counters=counters,
+        limit=CheckerThread.CHUNK_SIZE,
     )
 
-    was_err = False
+    checker_thread = None
+    if checker is not None:
+        import fcntl
+        loop = asyncio.get_running_loop()
+        try:
+            # The program runs ahead of the reading for longer
+            # with a larger pipe, when the checker takes the cpu.
+            fcntl.fcntl(proc.popen.stdout, getattr(fcntl, 'F_SETPIPE_SZ', 1031),
+                        CheckerThread.CHUNK_SIZE)
+        except OSError:
+            pass
+
+        def kill():
+            if proc.returncode is None:
+                checker.killed = True
+                proc.kill()
+
+        checker_thread = CheckerThread(checker, lambda: loop.call_soon_threadsafe(kill))
 
     async def process_stdout(stdout):
-        nonlocal was_err
-        while (line := (await stdout.readline()).decode()):
-            output_chunks.append(line)
-            print(line, end='')
-            was_err = False
+        while (data := await stdout.read(OutputEcho.CHUNK_SIZE)):
+            echo.write('stdout', data)
+            if checker_thread is not None:
+                checker_thread.write(data)
 
     async def process_stderr(stderr):
-        nonlocal was_err
-        while (line := (await stderr.readline()).decode()):
-            if style_stderr:
-                if was_err:
-                    click.secho('       | ',
-                                bold=True, fg='magenta', nl=False, err=True)
-                else:
-                    click.secho('STDERR | ',
-                                bold=True, fg='magenta', nl=False, err=True)
-            click.secho(line, nl=False, err=True)
-            was_err = True
+        while (data := await stderr.read(OutputEcho.CHUNK_SIZE)):
+            echo.write('stderr', data)
 
-    await asyncio.gather(
-            process_stdout(proc.stdout),
-            process_stderr(proc.stderr),
-    )
+    try:
+        await asyncio.gather(
+                process_stdout(proc.stdout),
+                process_stderr(proc.stderr),
+        )
+    finally:
+        if checker_thread is not None:
+            await checker_thread.finish()
+    echo.finish()
 
-    return await proc.wait(), ''.join(output_chunks)
+    return await proc.wait(), proc.usage
 
 
 async def execute_interactive_impl(executable,
                                    interactor,
                                    argv,
                                    sample_in,
+                                   limits=None,
                                    ):
     '''
     Run two executables communicating to each other
@@ -68,21 +322,28 @@ async def execute_interactive_impl(executable,
 
     `sample_in` is given to `interactor`'s stdin
     before the communication starts.
+
+    `executable` is killed if it exceeds the given :py:class:`Limits`.
+
+    Returns the exit codes of `executable` and `interactor`,
+    and the :py:class:`Usage` of `executable`.
     '''
     import asyncio
+    from .spawn import PIPE, spawn, split_command
 
-    exec_proc = await asyncio.create_subprocess_shell(
-        executable,
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        # stderr=asyncio.subprocess.PIPE,
+    exec_proc = await spawn(
+        split_command(executable),
+        stdin=PIPE,
+        stdout=PIPE,
+        # stderr=PIPE,
+        limits=limits,
     )
 
-    inte_proc = await asyncio.create_subprocess_shell(
-        ' '.join((interactor, *argv)),
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        # stderr=asyncio.subprocess.PIPE,
+    inte_proc = await spawn(
+        [*split_command(interactor), *argv],
+        stdin=PIPE,
+        stdout=PIPE,
+        # stderr=PIPE,
     )
 
     last_begin_pre = ''
@@ -125,25 +386,25 @@ async def execute_interactive_impl(executable,
         ),
     )
 
-    return await exec_proc.wait(), await inte_proc.wait()
+    return await exec_proc.wait(), await inte_proc.wait(), exec_proc.usage
 
 
-def execute(executable, argv, input_file, style_stderr):
+def execute(executable, argv, input_file, echo, limits=None, checker=None, counters=False):
     '''
     Wrapper for :py:function:`execute_impl` to start it
     in an async context.
     '''
     import asyncio
     return asyncio.run(execute_impl(
-        executable, argv, input_file, style_stderr))
+        executable, argv, input_file, echo, limits, checker, counters))
 
 
-def execute_interactive(executable, interactor, argv, sample_in):
+def execute_interactive(executable, interactor, argv, sample_in, limits=None):
     '''
     Wrapper for :py:func:`execute_interactive_impl` to start it
     in an async context.
     '''
     import asyncio
     return asyncio.run(execute_interactive_impl(
-        executable, interactor, argv, sample_in))
+        executable, interactor, argv, sample_in, limits))
 
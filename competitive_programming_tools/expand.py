@@ -1,6 +1,7 @@
 '''
 Provides :py:func:`expand`.
 '''
+import re
 from typing import Optional, Set, Tuple
 
 import click
@@ -8,6 +9,8 @@ import click
 from .auto_path import AutoPath
 from .stdin_or import StdinOr
 
+include_matcher = re.compile(r'^#include\s*(<|")(.*)(>|")$')
+local_include_matcher = re.compile(r'^#include\s*"(.*)"$')
 
 
 def get_inner_path(current_dir, line: str) -> Tuple[Optional[str], Optional[str]]:
@@ -30,13 +33,40 @@ def get_inner_path(current_dir, line: str) -> Tuple[Optional[str], Optional[str]
     if not match:
         return None, None
 
-    for include_dir in os.environ['CPT_EXPAND_PATH'].split(':'):
+    for include_dir in os.environ.get('CPT_EXPAND_PATH', '').split(':'):
+        if not include_dir:
+            continue
         path = os.path.join(include_dir, match.group(2))
         if os.path.isfile(path):
             return path, match.group(2)
     return None, None
 
 
+def included_paths(path: str) -> Set[str]:
+    '''
+    Find the paths of all files included by the
+    file at `path`, directly or through other includes,
+    that :py:func:`get_inner_path` can resolve.
+    '''
+    import os
+
+    found: Set[str] = set()
+    stack = [path]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(current, encoding='utf-8') as file:
+                lines = list(file)
+        except (OSError, UnicodeDecodeError):
+            continue
+        for line in lines:
+            inner_path, _ = get_inner_path(os.path.dirname(current), line)
+            if inner_path is not None and inner_path not in found:
+                found.add(inner_path)
+                stack.append(inner_path)
+    return found
+
+
 def should_skip(line: str, minify: bool, is_top_level: bool) -> bool:
     '''
     Determine whether to exclude a line from
@@ -93,14 +123,9 @@ def expand(source: str, tmp_file: bool, no_minify: bool, is_cli=True) -> Optiona
     Replace cpt includes with source code (for submission to online judges)
     Specifically for C++.
     '''
-    global include_matcher, local_include_matcher
-    import re
     import os
     from .utils import TMP_DIR
 
-    include_matcher = re.compile(r'^#include\s*(<|")(.*)(>|")$')
-    local_include_matcher = re.compile(r'^#include\s*"(.*)"$')
-
     minify = not no_minify
 
     res = expand_impl(source, set(), minify)
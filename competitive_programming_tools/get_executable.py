@@ -2,8 +2,33 @@
 Provides :py:func:`get_executable`.
 '''
 
+import contextlib
+import functools
+import os
+import re
+
 import click
 
+from .utils import TMP_DIR
+
+BUILD_VERSION = 1
+'''Changed whenever the builds made from the same inputs change.'''
+
+TOKEN_MATCHER = re.compile(rb'''
+    (?:u8|[uUL])?R"([^(\s]*)\(.*?\)\1"
+    | [A-Za-z_]\w*
+    | \.?\d(?:[eEpP][+-]|[\w.]|'\w)*
+    | "(?:\\.|[^"\\\n])*"
+    | '(?:\\.|[^'\\\n])*'
+    | <=> | \.\.\. | <<= | >>= | ->\*?
+    | \+\+ | -- | << | >> | [<>=!]= | && | \|\| | [-+*/%&|^]= | :: | \.\* | \#\#
+    | \S
+''', re.DOTALL | re.VERBOSE)
+'''Matches a token of C or C++ code.'''
+
+LINE_MARKER_MATCHER = re.compile(rb'^# \d+ "(?:\\.|[^"\\])*"((?: \d+)*)\n', re.MULTILINE)
+'''Matches a line marker of the preprocessor, capturing its flags.'''
+
 
 class CompileError(Exception):
     '''
@@ -14,6 +39,175 @@ class CompileError(Exception):
         self.exit_code = exit_code
 
 
+@functools.lru_cache(maxsize=None)
+def compiler_identity(program: str) -> str:
+    '''
+    Get the `--version` output of a compiler. It is probed
+    once for each version of the compiler's file, and
+    remembered in TMP_DIR, since probing takes a while.
+    '''
+    import json
+    import subprocess
+    from .spawn import resolve_program
+
+    path = resolve_program(program)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return program
+    file_id = f'{path} {stat.st_size} {stat.st_mtime_ns}'
+
+    identities_path = os.path.join(TMP_DIR, 'compilers.json')
+    try:
+        with open(identities_path, encoding='utf-8') as file:
+            identities = json.load(file)
+    except (OSError, ValueError):
+        identities = {}
+
+    if file_id not in identities:
+        try:
+            identities[file_id] = subprocess.run(
+                [path, '--version'],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                check=False,
+            ).stdout.decode(errors='replace')
+        except OSError:
+            return file_id
+        partial_path = f'{identities_path}.{os.getpid()}.partial'
+        with open(partial_path, 'w', encoding='utf-8') as file:
+            json.dump(identities, file)
+        os.replace(partial_path, identities_path)
+
+    return identities[file_id]
+
+
+def build_key(command, source_path: str) -> str:
+    '''
+    Get the hash of everything a build depends on: the
+    compile command (without the paths of the source and
+    executable), the compiler, and the content of the source
+    and of every local header it includes, directly or not.
+    '''
+    import hashlib
+    import json
+    from .expand import included_paths
+    from .spawn import split_command
+    from .verdict_cache import file_digest
+
+    command_template = command(source_path='{source}', executable_path='{executable}')
+    return hashlib.sha256(json.dumps([
+        BUILD_VERSION,
+        command_template,
+        compiler_identity(split_command(command_template)[0]),
+        file_digest(source_path),
+        sorted(map(str, map(file_digest, included_paths(source_path)))),
+    ]).encode()).hexdigest()
+
+
+def records_lines(command) -> bool:
+    '''
+    Get whether a compile command puts the lines and columns
+    of the source into the build, with debug info, sanitizers
+    or profiling, so its build can not be reused for
+    a source with the same tokens laid out differently.
+    '''
+    from .spawn import split_command
+
+    records = False
+    for arg in split_command(command(source_path='{source}', executable_path='{executable}')):
+        if arg.startswith('-g'):
+            records = arg not in ('-g0', '-ggdb0', '-gdwarf0')
+        elif arg.startswith('-fsanitize=') or arg == '-pg':
+            return True
+    return records
+
+
+def normalize_tokens(code: bytes) -> bytes:
+    '''
+    Get the tokens of preprocessed C or C++ code separated
+    by single spaces, however they were laid out.
+    '''
+    return b' '.join(match[0] for match in TOKEN_MATCHER.finditer(code))
+
+
+async def token_key(command, source_path: str):
+    '''
+    Get the hash of the compile command, the compiler and
+    the preprocessed source, without line markers, comments and
+    whitespace, or None if it could not be preprocessed.
+
+    Preprocessing is much faster than compiling, and sources
+    differing only in comments or formatting have the same key.
+    The parts from system headers are hashed as they are, since
+    they only change with the compiler (or the macros defined
+    before them, which are preprocessed into them).
+    '''
+    import asyncio
+    import hashlib
+    from .spawn import resolve_program, split_command
+
+    argv = split_command(command(source_path=source_path, executable_path='-'))
+    proc = await asyncio.create_subprocess_exec(
+        resolve_program(argv[0]), *argv[1:], '-E', '-w',
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    code, _ = await proc.communicate()
+    if proc.returncode:
+        return None
+
+    command_template = command(source_path='{source}', executable_path='{executable}')
+    digest = hashlib.sha256()
+    digest.update(f'{BUILD_VERSION}\0{command_template}\0'.encode())
+    digest.update(compiler_identity(argv[0]).encode())
+
+    parts = LINE_MARKER_MATCHER.split(code)
+    digest.update(b'\0U' + normalize_tokens(parts[0]))
+    for flags, part in zip(parts[1::2], parts[2::2]):
+        if b'3' in flags.split():
+            digest.update(b'\0S' + part)
+        else:
+            digest.update(b'\0U' + normalize_tokens(part))
+    return digest.hexdigest()
+
+
+def link_into_place(build_path: str, executable_path: str) -> None:
+    '''
+    Make `executable_path` the build at `build_path`,
+    by a hard link where possible, replacing it atomically.
+    '''
+    import shutil
+    try:
+        if os.path.samefile(build_path, executable_path):
+            return
+    except FileNotFoundError:
+        pass
+    partial_path = f'{executable_path}.{os.getpid()}.partial'
+    try:
+        os.link(build_path, partial_path)
+    except OSError:
+        shutil.copy2(build_path, partial_path)
+    os.replace(partial_path, executable_path)
+
+
+@contextlib.asynccontextmanager
+async def locked(path: str):
+    '''
+    Hold an exclusive lock on the file at `path` (created
+    if needed), so other processes building the same
+    thing wait for it instead of racing.
+    '''
+    import asyncio
+    import fcntl
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, fcntl.flock, fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
 def get_executable(*,
                    source_path: str,
                    debug_level: int,
@@ -22,12 +216,67 @@ def get_executable(*,
     '''
     Get the path to an executable corresponding to the source,
     by compiling, or using previously compiled executable.
+
+    Builds are shared by all sources with the same content
+    and includes, compiled the same way, wherever they are.
+    '''
+    import asyncio
+    return asyncio.run(get_executable_async(
+        source_path=source_path,
+        debug_level=debug_level,
+        extra_flags=extra_flags,
+        force_recompile=force_recompile,
+    ))
+
+
+def get_executables(builds, jobs=None):
+    '''
+    Get the paths to several executables, each given as a dict of
+    the keyword arguments of :py:func:`get_executable`, compiling
+    up to `jobs` of them at once (by default one per cpu).
+
+    The output of the compilers is shown after each finishes,
+    so it is not interleaved.
+    '''
+    import asyncio
+
+    async def get_all():
+        semaphore = asyncio.Semaphore(jobs or os.cpu_count() or 1)
+        # The other builds are finished (and cached) even if one fails,
+        # rather than cancelled, since cancelling a process being started
+        # can wait for it anyway.
+        results = await asyncio.gather(*(
+            get_executable_async(**build, semaphore=semaphore, capture=len(builds) > 1)
+            for build in builds
+        ), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    return asyncio.run(get_all())
+
+
+async def get_executable_async(*,
+                               source_path: str,
+                               debug_level: int,
+                               extra_flags: str,
+                               force_recompile: bool,
+                               semaphore=None,
+                               capture: bool = False) -> str:
+    '''
+    Like :py:func:`get_executable`, but compiles while
+    holding `semaphore` if it is given, and captures the
+    output of the compiler to show it at once if `capture` is set.
+
+    C++ sources use the headers precompiled by `mkpch`.
     '''
-    import os
     from hashlib import sha1
 
-    from .languages import SUFF_TO_LANG
-    from .utils import TMP_DIR, error
+    from . import build_cache
+    from .languages import C, CPP, SUFF_TO_LANG
+    from .spawn import run_command, split_command
+    from .utils import ensure_dir, error
 
     suffix = source_path.rsplit('.', 1)[-1]
 
@@ -43,6 +292,10 @@ def get_executable(*,
             extra_flags=extra_flags,
         )(source_path=source_path, executable_path='?')
 
+    if lang is CPP:
+        from .mkpch import pch_flags
+        extra_flags = f'{pch_flags(source_path, debug_level)} {extra_flags}'.strip()
+
     command = lang.get_compile_command_gen(
         debug_level=debug_level,
         extra_flags=extra_flags,
@@ -53,45 +306,67 @@ def get_executable(*,
     source_id = sha1(source_path.encode()).hexdigest()[:16]
     command_id = sha1(command_id_str.encode()).hexdigest()[:16]
 
-    source_copy_path = os.path.join(
-        TMP_DIR,
-        f'{source_id}-{command_id}.src',
-    )
     executable_path = os.path.join(
         TMP_DIR,
         f'{source_id}-{command_id}.exe',
     )
 
-    old_content = ''
-
-    if os.path.exists(source_copy_path):
-        with open(source_copy_path, 'r', encoding='utf-8') as file:
-            old_content = ''.join(file)
+    ensure_dir(build_cache.BUILD_DIR)
+    build_path = os.path.join(build_cache.BUILD_DIR, f'{build_key(command, source_path)}.exe')
 
-    new_content = ''
-    with open(source_path, 'r', encoding='utf-8') as file:
-        new_content = ''.join(file)
+    async with locked(f'{build_path}.lock'):
+        if force_recompile and os.path.exists(build_path):
+            build_cache.remove_build(build_path, {})
 
-    if new_content != old_content:
-        force_recompile = True
-        with open(source_copy_path, 'w', encoding='utf-8') as file:
-            file.write(new_content)
+        hit = os.path.exists(build_path)
+        tokens = None
+        if (not hit and lang in (C, CPP) and build_cache.token_cache_enabled()
+                and not records_lines(command)):
+            tokens = await token_key(command, source_path)
+            equivalent_path = tokens and not force_recompile and build_cache.equivalent_build(tokens)
+            if equivalent_path:
+                try:
+                    os.link(equivalent_path, build_path)
+                except FileNotFoundError:
+                    pass
+                else:
+                    build_cache.record_build(build_path, lang, debug_level, source_path)
+                    hit = True
+        build_cache.record_use(build_path, lang, debug_level, hit)
+        if not hit:
+            async with semaphore or contextlib.AsyncExitStack():
+                if not capture:
+                    click.echo(
+                        f'Compiling {click.style(repr(source_path), fg="yellow")} ... ',
+                        err=True, nl=False
+                    )
 
-    if force_recompile and os.path.exists(executable_path):
-        os.remove(executable_path)
+                partial_path = f'{build_path}.{os.getpid()}.partial'
+                exit_code, output = await run_command(split_command(
+                    command(source_path=source_path, executable_path=partial_path)), capture)
 
-    if not os.path.exists(executable_path):
-        click.echo(
-            f'Compiling {click.style(repr(source_path), fg="yellow")} ... ',
-            err=True, nl=False
-        )
+            if capture:
+                click.echo(
+                    f'Compiling {click.style(repr(source_path), fg="yellow")} '
+                    f'-d {debug_level} ... ',
+                    err=True, nl=False
+                )
+                if output:
+                    click.echo(err=True)
+                    click.echo(output.decode(errors='replace'), err=True, nl=False)
+            if exit_code:
+                click.echo(err=True)
+                raise CompileError(exit_code)
+            os.replace(partial_path, build_path)
+            build_cache.record_build(build_path, lang, debug_level, source_path)
+            if tokens is not None:
+                build_cache.record_tokens(tokens, build_path)
 
-        exit_code = os.system(
-            command(source_path=source_path, executable_path=executable_path))
-        if exit_code:
-            click.echo(err=True)
-            raise CompileError(exit_code)
+            click.secho('done!', fg='green', err=True)
 
-        click.secho('done!', fg='green', err=True)
+        link_into_place(build_path, executable_path)
+        build_cache.record_link(build_path, executable_path)
 
+    if not hit:
+        build_cache.evict(keep=build_path)
     return executable_path
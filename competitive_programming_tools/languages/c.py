@@ -11,6 +11,11 @@ SANITIZERS = (
     '-fstack-protector -fsanitize-address-use-after-scope '
 )
 
+PROFILE_FLAGS = {
+    'perf': '-g -fno-omit-frame-pointer ',
+    'gprof': '-g -pg -fno-omit-frame-pointer ',
+}
+
 C = Language(
     name='C',
     suffixes=('c', 'h',),
@@ -25,5 +30,6 @@ C = Language(
         '{debug_level} {extra_flags} '
         '{source_path} -o {executable_path} '
     ),
+    profile_flags=PROFILE_FLAGS,
     cf_id=73,
 )
@@ -14,6 +14,11 @@ SANITIZERS = (
 
 GLIBCXX_DEBUG = '-D_GLIBCXX_DEBUG -D_GLIBCXX_DEBUG_PEDANTIC '
 
+PROFILE_FLAGS = {
+    'perf': '-g -fno-omit-frame-pointer ',
+    'gprof': '-g -pg -fno-omit-frame-pointer ',
+}
+
 CPP = Language(
     name='C++',
     suffixes=('cpp', 'cxx', 'cc', 'hpp'),
@@ -28,5 +33,6 @@ CPP = Language(
         '{debug_level} {extra_flags} '
         '{source_path} -o {executable_path} '
     ),
+    profile_flags=PROFILE_FLAGS,
     cf_id=73,
 )
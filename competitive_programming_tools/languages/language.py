@@ -1,6 +1,7 @@
+import shlex
 from functools import partial
 
-from typing import Protocol, Sequence
+from typing import Mapping, Optional, Protocol, Sequence
 
 
 class CompileCommandGen(Protocol):
@@ -14,20 +15,31 @@ class Language:
                  debug_levels: Sequence[str],
                  compile_format: str,
                  cf_id: int,
-                 directly_runnable: bool = False):
+                 directly_runnable: bool = False,
+                 profile_flags: Optional[Mapping[str, str]] = None):
         self.name = name
         self.suffixes = suffixes
         self.debug_levels = debug_levels
         self.compile_format = compile_format
         self.cf_id = cf_id
         self.directly_runnable = directly_runnable
+        self.profile_flags = profile_flags or {}
 
     def get_compile_command_gen(self, *,
                                 debug_level: int,
                                 extra_flags: str) -> CompileCommandGen:
-        return partial(
+        format_command = partial(
             self.compile_format.format,
             debug_level=self.debug_levels[debug_level],
             debug_level_id=debug_level,
             extra_flags=extra_flags,
         )
+
+        # The commands are split like by a shell, so the
+        # paths are quoted, in case they contain spaces.
+        def command_gen(*, source_path: str, executable_path: str) -> str:
+            return format_command(
+                source_path=shlex.quote(source_path),
+                executable_path=shlex.quote(executable_path),
+            )
+        return command_gen
@@ -14,4 +14,5 @@ PY = Language(
     compile_format='{debug_level} {source_path}',
     cf_id=70,
     directly_runnable=True,
+    profile_flags={'cProfile': ''},
 )
@@ -12,6 +12,10 @@ DEBUG_MODE = (
     ''  # TODO
 )
 
+PROFILE_FLAGS = {
+    'perf': '-g -C force-frame-pointers=yes ',
+}
+
 RS = Language(
     name='Rust',
     suffixes=('rs',),
@@ -26,5 +30,6 @@ RS = Language(
         '{debug_level} {extra_flags} '
         '{source_path} -o {executable_path} '
     ),
+    profile_flags=PROFILE_FLAGS,
     cf_id=75,
 )
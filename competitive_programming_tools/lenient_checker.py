@@ -1,6 +1,7 @@
 '''
-Provides :py:class:`LenientChecker`
+Provides :py:class:`LenientChecker` and :py:class:`StreamingChecker`.
 '''
+import os
 import re
 
 ACCEPTABLE_PRECISION_ERROR = 1e-3
@@ -27,12 +28,36 @@ class LenientChecker:
             return func
         return dec
 
-    def __init__(self, participant_answer, judge_answer):
-        import re
+    @classmethod
+    def compile_patterns(cls):
+        '''
+        Compile the regular expressions used
+        for checking, if not done already.
+        '''
         if LenientChecker.CHECK_FLOAT_FORMAT is None:
             LenientChecker.CHECK_FLOAT_FORMAT = re.compile(r'^\d+\.\d+$')
             LenientChecker.WHITESPACE_CHUNK = re.compile(r'(\s+)')
 
+    @classmethod
+    def tokens_match(cls, p_token, j_token, ignored_properties, warnings):
+        '''
+        Check if two tokens are equal,
+        possibly after ignoring some property,
+        which is then added to `ignored_properties`.
+        '''
+        if p_token == j_token:
+            return True
+
+        for name, check in cls.IGNORE_PROPERTY.items():
+            if check(p_token, j_token, warnings):
+                ignored_properties.add(name)
+                return True
+
+        return False
+
+    def __init__(self, participant_answer, judge_answer):
+        LenientChecker.compile_patterns()
+
         self.accept = False
         self.ignored_properties = set()
         self.warnings = dict()
@@ -49,19 +74,286 @@ class LenientChecker:
             return
 
         for p_token, j_token in zip(p_tokens, j_tokens):
-            if p_token == j_token:
-                continue
-
-            for name, check in self.IGNORE_PROPERTY.items():
-                if check(p_token, j_token, self.warnings):
-                    self.ignored_properties.add(name)
-                    break
-            else:
+            if not self.tokens_match(p_token, j_token,
+                                     self.ignored_properties, self.warnings):
                 return
 
         self.accept = True
 
 
+TOKEN = re.compile(r'\s+|\S+')
+
+
+class _Tokenizer:
+    '''
+    Splits text fed in chunks into the same tokens as
+    ``LenientChecker.WHITESPACE_CHUNK.split`` would split the whole text:
+    words and whitespace alternating, starting and ending with
+    a word, which is empty if the text starts or ends with whitespace.
+    '''
+
+    def __init__(self):
+        self.carry = ''
+        self.expect_word = True
+
+    def _alternate(self, tokens):
+        # The tokens found by TOKEN already alternate,
+        # so only the ends need to be looked at.
+        if tokens:
+            if self.expect_word and tokens[0][0].isspace():
+                tokens.insert(0, '')
+            self.expect_word = tokens[-1][0].isspace()
+        return tokens
+
+    def feed(self, text):
+        '''
+        Tokenize the next chunk of text, and return the tokens
+        that can not be continued by later chunks.
+        '''
+        tokens = TOKEN.findall(self.carry + text)
+        self.carry = tokens.pop() if tokens else ''
+        return self._alternate(tokens)
+
+    def finish(self):
+        '''
+        Return the remaining tokens after the last chunk.
+        '''
+        res = self._alternate([self.carry] if self.carry else [])
+        self.carry = ''
+        if self.expect_word:
+            res.append('')
+        return res
+
+
+class _Stripper:
+    '''
+    Turns tokens from :py:class:`_Tokenizer`
+    into the tokens of the stripped text.
+    '''
+
+    def __init__(self):
+        self.pending_whitespace = None
+        self.has_word = False
+
+    def push(self, tokens):
+        '''
+        Return the stripped tokens known after seeing `tokens`.
+        '''
+        # Empty words only appear first and last.
+        if tokens and not tokens[0]:
+            tokens = tokens[1:]
+        if tokens and not tokens[-1]:
+            tokens = tokens[:-1]
+        if not tokens:
+            return tokens
+
+        if not self.has_word and tokens[0][0].isspace():
+            tokens = tokens[1:]
+        elif self.pending_whitespace is not None and not tokens[0][0].isspace():
+            tokens = [self.pending_whitespace, *tokens]
+        self.pending_whitespace = None
+
+        if tokens and tokens[-1][0].isspace():
+            self.pending_whitespace = tokens.pop()
+        if tokens:
+            self.has_word = True
+        return tokens
+
+    def finish(self):
+        '''
+        Return the remaining stripped tokens after the last token.
+        '''
+        return [] if self.has_word else ['']
+
+
+def _file_tokens(path):
+    '''
+    Generate lists of the tokens of a text file,
+    reading it in chunks through mmap.
+    Newlines are translated like when opening the file in text mode.
+    '''
+    import codecs
+    import io
+    import mmap
+
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder('utf-8')(errors='replace'),
+        translate=True,
+    )
+    tokenizer = _Tokenizer()
+
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for begin in range(0, size, StreamingChecker.CHUNK_SIZE):
+                    chunk = mapped[begin:begin+StreamingChecker.CHUNK_SIZE]
+                    yield tokenizer.feed(decoder.decode(chunk))
+        yield tokenizer.feed(decoder.decode(b'', final=True))
+        yield tokenizer.finish()
+
+
+def _stripped_tokens(token_lists):
+    '''
+    Generate lists of the tokens of the stripped text,
+    from lists of tokens generated by :py:func:`_file_tokens`.
+    '''
+    stripper = _Stripper()
+    for tokens in token_lists:
+        yield stripper.push(tokens)
+    yield stripper.finish()
+
+
+class _Comparison:
+    '''
+    Compares lists of tokens pushed one at a time
+    with the tokens from the lists generated by `judge_tokens`.
+    '''
+
+    def __init__(self, judge_tokens):
+        self.judge_tokens = judge_tokens
+        self.buffer = []
+        self.ignored_properties = set()
+        self.warnings = dict()
+        self.matches = True
+        self.too_long = False
+
+    @property
+    def failed(self):
+        '''
+        Whether the participant tokens can not be accepted anymore.
+        '''
+        return not self.matches or self.too_long
+
+    def _take(self, count):
+        while len(self.buffer) < count:
+            tokens = next(self.judge_tokens, None)
+            if tokens is None:
+                break
+            self.buffer += tokens
+        res = self.buffer[:count]
+        del self.buffer[:count]
+        return res
+
+    def push(self, p_tokens):
+        '''
+        Compare the next participant tokens to the next judge tokens.
+        '''
+        if self.too_long:
+            return
+        j_tokens = self._take(len(p_tokens))
+        if len(j_tokens) < len(p_tokens):
+            self.too_long = True
+            return
+        if not self.matches or p_tokens == j_tokens:
+            return
+        for p_token, j_token in zip(p_tokens, j_tokens):
+            if not LenientChecker.tokens_match(
+                    p_token, j_token, self.ignored_properties, self.warnings):
+                self.matches = False
+                return
+
+    def same_length(self):
+        '''
+        Check if there are as many participant tokens
+        as judge tokens, after the last token was pushed.
+        '''
+        return not self.too_long and not self._take(1)
+
+
+class StreamingChecker:
+    '''
+    Class for checking whether output approximately
+    matches an answer file, like :py:class:`LenientChecker`,
+    but reading both a chunk at a time, so memory usage
+    does not grow with the size of the output.
+
+    Give the output to :py:meth:`feed` as it is produced,
+    then call :py:meth:`finish`, after which `accept`,
+    `ignored_properties` and `warnings` are set
+    like for :py:class:`LenientChecker`.
+
+    `killed` is set by whoever runs the program
+    if it was killed because the output was rejected.
+    '''
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, judge_answer_path):
+        import codecs
+        import itertools
+        LenientChecker.compile_patterns()
+
+        self.accept = False
+        self.ignored_properties = set()
+        self.warnings = dict()
+        self.rejected = False
+        self.killed = False
+
+        self.pending = []
+        self.pending_size = 0
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.tokenizer = _Tokenizer()
+        self.stripper = _Stripper()
+
+        # LenientChecker compares the tokens of the texts as they are
+        # if there are equally many, and otherwise the tokens of the
+        # stripped texts, so both comparisons are done at the same time.
+        exact_tokens, tokens_to_strip = itertools.tee(_file_tokens(judge_answer_path))
+        self.exact = _Comparison(exact_tokens)
+        self.stripped = _Comparison(_stripped_tokens(tokens_to_strip))
+
+    def _push(self, tokens):
+        self.exact.push(tokens)
+        self.stripped.push(self.stripper.push(tokens))
+        self.rejected = self.exact.failed and self.stripped.failed
+
+    def _flush(self, final=False):
+        text = self.decoder.decode(b''.join(self.pending), final=final)
+        self.pending = []
+        self.pending_size = 0
+        self._push(self.tokenizer.feed(text))
+
+    def feed(self, data):
+        '''
+        Check the next chunk of output bytes.
+        Small chunks are collected and checked together.
+
+        Returns False if the output can not be accepted
+        no matter what comes after, in which case
+        the rest of the output does not need to be fed.
+        '''
+        if not self.rejected:
+            self.pending.append(data)
+            self.pending_size += len(data)
+            if self.pending_size >= self.CHUNK_SIZE:
+                self._flush()
+        return not self.rejected
+
+    def finish(self):
+        '''
+        Check the end of the output and set the result.
+        '''
+        if self.rejected:
+            return self
+
+        self._flush(final=True)
+        self._push(self.tokenizer.finish())
+        self.stripped.push(self.stripper.finish())
+
+        if self.exact.same_length():
+            result = self.exact
+        else:
+            self.ignored_properties.add('whitespace')
+            result = self.stripped
+            if not result.same_length():
+                return self
+
+        self.ignored_properties |= result.ignored_properties
+        self.warnings = result.warnings
+        self.accept = result.matches
+        return self
+
+
 @LenientChecker.register_ignore('whitespace')
 def ignore_whitespace(p_token, j_token, _):
     '''
@@ -90,7 +382,10 @@ def ignore_precision(p_token, j_token, warnings):
         return False
 
     p_val = float(p_token)
-    j_val = float(j_token)
+    try:
+        j_val = float(j_token)
+    except ValueError:
+        return False
 
     error = abs(p_val-j_val) / max(1, j_val)
     if error > ACCEPTABLE_PRECISION_ERROR:
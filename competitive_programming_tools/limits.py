@@ -0,0 +1,105 @@
+'''
+Provides :py:class:`Limits`, and functions for
+saving and loading the limits of a problem.
+'''
+from typing import NamedTuple, Optional
+
+
+class Limits(NamedTuple):
+    '''
+    Time and memory limits for running a solution.
+    '''
+    time: Optional[float] = None
+    '''Seconds of cpu time.'''
+    memory: Optional[int] = None
+    '''Bytes of peak resident memory.'''
+
+    @property
+    def wall_time(self):
+        '''
+        Seconds of wall time after which the
+        solution is killed, or None if there is no time limit.
+        Generous, so that a solution waiting on something
+        is caught, without killing slow but valid runs.
+        '''
+        if self.time is None:
+            return None
+        return 2 * self.time + 1
+
+    def exceeded(self, usage):
+        '''
+        Get the verdict ('MLE' or 'TLE') for a run
+        with the given :py:class:`Usage`,
+        or None if it was within the limits.
+        '''
+        if self.memory is not None and (usage.killed == 'MLE' or usage.max_rss > self.memory):
+            return 'MLE'
+        if self.time is not None and (
+                usage.killed == 'TLE' or
+                usage.cpu_time > self.time or
+                usage.wall_time >= self.wall_time):
+            return 'TLE'
+        return None
+
+
+def limits_path(testset):
+    '''
+    Get the path of the file storing the limits
+    for the tests matching `testset`.
+    '''
+    return f'{testset}.json'
+
+
+def save_limits(testset, time_limit_ms, memory_limit_mb):
+    '''
+    Store the limits for the tests matching `testset`,
+    in the format used by Competitive Companion.
+    '''
+    import json
+    with open(limits_path(testset), 'w', encoding='utf-8') as file:
+        json.dump({
+            'timeLimit': time_limit_ms,
+            'memoryLimit': memory_limit_mb,
+        }, file)
+
+
+def load_limits(testsets, time_limit_ms, memory_limit_mb):
+    '''
+    Get the :py:class:`Limits` from the given
+    command line values (in ms and MB), falling back to
+    the first limits stored for one of the `testsets`.
+    '''
+    import json
+    import os
+
+    stored = {}
+    for testset in testsets:
+        if testset is None or not os.path.isfile(limits_path(testset)):
+            continue
+        with open(limits_path(testset), encoding='utf-8') as file:
+            stored = json.load(file)
+        break
+
+    if time_limit_ms is None:
+        time_limit_ms = stored.get('timeLimit')
+    if memory_limit_mb is None:
+        memory_limit_mb = stored.get('memoryLimit')
+
+    return Limits(
+        time=None if time_limit_ms is None else time_limit_ms / 1000,
+        memory=None if memory_limit_mb is None else memory_limit_mb * 1024**2,
+    )
+
+
+def default_testset(source):
+    '''
+    Get the default testset of a source file,
+    'samples/{source_filename_without_suffix}'
+    in the directory of the source.
+    '''
+    import os
+    return os.path.join(
+        os.path.dirname(source),
+        'samples',
+        '.'.join(os.path.basename(source).split('.')[:-1])
+    )
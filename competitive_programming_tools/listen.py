@@ -54,10 +54,11 @@ class ProblemLoader:
         Given information about a problem,
         create a file containing boilerplate
         for a solution file, and save sample
-        test input and output.
+        test input and output, and the limits.
         '''
         from datetime import datetime
         import os
+        from .limits import save_limits
         from .utils import ensure_dir, error, warn
 
         if 'CPT_USERNAME' in os.environ:
@@ -76,9 +77,16 @@ class ProblemLoader:
 
         filename = format_name(data['name'])
 
+        sample_dir = os.path.join(self.contest_directory, 'samples')
+        ensure_dir(sample_dir)
+
+        save_limits(
+            os.path.join(sample_dir, filename),
+            data['timeLimit'],
+            data['memoryLimit'],
+        )
+
         if data['tests']:
-            sample_dir = os.path.join(self.contest_directory, 'samples')
-            ensure_dir(sample_dir)
 
             for i, sample in enumerate(data['tests']):
                 in_path = os.path.join(
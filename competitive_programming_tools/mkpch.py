@@ -1,37 +1,268 @@
+'''
+Provides :py:func:`mkpch`, and the functions
+letting builds use the precompiled headers.
+'''
+
 import os
-import shutil
 
 import click
-from requests import head
 
 from .utils import TMP_DIR, ensure_dir
-from .get_executable import get_executable
 from .languages import CPP
 
+PCH_DIR = os.path.join(TMP_DIR, 'include')
+'''Where the precompiled headers are, as `<header>.gch/<debug level>.gch`.'''
+
+
+def pch_dirname(header):
+    '''Get the directory of the precompiled variants of a header.'''
+    return os.path.join(PCH_DIR, f'{header}.gch')
+
+
+def metadata_path(header):
+    '''
+    Get the path of the file describing how each variant of a
+    header was built (not in its directory, where the compiler
+    would try to use it as a precompiled header).
+    '''
+    return f'{pch_dirname(header)}.json'
+
+
+def failures_path(header):
+    '''
+    Get the path of the file listing the compilers
+    that failed to precompile a header.
+    '''
+    return f'{pch_dirname(header)}.failed.json'
+
+
+def failed_compilers(header):
+    '''Get the compilers that failed to precompile a header.'''
+    import json
+    try:
+        with open(failures_path(header), encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return []
+
+
+def pch_identity(debug_level):
+    '''
+    Get what a precompiled header for `debug_level`
+    depends on, besides the header: the flags and the compiler.
+    '''
+    from .get_executable import compiler_identity
+    from .spawn import split_command
+
+    command = CPP.get_compile_command_gen(
+        debug_level=debug_level,
+        extra_flags='',
+    )(source_path='{source}', executable_path='{executable}')
+    return {
+        'command': command,
+        'compiler': compiler_identity(split_command(command)[0]),
+    }
+
+
+def included_headers(source_path):
+    '''
+    Get the headers included with `<...>` by
+    the source or the local headers it includes.
+    '''
+    from .expand import include_matcher, included_paths
+
+    headers = set()
+    for path in (source_path, *included_paths(source_path)):
+        try:
+            with open(path, encoding='utf-8') as file:
+                lines = list(file)
+        except (OSError, UnicodeDecodeError):
+            continue
+        for line in lines:
+            match = include_matcher.match(line.strip())
+            if match and match.group(1) == '<':
+                headers.add(match.group(2))
+    return headers
+
+
+def is_locked(header):
+    '''Get whether a header is being precompiled.'''
+    import fcntl
+    fd = os.open(f'{pch_dirname(header)}.lock', os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def rebuild_in_background(header):
+    '''
+    Start rebuilding the precompiled variants of a header
+    in a detached process, unless one is already doing it
+    (which the process checks again, holding the lock).
+    '''
+    import subprocess
+    import sys
+
+    if is_locked(header):
+        return
+
+    subprocess.Popen(
+        [sys.executable, '-c', f'from {__package__} import main; main()',
+         'mkpch', '--background', header],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def pch_flags(source_path, debug_level):
+    '''
+    Get the flags letting the compiler use the precompiled
+    variants of the headers the source includes, if there are
+    any. Those built with other flags or by another compiler are
+    rebuilt in the background, the compiler ignores them meanwhile,
+    unless rebuilding them failed before with the same compiler.
+    '''
+    import json
+    import shlex
+
+    headers = [
+        header for header in sorted(included_headers(source_path))
+        if os.path.isdir(pch_dirname(header))
+    ]
+    if not headers:
+        return ''
+
+    identity = pch_identity(debug_level)
+    for header in headers:
+        try:
+            with open(metadata_path(header), encoding='utf-8') as file:
+                metadata = json.load(file)
+        except (OSError, ValueError):
+            metadata = {}
+        if (metadata.get(str(debug_level)) != identity and
+                identity['compiler'] not in failed_compilers(header)):
+            rebuild_in_background(header)
+
+    return f'-I {shlex.quote(PCH_DIR)}'
+
+
+async def compile_pch(header, debug_level, header_holder_path, path, semaphore):
+    '''
+    Compile the variant of a header for `debug_level` to `path`,
+    while holding `semaphore`. It does not go through the
+    build cache, which would keep a second copy of it.
+    '''
+    from .get_executable import CompileError
+    from .spawn import run_command, split_command
+
+    command = CPP.get_compile_command_gen(debug_level=debug_level, extra_flags='')
+    partial_path = os.path.join(TMP_DIR, f'pch-{os.getpid()}-{debug_level}.partial')
+    async with semaphore:
+        exit_code, output = await run_command(split_command(
+            command(source_path=header_holder_path, executable_path=partial_path)), True)
+
+    click.echo(
+        f'Compiling {click.style(repr(header), fg="yellow")} -d {debug_level} ... ',
+        err=True, nl=False
+    )
+    if output:
+        click.echo(err=True)
+        click.echo(output.decode(errors='replace'), err=True, nl=False)
+    if exit_code:
+        click.echo(err=True)
+        raise CompileError(exit_code)
+    os.replace(partial_path, path)
+    click.secho('done!', fg='green', err=True)
+
+
+async def compile_pchs(header, header_holder_path, paths):
+    '''
+    Compile the variants of a header for each debug level
+    to `paths`, up to one per cpu at once.
+    '''
+    import asyncio
+
+    semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+    # Like get_executables, the others are finished if one fails.
+    results = await asyncio.gather(*(
+        compile_pch(header, debug_level, header_holder_path, path, semaphore)
+        for debug_level, path in enumerate(paths)
+    ), return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+
 @click.argument('header', type=str)
-def mkpch(header):
+@click.option('-bg', '--background', is_flag=True,
+              help=('Do nothing if the header is already being precompiled, '
+                    'instead of waiting to precompile it again.'))
+def mkpch(header, background):
     '''
     Create precompiled headers for each debug level.
+
+    They are used by the builds including the header from then on.
+    If precompiling fails, builds do not start precompiling
+    it again until the compiler changes, or mkpch succeeds.
     '''
+    import asyncio
+    import fcntl
+    import json
+    from hashlib import sha1
+    from .get_executable import CompileError
+    from .utils import error
 
-    header_holder_path = os.path.join(TMP_DIR, 'header_holder.hpp')
-    with open(header_holder_path, 'w', encoding='UTF-8') as header_holder:
-        header_holder.write(f'#include <{header}>')
+    dirname = pch_dirname(header)
+    ensure_dir(dirname)
 
-    pch_dir = os.path.join(TMP_DIR, 'include')
+    lock_fd = os.open(f'{dirname}.lock', os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+    try:
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | (fcntl.LOCK_NB if background else 0))
+        except BlockingIOError:
+            return
 
-    for debug_level in range(len(CPP.debug_levels)):
-        dirname = os.path.join(pch_dir, f'{header}.gch')
-        ensure_dir(dirname)
+        header_holder_path = os.path.join(
+            TMP_DIR,
+            f'header_holder_{sha1(header.encode()).hexdigest()[:16]}.hpp',
+        )
+        with open(header_holder_path, 'w', encoding='UTF-8') as header_holder:
+            header_holder.write(f'#include <{header}>')
 
-        path = os.path.join(dirname, f'{debug_level}.gch')
-        if os.path.exists(path):
-            os.remove(path)
+        debug_levels = range(len(CPP.debug_levels))
+        paths = [
+            os.path.join(dirname, f'{debug_level}.gch')
+            for debug_level in debug_levels
+        ]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
 
-        pch_path = get_executable(
-            source_path=header_holder_path,
-            debug_level=debug_level,
-            extra_flags='',
-            force_recompile=True,
-        )
-        shutil.move(pch_path, path)
+        def write_json(path, data):
+            partial_path = f'{path}.{os.getpid()}.partial'
+            with open(partial_path, 'w', encoding='utf-8') as file:
+                json.dump(data, file)
+            os.replace(partial_path, path)
+
+        compiler = pch_identity(0)['compiler']
+        failed = [identity for identity in failed_compilers(header) if identity != compiler]
+        try:
+            asyncio.run(compile_pchs(header, header_holder_path, paths))
+        except CompileError:
+            write_json(failures_path(header), [*failed, compiler])
+            error('failed compiling.')
+            return
+        write_json(failures_path(header), failed)
+
+        write_json(metadata_path(header), {
+            str(debug_level): pch_identity(debug_level)
+            for debug_level in debug_levels
+        })
+    finally:
+        os.close(lock_fd)
@@ -0,0 +1,250 @@
+'''
+Provides :py:func:`profile_tests`, for finding
+where a solution spends its time.
+'''
+
+import os
+import re
+
+import click
+
+PERF_ROW = re.compile(r'^\s*[\d.]+%\s+(\d+)\s+(?:\[.\]\s+)?(.*?)\s*$')
+GPROF_ROW = re.compile(
+    r'^\s*[\d.]+\s+[\d.]+\s+([\d.]+)\s+(?:\d+\s+[\d.]+\s+[\d.]+\s+)?(.*?)\s*$')
+
+
+def choose_profiler(lang):
+    '''
+    Get the name of the best profiler available for
+    the language, or None if there is none.
+    '''
+    import shutil
+    import subprocess
+
+    for name in lang.profile_flags:
+        if name == 'perf' and shutil.which('perf'):
+            # Recording is often not permitted, even if perf is installed.
+            probe = subprocess.run(
+                ['perf', 'record', '-q', '-o', os.devnull, '--', 'true'],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+            if probe.returncode == 0:
+                return name
+        elif name == 'gprof' and shutil.which('gprof'):
+            return name
+        elif name == 'cProfile':
+            return name
+    return None
+
+
+def profiled_command(profiler, executable, output_path):
+    '''
+    Get the command running `executable`
+    under `profiler`, writing to `output_path`.
+    '''
+    import shlex
+    from .spawn import split_command
+
+    argv = split_command(executable)
+    if profiler == 'perf':
+        argv = ['perf', 'record', '-q', '-g', '-F', '4000', '-o', output_path, '--', *argv]
+    elif profiler == 'gprof':
+        # The profile is written to `output_path`.{pid} on exit.
+        argv = ['env', f'GMON_OUT_PREFIX={output_path}', *argv]
+    elif profiler == 'cProfile':
+        argv = [argv[0], '-m', 'cProfile', '-o', output_path, *argv[1:]]
+    return shlex.join(argv)
+
+
+def parse_rows(pattern, text, weight_type):
+    '''Sum the weights of the rows of a flat profile by name.'''
+    from collections import Counter
+    weights = Counter()
+    for line in text.splitlines():
+        match = pattern.match(line)
+        if match is not None and match[2]:
+            weights[match[2]] += weight_type(match[1])
+    return weights
+
+
+def perf_report(data_paths, sort_key):
+    '''
+    Sum the samples of perf recordings by `sort_key`
+    ('symbol' or 'srcline').
+    '''
+    import subprocess
+    from collections import Counter
+    weights = Counter()
+    for data_path in data_paths:
+        report = subprocess.run(
+            ['perf', 'report', '-i', data_path, '--stdio', '--no-children',
+             '-n', '--sort', sort_key],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False)
+        weights += parse_rows(PERF_ROW, report.stdout.decode(errors='replace'), int)
+    return weights
+
+
+def gprof_report(executable, gmon_paths):
+    '''
+    Sum the seconds spent in each function
+    over gprof profiles of `executable`.
+    '''
+    import subprocess
+    report = subprocess.run(
+        ['gprof', '-b', '-p', executable, *gmon_paths],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False)
+    return parse_rows(GPROF_ROW, report.stdout.decode(errors='replace'), float)
+
+
+def gmon_histogram(gmon_path):
+    '''
+    Read the pc histogram of a gmon.out file,
+    as (address, seconds) pairs of the nonempty bins.
+    '''
+    import struct
+    with open(gmon_path, 'rb') as file:
+        data = file.read()
+    if data[:4] != b'gmon':
+        return
+    offset = 20
+    # Records are a tag byte followed by: 0, a histogram;
+    # 1, an arc of the call graph; 2, basic block counts.
+    while offset < len(data):
+        tag = data[offset]
+        offset += 1
+        if tag == 0:
+            low_pc, high_pc, size, rate = struct.unpack_from('=QQII', data, offset)
+            offset += 24 + 16
+            bins = struct.unpack_from(f'={size}H', data, offset)
+            offset += 2 * size
+            for index, count in enumerate(bins):
+                if count:
+                    yield low_pc + index * (high_pc - low_pc) // size, count / rate
+        elif tag == 1:
+            offset += 20
+        else:
+            return
+
+
+def gprof_lines(executable, gmon_paths):
+    '''
+    Sum the seconds spent on each line over gprof profiles
+    of `executable`, from their histograms, since
+    `gprof -l` fails on many executables.
+    '''
+    import subprocess
+    from collections import Counter
+    seconds = Counter()
+    for gmon_path in gmon_paths:
+        for address, time in gmon_histogram(gmon_path):
+            seconds[address] += time
+    if not seconds:
+        return Counter()
+    addresses = list(seconds)
+    lines = subprocess.run(
+        ['addr2line', '-e', executable, *map(hex, addresses)],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=False,
+    ).stdout.decode(errors='replace').splitlines()
+    weights = Counter()
+    for address, line in zip(addresses, lines):
+        weights[line.split(' (')[0]] += seconds[address]
+    return weights
+
+
+def cprofile_report(stats_paths):
+    '''Sum the seconds spent in each function over cProfile profiles.'''
+    import pstats
+    from collections import Counter
+    weights = Counter()
+    stats = pstats.Stats(*stats_paths)
+    for (filename, line, function), (_, _, total, _, _) in stats.stats.items():
+        if filename == '~':
+            weights[function] += total
+        else:
+            weights[f'{function} ({os.path.basename(filename)}:{line})'] += total
+    return weights
+
+
+def show_table(title, weights, unit, top):
+    '''Show the `top` heaviest entries of `weights`.'''
+    total = sum(weights.values())
+    click.secho(f'\n{title}:', bold=True)
+    if not total:
+        click.echo('  (no samples)')
+        return
+    for name, weight in weights.most_common(top):
+        click.echo(''.join((
+            f'  {100 * weight / total:6.2f}%',
+            f' {weight:>10.2f} {unit}' if isinstance(weight, float) else f' {weight:>10} {unit}',
+            '  ',
+            click.style(name, fg='yellow'),
+        )))
+
+
+def profile_tests(source, argv, debug_level, extra_flags, force_recompile,
+                  test_dir, test_names, top):
+    '''
+    Run the tests with `source` built for profiling and
+    under a sampling profiler, and show the functions and
+    lines taking the most time over all of the tests.
+    '''
+    import glob
+    import shutil
+    from .execute import OutputCapture, execute
+    from .get_executable import CompileError, get_executable
+    from .languages import SUFF_TO_LANG
+    from .run import format_usage, test_paths
+    from .utils import TMP_DIR, ensure_dir, error, warn
+
+    lang = SUFF_TO_LANG.get(source.rsplit('.', 1)[-1])
+    profiler = None if lang is None else choose_profiler(lang)
+    if profiler is None:
+        error('no profiler available for this language (install perf or gprof).')
+        return
+
+    try:
+        executable = get_executable(
+            source_path=source,
+            debug_level=debug_level,
+            extra_flags=f'{lang.profile_flags[profiler]}{extra_flags}',
+            force_recompile=force_recompile,
+        )
+    except CompileError:
+        error('failed compiling.')
+        return
+
+    profile_dir = os.path.join(TMP_DIR, 'profile')
+    shutil.rmtree(profile_dir, ignore_errors=True)
+    ensure_dir(profile_dir)
+
+    for test_name in test_names:
+        click.secho(
+            f'Profiling test {click.style(repr(test_name), fg="yellow")} with {profiler} ...',
+            err=True)
+        input_path, _ = test_paths(test_dir, test_name)
+        with open(input_path, encoding='utf-8') as file:
+            returncode, usage = execute(
+                profiled_command(profiler, executable,
+                                 os.path.join(profile_dir, f'{test_name}.prof')),
+                argv, file, OutputCapture())
+        click.secho(format_usage(usage), fg='blue', err=True)
+        if returncode:
+            warn(f'{test_name!r} exited with {returncode}, its profile may be missing.')
+
+    profiles = sorted(glob.glob(os.path.join(profile_dir, '*.prof*')))
+    if not profiles:
+        error('no profiles were written.')
+        return
+
+    if profiler == 'perf':
+        show_table('Hot functions', perf_report(profiles, 'symbol'), 'samples', top)
+        show_table('Hot lines', perf_report(profiles, 'srcline'), 'samples', top)
+    elif profiler == 'gprof':
+        show_table('Hot functions', gprof_report(executable, profiles), 's', top)
+        show_table('Hot lines', gprof_lines(executable, profiles), 's', top)
+    else:
+        try:
+            weights = cprofile_report(profiles)
+        except (ValueError, TypeError, EOFError):
+            error('could not read the profiles (written by an incompatible python?).')
+            return
+        show_table('Hot functions', weights, 's', top)
@@ -0,0 +1,82 @@
+'''
+Provides :py:class:`ReferenceCache`, which remembers the outputs
+of reference solutions so they are not run again on the same input.
+'''
+
+import os
+
+from .utils import TMP_DIR
+
+CACHE_DIR = os.path.join(TMP_DIR, 'references')
+MAX_SIZE = 1 << 26
+'''Bytes the cache may use, the least recently used entries are evicted.'''
+
+
+class ReferenceCache:
+    '''
+    Outputs and exit codes of one reference
+    executable (talking with an interactor, if any),
+    keyed by their hashes and the hash of the input.
+
+    Counts the lookups and hits, for showing the hit rate.
+    '''
+
+    def __init__(self, executable, interactor=None):
+        import hashlib
+        import json
+        from .verdict_cache import command_digest
+        self.prefix = hashlib.sha256(json.dumps([
+            command_digest(executable),
+            None if interactor is None else command_digest(interactor),
+        ]).encode()).hexdigest()
+        self.lookups = 0
+        self.hits = 0
+
+    def key(self, input_digest):
+        '''Get the key of the input with the given hash.'''
+        import hashlib
+        return hashlib.sha256(f'{self.prefix} {input_digest}'.encode()).hexdigest()
+
+    def get(self, key):
+        '''
+        Get the output and exit code stored
+        for `key`, or None if there is none.
+        '''
+        path = os.path.join(CACHE_DIR, f'{key}.out')
+        self.lookups += 1
+        try:
+            with open(path, 'rb') as file:
+                exit_code = int(file.readline())
+                output = file.read()
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        self.hits += 1
+        return output, exit_code
+
+    @staticmethod
+    def put(key, output, exit_code):
+        '''Store the output and exit code for `key`.'''
+        from .utils import ensure_dir
+        ensure_dir(CACHE_DIR)
+        path = os.path.join(CACHE_DIR, f'{key}.out')
+        partial_path = f'{path}.{os.getpid()}.partial'
+        with open(partial_path, 'wb') as file:
+            file.write(b'%d\n' % exit_code)
+            file.write(output)
+        os.replace(partial_path, path)
+
+    def hit_rate(self):
+        '''Format the share of lookups that were hits.'''
+        if not self.lookups:
+            return 'ref cache -'
+        return f'ref cache {100 * self.hits / self.lookups:.0f}%'
+
+
+def evict(max_size=MAX_SIZE):
+    '''
+    Remove the least recently used cached outputs
+    until they take at most `max_size` bytes.
+    '''
+    from . import verdict_cache
+    verdict_cache.evict(max_size, CACHE_DIR, '.out')
@@ -4,17 +4,58 @@ import click
 from .auto_path import AutoPath
 
 
-def run_interactive(executable, interactor, argv, input_path, test_name):
+def format_count(count):
+    '''Format a large count with a metric prefix, like 1.23G.'''
+    for prefix, size in (('G', 10**9), ('M', 10**6), ('k', 10**3)):
+        if count >= size:
+            return f'{count / size:.2f}{prefix}'
+    return str(count)
+
+
+def format_usage(usage):
+    '''
+    Format the wall time, cpu time and peak memory
+    of a :py:class:`Usage` for printing,
+    and the hardware event counts if there are any.
+    '''
+    return ', '.join((
+        f'{round(usage.wall_time * 1000)} ms wall',
+        f'{round(usage.cpu_time * 1000)} ms cpu',
+        f'{usage.max_rss / 1024**2:.1f} MB',
+        *(
+            f'{format_count(count)} {name}'
+            for name, count in (usage.counters or {}).items()
+        ),
+    ))
+
+
+def warn_no_counters(usages):
+    '''
+    Warn if hardware events were counted for none of the runs
+    with the given :py:class:`Usage`.
+    '''
+    from .utils import warn
+    if not any(usage.counters for usage in usages):
+        warn('no hardware events could be counted, perf events are not '
+             'available (see /proc/sys/kernel/perf_event_paranoid).')
+
+
+def run_interactive(executable, interactor, argv, input_path, test_name, limits=None):
     '''
     Run two processes communicating with each other
     through stdin and stdout, and check that
-    the return code of both is 0, and print
-    information about the execution.
+    the return code of both is 0,
+    and that `executable` is within the `limits`,
+    and print information about the execution.
 
-    Returns a verdict string and the number of seconds spent.
+    Returns a verdict string and the :py:class:`Usage` of `executable`.
     '''
     from .execute import execute_interactive
-    from .utils import error, time_func
+    from .limits import Limits
+    from .utils import error
+
+    if limits is None:
+        limits = Limits()
 
     if input_path is None:
         input_data = ''
@@ -22,24 +63,25 @@ def run_interactive(executable, interactor, argv, input_path, test_name):
         with open(input_path, 'r', encoding='utf-8') as file:
             input_data = ''.join(file)
 
-    time_used, exit_codes = time_func(
-        lambda: execute_interactive(
-            executable,
-            interactor,
-            argv,
-            [f'{line}\n'
-             for line in input_data.split('\n')[:-1]],
-        )
+    executable_exit_code, interactor_exit_code, usage = execute_interactive(
+        executable,
+        interactor,
+        argv,
+        [f'{line}\n'
+         for line in input_data.split('\n')[:-1]],
+        limits,
     )
 
-    interactor_exit_code, executable_exit_code = exit_codes
+    limit_verdict = limits.exceeded(usage)
 
     fail = (
         interactor_exit_code != 0 or
         executable_exit_code != 0
     )
 
-    if fail:
+    if limit_verdict is not None:
+        verdict_str = click.style(limit_verdict, fg='red')
+    elif fail:
         verdict_str = click.style('RE', fg='red')
     else:
         verdict_str = click.style('AC', fg='green')
@@ -49,36 +91,86 @@ def run_interactive(executable, interactor, argv, input_path, test_name):
         click.secho(f'{test_name!r} ', fg='yellow', nl=False, err=True)
     click.echo('with ', nl=False, err=True)
     click.secho(verdict_str, bold=True, err=True)
-    if fail:
+    if fail and limit_verdict is None:
         error(f'crashed ({interactor_exit_code=}, {executable_exit_code=})')
-    click.secho(f'{round(time_used * 1000)} ms',
-                fg='blue', err=True)
+    click.secho(format_usage(usage), fg='blue', err=True)
 
-    return verdict_str, time_used
+    return verdict_str, usage
 
 
 def run_diagnostic(executable, argv, input_file):
     '''
     Run the `executable` with `input_file`
     fed to stdin inside the gnu debugger.
+
+    The output of the debugger is captured and echoed,
+    so it can be buffered together with the rest of
+    the output of a test.
     '''
+    import shlex
     import subprocess
-    proc = subprocess.Popen(
-        ' '.join((
-            f'gdb -batch -ex "{" ".join(("run", *argv))}" -ex "bt"',
-            executable,
-        )),
-        shell=True,
-        stdin=input_file
-    )
-    proc.wait()
+    from .spawn import resolve_program, split_command
+    from .utils import warn
+    try:
+        proc = subprocess.run(
+            [
+                resolve_program('gdb'), '-batch',
+                '-ex', shlex.join(('run', *argv)),
+                '-ex', 'bt',
+                *split_command(executable),
+            ],
+            stdin=input_file,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            check=False,
+        )
+    except FileNotFoundError:
+        warn('gdb was not found, no diagnostic available.')
+        return
+    click.echo(proc.stdout.decode(errors='replace'), nl=False)
+
+
+def find_tests(testset):
+    '''
+    Find the tests matching the pattern `testset`
+    ('some/directory/prefix', see the `--testset` option of `run`).
+
+    Returns the directory of the tests and the sorted test names.
+    '''
+    import os
+
+    test_dir = os.path.dirname(testset) or './'
+    test_prefix = os.path.basename(testset)
+
+    test_names = [
+        path[:-3]
+        for path in sorted(os.listdir(test_dir))
+        if path.startswith(test_prefix) and path.endswith('.in')
+    ]
+    return test_dir, test_names
+
+
+def test_paths(test_dir, test_name):
+    '''
+    Get the paths of the input and answer files of a test.
+    The answer file might not exist.
+    '''
+    import os
+
+    input_path = os.path.join(test_dir, f'{test_name}.in')
+    output_path = os.path.join(test_dir, f'{test_name}.ans')
+    if not os.path.exists(output_path) and os.path.basename(test_dir) == 'in':
+        output_path = os.path.join(os.path.dirname(test_dir), 'out', f'{test_name}.out')
+    return input_path, output_path
 
 
-def run_test(executable, interactor, argv, no_style_stderr, test_dir, test_name):
+def run_test(executable, interactor, argv, no_style_stderr, test_dir, test_name, limits,
+             preview_lines, cache=None, counters=False):
     '''
     Run `executable` with an input
     file and check if the output matches
-    the corresponding ouput file.
+    the corresponding ouput file,
+    and that it stays within the :py:class:`Limits`.
 
     If an interactor is specified,
     run them communicating with each other
@@ -89,17 +181,49 @@ def run_test(executable, interactor, argv, no_style_stderr, test_dir, test_name)
     ignore any output file
     (the interactor should check that the output is correct).
 
-    Returns a verdict string and the number of seconds used.
+    If `preview_lines` is not None, only that many lines from
+    the start and end of the output are shown.
+
+    If a :py:class:`VerdictCache` is given, the verdict of
+    an unchanged test is taken from it instead of running the test.
+    Tests without an answer or an interactor are always run,
+    since their output is all there is to see, and so are
+    tests that exceeded the limits, which may not happen again.
+
+    If `counters` is set, hardware events of `executable` are counted too.
+
+    Returns a verdict string and the :py:class:`Usage` of `executable`.
     '''
     import os
-    from .execute import execute
-    from .lenient_checker import LenientChecker
-    from .utils import warn, time_func
-
-    input_path = os.path.join(test_dir, f'{test_name}.in')
-    output_path = os.path.join(test_dir, f'{test_name}.ans')
-    if not os.path.exists(output_path) and os.path.basename(test_dir) == 'in':
-        output_path = os.path.join(os.path.dirname(test_dir), 'out', f'{test_name}.out')
+    import signal
+    from .execute import OutputEcho, execute
+    from .lenient_checker import StreamingChecker
+    from .utils import warn
+
+    input_path, output_path = test_paths(test_dir, test_name)
+
+    if cache is not None and (interactor is not None or os.path.exists(output_path)):
+        cache_key = cache.key(input_path, output_path)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            verdict_str, usage = cached
+            click.echo(''.join((
+                click.style('Cached ', fg='blue'),
+                click.style(repr(test_name), fg='yellow'),
+                ' with ',
+                verdict_str,
+            )), err=True)
+            click.secho(format_usage(usage), fg='blue', err=True)
+            return verdict_str, usage
+
+        verdict_str, usage = run_test(executable, interactor, argv, no_style_stderr,
+                                      test_dir, test_name, limits, preview_lines,
+                                      counters=counters)
+        # Exceeding the limits may be down to a noisy run,
+        # so it is not kept from being retried.
+        if limits.exceeded(usage) is None:
+            cache.put(cache_key, verdict_str, usage)
+        return verdict_str, usage
 
     click.secho(
         'Running test ' +
@@ -109,28 +233,54 @@ def run_test(executable, interactor, argv, no_style_stderr, test_dir, test_name)
     )
 
     if interactor is not None:
-        verdict_str, time_used = run_interactive(
+        return run_interactive(
             executable,
             interactor,
             argv,
             input_path,
             test_name,
+            limits,
         )
-        return verdict_str, time_used
+
+    checker = (
+        StreamingChecker(output_path)
+        if os.path.exists(output_path)
+        else None
+    )
 
     with open(input_path, encoding='utf-8') as file:
-        time_used, (returncode, output) = time_func(
-            lambda: execute(
-                executable, argv, file,
-                not no_style_stderr
-            )
+        returncode, usage = execute(
+            executable, argv, file,
+            OutputEcho(not no_style_stderr, preview_lines, test_name),
+            limits,
+            checker,
+            counters,
         )
-    click.secho(f'{round(time_used * 1000)} ms',
-                fg='blue', err=True)
+    click.secho(format_usage(usage), fg='blue', err=True)
 
     verdict_str = click.style('??', fg='yellow')
 
-    if returncode:
+    limit_verdict = limits.exceeded(usage)
+    # A program that crashed by itself gets RE even if its output
+    # was already rejected, like when checking it after it exits.
+    killed_by_checker = (
+        checker is not None and checker.killed and
+        returncode == -signal.SIGKILL
+    )
+
+    if limit_verdict is not None:
+        verdict_str = click.style(limit_verdict, fg='red')
+        limit_str = (
+            f'{round(limits.time * 1000)} ms' if limit_verdict == 'TLE'
+            else f'{limits.memory // 1024**2} MB'
+        )
+        click.echo(''.join((
+            click.style('Finished ', fg='red'),
+            click.style(repr(test_name), fg='yellow'),
+            click.style(f' with {limit_verdict} (limit {limit_str})', fg='red'),
+        )), err=True)
+
+    elif returncode and not killed_by_checker:
         verdict_str = click.style('RE', 'red')
         click.secho('[DIAGNOSTIC]',
                     bold=True, fg='yellow', err=True)
@@ -142,13 +292,18 @@ def run_test(executable, interactor, argv, no_style_stderr, test_dir, test_name)
             click.style(f' with RE ({returncode})', fg='red'),
         )), err=True)
 
-    elif os.path.exists(output_path):
-        verdict_str = click.style('AC', fg='green')
+    elif checker is not None and checker.rejected:
+        verdict_str = click.style('WA', fg='red')
+        click.echo(''.join((
+            click.style('Finished ', fg='red'),
+            click.style(repr(test_name), fg='yellow'),
+            click.style(' with WA (stopped at the first wrong token)', fg='red'),
+        )), err=True)
 
-        with open(output_path, 'r', encoding='utf-8') as file:
-            answer = ''.join(file)
+    elif checker is not None:
+        verdict_str = click.style('AC', fg='green')
 
-        checker_result = LenientChecker(output, answer)
+        checker_result = checker.finish()
 
         if not checker_result.accept:
             verdict_str = click.style('WA', fg='red')
@@ -181,7 +336,24 @@ def run_test(executable, interactor, argv, no_style_stderr, test_dir, test_name)
                 click.style(' with AC (exact)', fg='green'),
             )), err=True)
 
-    return verdict_str, time_used
+    return verdict_str, usage
+
+
+def run_test_captured(*args):
+    '''
+    Call :py:func:`run_test` with everything it
+    prints recorded instead of written,
+    so tests can run in parallel without
+    their output being interleaved.
+
+    Returns the result of :py:func:`run_test`
+    and the recorded output.
+    '''
+    from .utils import capture_output
+
+    with capture_output() as chunks:
+        result = run_test(*args)
+    return result, chunks
 
 
 @click.argument('source', type=AutoPath())
@@ -216,24 +388,124 @@ def run_test(executable, interactor, argv, no_style_stderr, test_dir, test_name)
                     'The value should be something executable.'))
 @click.option('--no-style-stderr', is_flag=True,
               help='Disable highlighting which part of output is stderr.')
-def run(source, argv, debug_level, force_recompile, extra_flags, testset, interactor, no_style_stderr):
+@click.option('-j', '--jobs', type=click.IntRange(1), default=1,
+              help=('How many tests to run in parallel. '
+                    'The output of each test is buffered and shown '
+                    'in the same order as when running one at a time.'))
+@click.option('-P', '--preview', type=click.IntRange(0),
+              help=('Only show this many lines from the start and '
+                    'from the end of the output of each test. '
+                    'The full output is saved to temporary files.'))
+@click.option('-tl', '--time-limit', type=click.IntRange(1),
+              help=('Time limit in milliseconds of cpu time. '
+                    'The default is the limit saved by `cpt listen` '
+                    'for the testset, if any.'))
+@click.option('-ml', '--memory-limit', type=click.IntRange(1),
+              help=('Memory limit in megabytes. '
+                    'The default is the limit saved by `cpt listen` '
+                    'for the testset, if any.'))
+@click.option('--cache/--no-cache', envvar='CPT_CACHE', default=False,
+              help=('Reuse the verdicts of tests whose executable, arguments, '
+                    'limits, input and answer are all unchanged, '
+                    'instead of running them again '
+                    '(except for those exceeding the limits). '
+                    'Can also be enabled by setting CPT_CACHE=1.'))
+@click.option('-w', '--watch', is_flag=True,
+              help=('Keep running, and recompile and rerun the tests '
+                    'whenever the source or a file it includes is saved. '
+                    'A save cancels the tests still running.'))
+@click.option('--counters', is_flag=True,
+              help=('Count instructions, cycles, branch misses and '
+                    'cache misses of each test with perf_event_open, '
+                    'where perf events are permitted.'))
+@click.option('--cost', type=click.Choice(['time', 'instructions']), default='time',
+              help=('What the Summary measures. Instructions are counted with perf '
+                    'events or cachegrind, and are reproducible on noisy machines. '
+                    'They are compared against the baseline stored '
+                    'next to the testset, which the first counts become.'))
+@click.option('--save-baseline', is_flag=True,
+              help='Store the instruction counts as the new baseline.')
+@click.option('--profile', is_flag=True,
+              help=('Instead of checking the tests, build for profiling and '
+                    'show where the time goes over all of them, using perf, '
+                    'gprof or cProfile, whichever fits the language.'))
+@click.option('--profile-top', type=click.IntRange(1), default=15,
+              help='How many of the hottest functions and lines to show.')
+def run(source, argv, debug_level, force_recompile, extra_flags, testset, interactor, no_style_stderr, jobs,
+        preview, time_limit, memory_limit, cache, watch=False, counters=False, cost='time',
+        save_baseline=False, profile=False, profile_top=15):
     '''Executes a program from source.'''
     import sys
     import os
-    from .execute import execute
+    from .execute import OutputEcho, execute
     from .get_executable import CompileError, get_executable
-    from .utils import error, time_func
+    from .limits import default_testset, load_limits
+    from .utils import error
 
     if testset is None and interactor is None:
         test_dir = os.path.join(os.path.dirname(source), 'samples')
         if os.path.isdir(test_dir):
-            testset = os.path.join(
-                test_dir,
-                '.'.join(os.path.basename(source).split('.')[:-1])
-            )
+            testset = default_testset(source)
         else:
             testset = '-'
 
+    if watch:
+        from .watch import watch as watch_source
+
+        if testset in (None, '-'):
+            error('watching needs tests to run, select them with -T.')
+            return
+
+        def run_pass(_changed):
+            # Builds are keyed on the content of the included headers,
+            # so a changed header gets a new build without forcing it.
+            run(source, argv, debug_level, force_recompile,
+                extra_flags, testset, interactor, no_style_stderr, jobs,
+                preview, time_limit, memory_limit, cache,
+                counters=counters, cost=cost, save_baseline=save_baseline,
+                profile=profile, profile_top=profile_top)
+
+        watch_source(source, run_pass)
+        return
+
+    if profile:
+        from .profiler import profile_tests
+
+        if testset in (None, '-') or interactor is not None:
+            error('profiling needs tests to run without an interactor, select them with -T.')
+            return
+
+        test_dir, test_names = find_tests(testset)
+        profile_tests(source, argv, debug_level, extra_flags, force_recompile,
+                      test_dir, test_names, profile_top)
+        return
+
+    instruction_counter = None
+    if cost == 'instructions':
+        from . import cost as cost_module
+        from .languages import SUFF_TO_LANG
+
+        lang = SUFF_TO_LANG.get(source.rsplit('.', 1)[-1])
+        if lang is not None and lang.directly_runnable:
+            error(f'--cost=instructions is unsupported for {lang.name}, '
+                  'its instruction counts are mostly the interpreter.')
+            return
+        if testset in (None, '-') or interactor is not None:
+            error('counting instructions needs tests to run without an interactor, '
+                  'select them with -T.')
+            return
+        instruction_counter = cost_module.instruction_counter()
+        if instruction_counter is None:
+            error('counting instructions needs perf events or valgrind, '
+                  'neither is available.')
+            return
+
+    limits = load_limits(
+        (testset if testset != '-' else None, default_testset(source)),
+        time_limit,
+        memory_limit,
+    )
+
     try:
         executable = get_executable(
             source_path=source,
@@ -247,47 +519,128 @@ def run(source, argv, debug_level, force_recompile, extra_flags, testset, intera
 
     if testset is None:
         assert interactor
-        run_interactive(executable, interactor, argv, None, '')
+        run_interactive(executable, interactor, argv, None, '', limits)
         return
 
     if testset == '-':
         if interactor is not None:
-            run_interactive(executable, interactor, argv, 0, '')
+            run_interactive(executable, interactor, argv, 0, '', limits)
             return
 
-        time_used, (returncode, _) = time_func(
-            lambda: execute(
-                executable, argv, sys.stdin,
-                not no_style_stderr
-            )
+        returncode, usage = execute(
+            executable, argv, sys.stdin,
+            OutputEcho(not no_style_stderr, preview, 'stdin'),
+            limits,
+            counters=counters,
         )
 
-        click.secho(f'{round(time_used * 1000)} ms',
-                    fg='blue', err=True)
+        click.secho(format_usage(usage), fg='blue', err=True)
+        if counters:
+            warn_no_counters((usage,))
 
-        if returncode:
+        limit_verdict = limits.exceeded(usage)
+        if limit_verdict is not None:
+            error(f'exceeded the limits ({limit_verdict})')
+        elif returncode:
             error(f'crashed ({returncode})')
         return
 
-    test_dir = os.path.dirname(testset) or './'
-    test_prefix = os.path.basename(testset)
+    test_dir, test_names = find_tests(testset)
+
+    count_events = counters or instruction_counter == 'perf'
+
+    verdict_cache = None
+    if cache:
+        from .verdict_cache import VerdictCache
+        verdict_cache = VerdictCache(executable, interactor, argv, limits, count_events)
 
     results = []
 
-    for path in sorted(os.listdir(test_dir)):
-        if not path.startswith(test_prefix):
-            continue
-        if not path.endswith('.in'):
-            continue
-        test_name = path[:-3]
-        results.append((
-            test_name,
-            *run_test(executable, interactor, argv, no_style_stderr,
-                      test_dir, test_name)
-        ))
+    if jobs == 1:
+        for test_name in test_names:
+            results.append((
+                test_name,
+                *run_test(executable, interactor, argv, no_style_stderr,
+                          test_dir, test_name, limits, preview, verdict_cache, count_events)
+            ))
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        from .utils import replay_output
+
+        with ProcessPoolExecutor(min(jobs, len(test_names) or 1)) as executor:
+            futures = [
+                executor.submit(run_test_captured,
+                                executable, interactor, argv, no_style_stderr,
+                                test_dir, test_name, limits, preview, verdict_cache, count_events)
+                for test_name in test_names
+            ]
+            for test_name, future in zip(test_names, futures):
+                result, chunks = future.result()
+                replay_output(chunks)
+                results.append((test_name, *result))
+
+    if verdict_cache is not None:
+        from .verdict_cache import evict
+        evict()
+
+    costs = {}
+    if instruction_counter == 'perf':
+        costs = {
+            name: usage.counters['instructions']
+            for name, _, usage in results
+            if 'instructions' in (usage.counters or {})
+        }
+    elif instruction_counter == 'cachegrind':
+        for name in test_names:
+            click.echo(f'Counting instructions of {name!r} with cachegrind ...', err=True)
+            count = cost_module.cachegrind_instructions(
+                executable, argv, test_paths(test_dir, name)[0])
+            if count is not None:
+                costs[name] = count
+
+    if instruction_counter is not None:
+        baseline = cost_module.load_baseline(testset)
 
     click.echo('\nSummary:', err=True)
-    for name, verdict, time_used in results:
-        click.echo(f'  [{name}] ', err=True, nl=False)
+    name_width = max((len(name) for name, *_ in results), default=0)
+    verdict_width = max((len(click.unstyle(verdict)) for _, verdict, _ in results), default=0)
+    for name, verdict, usage in results:
+        click.echo(f'  [{name}] '.ljust(name_width + 5), err=True, nl=False)
         click.secho(verdict, bold=True, err=True, nl=False)
-        click.echo(f' {round(1000*time_used)} ms', err=True)
+        click.echo(' ' * (verdict_width - len(click.unstyle(verdict))), err=True, nl=False)
+        click.echo(''.join((
+            f' {round(1000*usage.wall_time):>6} ms wall',
+            f' {round(1000*usage.cpu_time):>6} ms cpu',
+            f' {usage.max_rss / 1024**2:>7.1f} MB',
+            *(
+                f' {format_count(count):>8} {name}'
+                for name, count in (usage.counters or {}).items()
+                if counters and name in ('instructions', 'LLC-misses')
+            ),
+        )), err=True, nl=instruction_counter is None)
+        if instruction_counter is not None:
+            click.echo(
+                f' {format_count(costs[name]):>8} instr {cost_module.format_change(costs[name], baseline.get(name))}'
+                if name in costs else '        ? instr',
+                err=True,
+            )
+
+    if instruction_counter is not None:
+        common = [name for name in costs if name in baseline]
+        if common:
+            click.echo(
+                'Instructions against the baseline: ' +
+                cost_module.format_change(
+                    sum(costs[name] for name in common),
+                    sum(baseline[name] for name in common),
+                    width=0,
+                ),
+                err=True,
+            )
+        if costs and (save_baseline or not baseline):
+            cost_module.save_baseline(testset, costs)
+            click.echo('Saved the instruction counts as the baseline in '
+                       f'{cost_module.baseline_path(testset)!r}.', err=True)
+
+    if counters:
+        warn_no_counters(usage for _, _, usage in results)
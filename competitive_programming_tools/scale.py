@@ -0,0 +1,262 @@
+'''
+Provides :py:func:`scale`, for estimating the
+time complexity of a solution empirically.
+'''
+
+import math
+
+import click
+
+from .auto_path import AutoPath
+
+MODELS = (
+    ('1', lambda n: 1.0),
+    ('log n', lambda n: math.log2(n + 1)),
+    ('sqrt n', math.sqrt),
+    ('n', float),
+    ('n log n', lambda n: n * math.log2(n + 1)),
+    ('n log^2 n', lambda n: n * math.log2(n + 1)**2),
+    ('n sqrt n', lambda n: n * math.sqrt(n)),
+    ('n^2', lambda n: float(n)**2),
+    ('n^2 log n', lambda n: float(n)**2 * math.log2(n + 1)),
+    ('n^3', lambda n: float(n)**3),
+)
+'''Complexity models by name, and their growth functions.'''
+
+STARTUP_FACTOR = 10
+'''
+How many times longer than on the smallest test the runs must
+take by default, so that their times are not mostly start up time.
+'''
+
+
+def fit(sizes, times, growth):
+    '''
+    Fit `times` as `a + c * growth(size)` with a, c >= 0, minimizing
+    the relative errors, so that small sizes count as much as large ones.
+
+    Returns a, c and the root mean square relative error.
+    '''
+    xs = [growth(size) for size in sizes]
+    weights = [1 / time**2 for time in times]
+
+    def error(a, c):
+        return math.sqrt(sum(
+            ((a + c * x - time) / time)**2
+            for x, time in zip(xs, times)
+        ) / len(times))
+
+    s_w = sum(weights)
+    s_x = sum(w * x for w, x in zip(weights, xs))
+    s_xx = sum(w * x * x for w, x in zip(weights, xs))
+    s_y = sum(w * t for w, t in zip(weights, times))
+    s_xy = sum(w * x * t for w, x, t in zip(weights, xs, times))
+
+    det = s_w * s_xx - s_x * s_x
+    if det > 0:
+        a = (s_xx * s_y - s_x * s_xy) / det
+        c = (s_w * s_xy - s_x * s_y) / det
+        if a >= 0 and c >= 0:
+            return a, c, error(a, c)
+
+    # The best fit has a or c at zero.
+    candidates = []
+    if s_xx > 0:
+        candidates.append((0.0, max(0.0, s_xy / s_xx)))
+    candidates.append((s_y / s_w, 0.0))
+    a, c = min(candidates, key=lambda ac: error(*ac))
+    return a, c, error(a, c)
+
+
+def format_time(seconds):
+    '''Format a duration with a sensible unit.'''
+    if seconds < 1:
+        return f'{1000 * seconds:.1f} ms'
+    if seconds < 3600:
+        return f'{seconds:.2f} s'
+    return f'{seconds / 3600:.1f} h'
+
+
+@click.argument('source', type=AutoPath())
+@click.argument('pattern', nargs=-1, required=True)
+@click.option('-d', '--debug-level', type=click.IntRange(0), default=0,
+              help=(
+                  '\b\n'
+                  'How paranoid should the debugging be?\n'
+                  ' 0: As close to the average contest\n'
+                  '    environment as possible.\n'
+                  ' 1: Default balance between compilation\n'
+                  '    speed and information.\n'
+                  '>1: Higher levels may exist\n'
+                  '    depending on language.\n\b\n'
+              ))
+@click.option('-fr', '--force-recompile', is_flag=True,
+              help='If this flag is set, the program will '
+                   'be recompiled even if unneccesary.')
+@click.option('-e', '--extra-flags', default='')
+@click.option('-p', '--param', type=click.IntRange(1), default=1,
+              help=('Which range in the pattern is the size to sweep '
+                    '(1 for the first one). The other ranges stay random.'))
+@click.option('-s', '--steps', type=click.IntRange(2), default=8,
+              help='How many sizes to time, in a geometric series over the range.')
+@click.option('-r', '--repetitions', type=click.IntRange(1), default=3,
+              help='How many generated tests to time at each size (the median is used).')
+@click.option('-m', '--min-n', type=click.IntRange(1),
+              help=('The smallest size to time, the default is the first size '
+                    f'(growing 4 times at a time) where a run takes {STARTUP_FACTOR} '
+                    'times as long as on the smallest one, since smaller tests '
+                    'are mostly start up time.'))
+@click.option('-n', '--max-n', type=click.IntRange(1),
+              help='The size to project the time at, the default is the end of the range.')
+@click.option('-mt', '--max-time', type=float, default=10.0,
+              help=('Stop at the first size where a run takes longer than this '
+                    'many seconds of cpu time (it is killed then).'))
+def scale(source, pattern, debug_level, force_recompile, extra_flags,
+          param, steps, repetitions, min_n, max_n, max_time):
+    '''
+    Estimate the time complexity of `source`, by timing
+    it on tests generated by the pattern (like for `stress`)
+    with one range swept over a geometric series of sizes,
+    and fitting the cpu times to common complexities.
+    '''
+    import asyncio
+    import shlex
+    import statistics
+    from .get_executable import CompileError, get_executable
+    from .limits import Limits, default_testset, load_limits
+    from .spawn import split_command
+    from .stress import ProcessedArg, parse_range, silent_run
+    from .utils import error, warn
+
+    tokens = [token for arg in pattern for token in split_command(arg)]
+    ranges = [index for index, token in enumerate(tokens) if parse_range(token) is not None]
+    if len(ranges) < param:
+        error(f'the pattern has {len(ranges)} ranges, there is no range {param}.')
+        return
+    swept = ranges[param - 1]
+    start, stop = parse_range(tokens[swept])
+    high = stop - 1
+    low = max(start, 1)
+    if max_n is None:
+        max_n = high
+    if high < low:
+        error('the swept range is empty.')
+        return
+
+    try:
+        soln_exe = split_command(get_executable(
+            source_path=source,
+            debug_level=debug_level,
+            force_recompile=force_recompile,
+            extra_flags=extra_flags,
+        ))
+    except CompileError:
+        error('failed compiling.')
+        return
+
+    processed_args = [ProcessedArg(token) for token in tokens]
+    run_limits = Limits(time=max_time)
+
+    async def time_size(size):
+        # The median cpu time, or None if a run took too long.
+        cpu_times = []
+        for _ in range(repetitions):
+            gen_argv = [
+                str(size) if index == swept else arg.get()
+                for index, arg in enumerate(processed_args)
+            ]
+            input_data, gen_exit_code, _ = await silent_run(None, gen_argv, None)
+            if gen_exit_code:
+                raise ValueError(f'The generator crashed on {shlex.join(gen_argv)} ({gen_exit_code=})')
+            _, exit_code, usage = await silent_run(input_data, soln_exe, None, run_limits)
+            if run_limits.exceeded(usage):
+                return None
+            if exit_code:
+                raise ValueError(f'The solution crashed on {shlex.join(gen_argv)} ({exit_code=})')
+            cpu_times.append(usage.cpu_time)
+        return statistics.median(cpu_times)
+
+    if min_n is None:
+        # The sizes grow 4 times at a time from the smallest, until
+        # the runs take long enough not to be mostly start up time.
+        try:
+            baseline = asyncio.run(time_size(low))
+            size = low
+            while True:
+                cpu_time = asyncio.run(time_size(size))
+                if cpu_time is None:
+                    min_n = max(low, size // 4)
+                    break
+                if cpu_time >= STARTUP_FACTOR * max(baseline, 1e-4):
+                    min_n = size
+                    break
+                if size == high:
+                    break
+                size = min(high, size * 4)
+        except ValueError as exc:
+            error(str(exc))
+            return
+        if baseline is None:
+            error(f'the smallest size takes longer than {max_time} s.')
+            return
+        if min_n is None:
+            warn('the runs take about as long as on the smallest size, '
+                 'so their times are mostly start up time.')
+            min_n = high // 1000
+    low = max(low, min_n)
+    if high < low:
+        error('the swept range is empty.')
+        return
+
+    sizes = sorted({
+        round(low * (high / low)**(step / (steps - 1)))
+        for step in range(steps)
+    })
+
+    measured_sizes = []
+    times = []
+
+    click.echo(f'{"n":>12} {"cpu time":>12}')
+    for size in sizes:
+        try:
+            cpu_time = asyncio.run(time_size(size))
+        except ValueError as exc:
+            error(str(exc))
+            return
+        if cpu_time is None:
+            warn(f'stopped sweeping, n={size} took longer than {max_time} s.')
+            break
+        click.echo(f'{size:>12} {format_time(cpu_time):>12}')
+        measured_sizes.append(size)
+        # Timer resolution, so the relative errors stay finite.
+        times.append(max(cpu_time, 1e-4))
+
+    if len(measured_sizes) < 3:
+        error('too few sizes were timed to fit a complexity.')
+        return
+
+    fits = sorted(
+        ((name, *fit(measured_sizes, times, growth), growth) for name, growth in MODELS),
+        key=lambda result: result[3],
+    )
+
+    click.echo(f'\n{"model":>12} {"error":>8} {"at max n":>12}')
+    for name, a, c, err, growth in fits:
+        click.echo(f'{name:>12} {100 * err:>7.1f}% {format_time(a + c * growth(max_n)):>12}')
+
+    best_name, best_a, best_c, _, best_growth = fits[0]
+    projected = best_a + best_c * best_growth(max_n)
+    limits = load_limits((default_testset(source),), None, None)
+
+    summary = (
+        f'\nBest fit: O({best_name}), '
+        f'projected {format_time(projected)} at n={max_n}'
+    )
+    if limits.time is None:
+        click.secho(summary, bold=True)
+    else:
+        click.secho(
+            f'{summary} (time limit {format_time(limits.time)})',
+            bold=True,
+            fg='green' if projected <= limits.time else 'red',
+        )
@@ -0,0 +1,694 @@
+'''
+Provides :py:func:`spawn`, for starting child processes
+without a shell and measuring the resources they use.
+'''
+import asyncio
+import functools
+import os
+import time
+from typing import Dict, NamedTuple, Optional
+
+PIPE = asyncio.subprocess.PIPE
+DEVNULL = asyncio.subprocess.DEVNULL
+
+# A process forked from python starts out with python's
+# peak memory usage as its own, so the programs are
+# started from a tiny process instead, which reports
+# the resource usage of the program it ran.
+RUNNER_SOURCE = r'''
+#define _GNU_SOURCE
+#include <errno.h>
+#include <fcntl.h>
+#include <linux/perf_event.h>
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/prctl.h>
+#include <sys/resource.h>
+#include <sys/syscall.h>
+#include <sys/wait.h>
+#include <time.h>
+#include <unistd.h>
+
+#define CACHE_MISSES(cache) \
+  (PERF_COUNT_HW_CACHE_##cache | PERF_COUNT_HW_CACHE_OP_READ << 8 | \
+   PERF_COUNT_HW_CACHE_RESULT_MISS << 16)
+#define COUNTERS 5
+
+static const struct { unsigned type; unsigned long long config; }
+counter_events[COUNTERS] = {
+  {PERF_TYPE_HARDWARE, PERF_COUNT_HW_INSTRUCTIONS},
+  {PERF_TYPE_HARDWARE, PERF_COUNT_HW_CPU_CYCLES},
+  {PERF_TYPE_HARDWARE, PERF_COUNT_HW_BRANCH_MISSES},
+  {PERF_TYPE_HW_CACHE, CACHE_MISSES(L1D)},
+  {PERF_TYPE_HW_CACHE, CACHE_MISSES(LL)},
+};
+
+static volatile pid_t child;
+
+static void forward_kill(int sig) {
+  (void)sig;
+  if (child > 0) kill(child, SIGKILL);
+}
+
+static long long to_us(struct timeval tv) {
+  return tv.tv_sec * 1000000LL + tv.tv_usec;
+}
+
+static long long elapsed_us(struct timespec start) {
+  struct timespec now;
+  clock_gettime(CLOCK_MONOTONIC, &now);
+  return (now.tv_sec - start.tv_sec) * 1000000LL +
+         (now.tv_nsec - start.tv_nsec) / 1000;
+}
+
+static long long rss_bytes(pid_t pid) {
+  char path[64];
+  long long size = 0, resident = 0;
+  snprintf(path, sizeof path, "/proc/%d/statm", (int)pid);
+  FILE *file = fopen(path, "r");
+  if (!file) return 0;
+  if (fscanf(file, "%lld %lld", &size, &resident) != 2) resident = 0;
+  fclose(file);
+  return resident * sysconf(_SC_PAGESIZE);
+}
+
+/* The cpu time of the program so far, in clock ticks, or -1. */
+static long long cpu_ticks(pid_t pid) {
+  char path[64], stat[1024];
+  unsigned long long user = 0, sys = 0;
+  snprintf(path, sizeof path, "/proc/%d/stat", (int)pid);
+  FILE *file = fopen(path, "r");
+  if (!file) return -1;
+  size_t size = fread(stat, 1, sizeof stat - 1, file);
+  fclose(file);
+  stat[size] = 0;
+  /* The name in parentheses may contain spaces. */
+  char *fields = strrchr(stat, ')');
+  if (!fields || sscanf(fields + 1, " %*c %*d %*d %*d %*d %*d %*u %*u %*u %*u %*u %llu %llu",
+                        &user, &sys) != 2)
+    return -1;
+  return (long long)(user + sys);
+}
+
+/* Whether the program is blocked writing to a full pipe, waiting
+ * for its output to be read, which is up to whoever reads it. */
+static int waiting_on_output(pid_t pid) {
+  char path[64], wchan[64] = "";
+  snprintf(path, sizeof path, "/proc/%d/wchan", (int)pid);
+  FILE *file = fopen(path, "r");
+  if (!file) return 0;
+  if (!fgets(wchan, sizeof wchan, file)) wchan[0] = 0;
+  fclose(file);
+  return strstr(wchan, "pipe_write") != NULL;
+}
+
+/* Counts the user mode events of the program (and its children)
+ * from when it calls exec. Fails if perf events are not permitted. */
+static int open_counter(pid_t pid, int index) {
+  struct perf_event_attr attr;
+  memset(&attr, 0, sizeof attr);
+  attr.size = sizeof attr;
+  attr.type = counter_events[index].type;
+  attr.config = counter_events[index].config;
+  attr.disabled = 1;
+  attr.enable_on_exec = 1;
+  attr.inherit = 1;
+  attr.exclude_kernel = 1;
+  attr.exclude_hv = 1;
+  attr.read_format =
+      PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING;
+  return (int)syscall(SYS_perf_event_open, &attr, pid, -1, -1,
+                      PERF_FLAG_FD_CLOEXEC);
+}
+
+/* The count, scaled up if the counter was multiplexed, or -1. */
+static long long read_counter(int fd) {
+  unsigned long long values[3];
+  if (fd < 0 || read(fd, values, sizeof values) != sizeof values) return -1;
+  if (values[2] == 0) return 0;
+  return (long long)((double)values[0] * values[1] / values[2]);
+}
+
+/* runner REPORT_FD CPU_LIMIT_MS WALL_LIMIT_MS MEMORY_LIMIT_BYTES COUNTERS
+ *        PROGRAM ARGS...
+ * A limit of 0 means no limit. Kills the program when it exceeds
+ * the cpu time, wall time or memory limit, polling every 5 ms,
+ * with RLIMIT_CPU set a second later as a backstop. If COUNTERS is 1,
+ * counts hardware events of the program with perf_event_open.
+ * Writes "status killed wall_us user_us sys_us max_rss_kib" and the
+ * counts (-1 if not counted) to REPORT_FD, where killed is 1 if the
+ * program was killed for its time, 2 for its memory, and 0 otherwise.
+ * The wall time does not count the time the program
+ * was seen waiting for its output to be read. */
+int main(int argc, char **argv) {
+  if (argc < 7) return 127;
+  int report_fd = atoi(argv[1]);
+  long long cpu_limit_ms = atoll(argv[2]);
+  long long cpu_limit_s = (cpu_limit_ms + 999) / 1000 + 1;
+  long long ticks_per_s = sysconf(_SC_CLK_TCK);
+  long long wall_limit_ms = atoll(argv[3]);
+  long long memory_limit = atoll(argv[4]);
+  int count = atoi(argv[5]);
+  pid_t parent = getpid();
+
+  /* The program waits for this to close before exec,
+   * so the counters are opened before it starts. */
+  int ready[2] = {-1, -1};
+  if (count && pipe(ready) < 0) return 127;
+
+  sigset_t sigchld;
+  sigemptyset(&sigchld);
+  sigaddset(&sigchld, SIGCHLD);
+  sigprocmask(SIG_BLOCK, &sigchld, NULL);
+
+  struct timespec start;
+  clock_gettime(CLOCK_MONOTONIC, &start);
+
+  child = fork();
+  if (child < 0) return 127;
+  if (child == 0) {
+    close(report_fd);
+    prctl(PR_SET_PDEATHSIG, SIGKILL);
+    if (getppid() != parent) _exit(127);
+    sigprocmask(SIG_UNBLOCK, &sigchld, NULL);
+    if (cpu_limit_ms) {
+      struct rlimit limit = {cpu_limit_s, cpu_limit_s + 1};
+      setrlimit(RLIMIT_CPU, &limit);
+    }
+    if (count) {
+      char byte;
+      close(ready[1]);
+      while (read(ready[0], &byte, 1) < 0 && errno == EINTR) {}
+      close(ready[0]);
+    }
+    execvp(argv[6], argv + 6);
+    _exit(127);
+  }
+
+  int counter_fds[COUNTERS];
+  for (int index = 0; index < COUNTERS; ++index)
+    counter_fds[index] = count ? open_counter(child, index) : -1;
+  if (count) {
+    close(ready[0]);
+    close(ready[1]);
+  }
+
+  signal(SIGINT, SIG_IGN);
+  signal(SIGTERM, forward_kill);
+
+  int devnull = open("/dev/null", O_RDWR);
+  for (int fd = 0; fd < 3; ++fd) dup2(devnull, fd);
+
+  int status;
+  struct rusage usage;
+  long long waited_us = 0, last_poll_us = 0;
+  int waiting = 0, killed = 0;
+  for (;;) {
+    pid_t done = wait4(child, &status, WNOHANG, &usage);
+    long long now_us = elapsed_us(start);
+    if (waiting) waited_us += now_us - last_poll_us;
+    last_poll_us = now_us;
+    if (done == child) break;
+    if (done < 0 && errno != EINTR) return 127;
+    waiting = waiting_on_output(child);
+    if (!killed) {
+      if ((wall_limit_ms && now_us - waited_us > wall_limit_ms * 1000) ||
+          (cpu_limit_ms && cpu_ticks(child) * 1000 > cpu_limit_ms * ticks_per_s))
+        killed = 1;
+      else if (memory_limit && rss_bytes(child) > memory_limit)
+        killed = 2;
+      if (killed) kill(child, SIGKILL);
+    }
+    struct timespec poll_interval = {0, 5 * 1000000};
+    sigtimedwait(&sigchld, NULL, &poll_interval);
+  }
+
+  dprintf(report_fd, "%d %d %lld %lld %lld %ld", status, killed, elapsed_us(start) - waited_us,
+          to_us(usage.ru_utime), to_us(usage.ru_stime), usage.ru_maxrss);
+  for (int index = 0; index < COUNTERS; ++index)
+    dprintf(report_fd, " %lld", read_counter(counter_fds[index]));
+  dprintf(report_fd, "\n");
+  return 0;
+}
+'''
+
+
+class Usage(NamedTuple):
+    '''
+    Resources used by a finished process.
+    '''
+    wall_time: float
+    '''
+    Seconds from spawning until the process was reaped, except
+    those it was seen blocked on a full pipe waiting for its output
+    to be read (polled every few milliseconds by the runner).
+    '''
+    cpu_time: float
+    '''Seconds spent in user and system mode.'''
+    max_rss: int
+    '''Peak resident set size in bytes.'''
+    counters: Optional[Dict[str, int]] = None
+    '''
+    Hardware event counts by name (see :py:const:`COUNTER_NAMES`),
+    if they were requested. Events that could not be counted are missing.
+    '''
+    killed: Optional[str] = None
+    '''
+    'TLE' or 'MLE' if the process was killed for exceeding the time or
+    memory limit, which its measured usage may not show (the peak
+    resident set size is counted differently than while it runs).
+    '''
+
+
+COUNTER_NAMES = ('instructions', 'cycles', 'branch-misses', 'L1d-misses', 'LLC-misses')
+
+
+@functools.lru_cache(maxsize=None)
+def _split_command(command):
+    import shlex
+    return tuple(shlex.split(command))
+
+
+def split_command(command):
+    '''
+    Split a command string into an argument list
+    the way a shell would, without running a shell.
+    '''
+    return list(_split_command(command))
+
+
+async def run_command(argv, capture=False):
+    '''
+    Run a program from an argument list, without a shell,
+    with the standard streams inherited, or with stdout
+    and stderr captured together if `capture` is set.
+
+    Returns the exit code, which is 127
+    if the program could not be found, like in a shell,
+    and the captured output (empty if not captured).
+    '''
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            resolve_program(argv[0]), *argv[1:],
+            stdout=PIPE if capture else None,
+            stderr=asyncio.subprocess.STDOUT if capture else None,
+            close_fds=False,
+        )
+    except FileNotFoundError:
+        return 127, b''
+    try:
+        output, _ = await proc.communicate()
+    except asyncio.CancelledError:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        raise
+    return proc.returncode, output or b''
+
+
+@functools.lru_cache(maxsize=None)
+def resolve_program(name):
+    '''
+    Find the full path to a program,
+    searching PATH if `name` contains no slash.
+    '''
+    import shutil
+    if os.sep in name:
+        return name
+    return shutil.which(name) or name
+
+
+@functools.lru_cache(maxsize=None)
+def get_runner():
+    '''
+    Get the path to the runner compiled from :py:const:`RUNNER_SOURCE`,
+    compiling it if it does not exist yet.
+
+    Returns None if it could not be compiled.
+    '''
+    import subprocess
+    from hashlib import sha1
+    from .utils import TMP_DIR
+
+    source_id = sha1(RUNNER_SOURCE.encode()).hexdigest()[:16]
+    runner_path = os.path.join(TMP_DIR, f'runner-{source_id}.exe')
+
+    if not os.path.exists(runner_path):
+        partial_path = f'{runner_path}.{os.getpid()}'
+        try:
+            result = subprocess.run(
+                ['gcc', '-O2', '-x', 'c', '-', '-o', partial_path],
+                input=RUNNER_SOURCE.encode(),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=False,
+            )
+        except OSError:
+            return None
+        if result.returncode:
+            return None
+        os.replace(partial_path, runner_path)
+
+    return runner_path
+
+
+class Process:
+    '''
+    A running child process with asyncio streams
+    for the pipes that were requested, similar to
+    :py:class:`asyncio.subprocess.Process`.
+
+    :py:attr:`usage` is available after
+    :py:meth:`wait` returns.
+    '''
+
+    def __init__(self, popen, start_time, report_fd, counters):
+        self.popen = popen
+        self.pid = popen.pid
+        self.start_time = start_time
+        self.report_fd = report_fd
+        self.counters = counters
+        self.stdin = None
+        self.stdout = None
+        self.stderr = None
+        self.returncode = None
+        self.usage = None
+        self._reaper = None
+
+    async def connect(self, limit):
+        '''
+        Wrap the pipes of the process in asyncio streams.
+        '''
+        loop = asyncio.get_running_loop()
+
+        if self.popen.stdin is not None:
+            transport, protocol = await loop.connect_write_pipe(
+                asyncio.streams.FlowControlMixin, self.popen.stdin)
+            self.stdin = asyncio.StreamWriter(transport, protocol, None, loop)
+
+        async def connect_reader(pipe):
+            reader = asyncio.StreamReader(limit=limit)
+            await loop.connect_read_pipe(
+                lambda: asyncio.StreamReaderProtocol(reader), pipe)
+            return reader
+
+        if self.popen.stdout is not None:
+            self.stdout = await connect_reader(self.popen.stdout)
+        if self.popen.stderr is not None:
+            self.stderr = await connect_reader(self.popen.stderr)
+
+    def _reap(self):
+        _, status, rusage = os.wait4(self.pid, 0)
+        end_time = time.perf_counter()
+
+        if self.report_fd is None:
+            return (
+                os.waitstatus_to_exitcode(status),
+                Usage(
+                    wall_time=end_time - self.start_time,
+                    cpu_time=rusage.ru_utime + rusage.ru_stime,
+                    max_rss=rusage.ru_maxrss * 1024,
+                    counters={} if self.counters else None,
+                ),
+            )
+
+        with os.fdopen(self.report_fd, 'rb') as report_file:
+            report = report_file.readline().split()
+        self.report_fd = None
+
+        if len(report) != 6 + len(COUNTER_NAMES):
+            # The runner itself failed.
+            return 127, Usage(end_time - self.start_time, 0.0, 0)
+
+        status, killed, wall_us, user_us, sys_us, max_rss_kib, *counts = map(int, report)
+        return (
+            os.waitstatus_to_exitcode(status),
+            Usage(
+                wall_time=wall_us / 1e6,
+                cpu_time=(user_us + sys_us) / 1e6,
+                max_rss=max_rss_kib * 1024,
+                counters={
+                    name: count
+                    for name, count in zip(COUNTER_NAMES, counts)
+                    if count >= 0
+                } if self.counters else None,
+                killed=(None, 'TLE', 'MLE')[killed],
+            ),
+        )
+
+    def _start_reaper(self):
+        loop = asyncio.get_running_loop()
+
+        try:
+            pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            return loop.run_in_executor(None, self._reap)
+
+        future = loop.create_future()
+
+        def on_exit():
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+            try:
+                future.set_result(self._reap())
+            except OSError as exc:
+                future.set_exception(exc)
+
+        loop.add_reader(pidfd, on_exit)
+        return future
+
+    async def wait(self):
+        '''
+        Wait for the process to exit,
+        and return its exit code.
+        '''
+        if self.returncode is None:
+            if self._reaper is None:
+                self._reaper = self._start_reaper()
+            returncode, usage = await asyncio.shield(self._reaper)
+            if self.returncode is None:
+                self.returncode = returncode
+                self.popen.returncode = returncode
+                self.usage = usage
+        return self.returncode
+
+    async def communicate(self, input_data=None):
+        '''
+        Send `input_data` to stdin, read stdout and stderr
+        until they are closed, and wait for the process to exit.
+
+        Returns the data read from stdout and stderr.
+        '''
+        async def feed():
+            if self.stdin is None:
+                return
+            if input_data:
+                self.stdin.write(input_data)
+                try:
+                    await self.stdin.drain()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+            self.stdin.close()
+
+        async def read(stream):
+            if stream is None:
+                return None
+            return await stream.read()
+
+        _, stdout, stderr = await asyncio.gather(
+            feed(),
+            read(self.stdout),
+            read(self.stderr),
+        )
+        await self.wait()
+        return stdout, stderr
+
+    def kill(self):
+        '''
+        Kill the process if it has not been reaped yet.
+        '''
+        import signal
+        if self.returncode is None:
+            try:
+                # The runner forwards SIGTERM as SIGKILL,
+                # and still reports the usage.
+                os.kill(self.pid, signal.SIGTERM if self.report_fd is not None
+                        else signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+
+async def spawn(argv, *, stdin=None, stdout=None, stderr=None,
+                limits=None, counters=False, limit=2**16):
+    '''
+    Start a process from an argument list, without a shell.
+
+    `stdin`, `stdout` and `stderr` can be anything
+    accepted by :py:class:`subprocess.Popen`.
+    The ones given as :py:const:`PIPE` are available
+    as asyncio streams on the returned :py:class:`Process`.
+
+    If :py:class:`Limits` are given, the process is killed
+    as soon as it exceeds the cpu time, wall time or memory limit
+    (RLIMIT_CPU is set too, a bit above the time limit).
+
+    If `counters` is set, hardware events of the process are counted,
+    as far as perf events are permitted, into :py:attr:`Usage.counters`.
+    '''
+    import math
+    import subprocess
+    from .limits import Limits
+
+    if limits is None:
+        limits = Limits()
+
+    cpu_limit_ms = 0 if limits.time is None else math.ceil(limits.time * 1000)
+    wall_limit_ms = 0 if limits.time is None else math.ceil(limits.wall_time * 1000)
+
+    argv = [resolve_program(argv[0]), *argv[1:]]
+    report_fd = report_write_fd = None
+
+    runner = get_runner()
+    if runner is not None:
+        report_fd, report_write_fd = os.pipe()
+        # Inherited instead of passed with pass_fds, so subprocess
+        # can use posix_spawn. Processes are spawned one at a time
+        # from the event loop, so no other process inherits it.
+        os.set_inheritable(report_write_fd, True)
+        argv = [
+            runner, str(report_write_fd),
+            str(cpu_limit_ms), str(wall_limit_ms), str(limits.memory or 0),
+            str(int(counters)), *argv,
+        ]
+
+    start_time = time.perf_counter()
+    try:
+        popen = subprocess.Popen(
+            argv,
+            stdin=stdin,
+            stdout=stdout,
+            stderr=stderr,
+            close_fds=False,
+        )
+    except BaseException:
+        if report_fd is not None:
+            os.close(report_fd)
+        raise
+    finally:
+        if report_write_fd is not None:
+            os.close(report_write_fd)
+
+    proc = Process(popen, start_time, report_fd, counters)
+
+    if runner is None and cpu_limit_ms:
+        # Without the runner only the time limit is enforced.
+        import resource
+        cpu_limit_s = math.ceil(limits.time) + 1
+        resource.prlimit(proc.pid, resource.RLIMIT_CPU,
+                         (cpu_limit_s, cpu_limit_s + 1))
+        asyncio.get_running_loop().call_later(wall_limit_ms / 1000, proc.kill)
+
+    await proc.connect(limit)
+    return proc
+
+
+class Tee:
+    '''
+    Copies everything read from a pipe into a spill file,
+    and from the spill file into other pipes as it arrives,
+    with splice and sendfile, so the data is copied
+    by the kernel rather than through python buffers.
+
+    Each sink is fed by a thread of its own, so a slow
+    reader only holds back itself, and a sink closed
+    early (by a reader not reading all of its input)
+    is dropped. The sinks are closed at the end.
+    '''
+    CHUNK = 1 << 16
+
+    def __init__(self, source_fd, spill_fd, sink_fds):
+        import threading
+        self.source_fd = source_fd
+        self.spill_fd = spill_fd
+        self.sink_fds = sink_fds
+        self.size = 0
+        self.done = False
+        self.changed = threading.Condition()
+
+    def _fill(self):
+        splice = getattr(os, 'splice', None)
+        try:
+            while True:
+                try:
+                    if splice is None:
+                        raise OSError
+                    count = splice(self.source_fd, self.spill_fd, self.CHUNK)
+                except OSError:
+                    splice = None
+                    data = os.read(self.source_fd, self.CHUNK)
+                    count = len(data)
+                    os.pwrite(self.spill_fd, data, self.size)
+                if not count:
+                    break
+                with self.changed:
+                    self.size += count
+                    self.changed.notify_all()
+        finally:
+            with self.changed:
+                self.done = True
+                self.changed.notify_all()
+
+    def _drain(self, sink_fd):
+        offset = 0
+        sendfile = os.sendfile
+        try:
+            while True:
+                with self.changed:
+                    self.changed.wait_for(lambda: self.size > offset or self.done)
+                    size = self.size
+                if size == offset:
+                    break
+                while offset < size:
+                    try:
+                        if sendfile is None:
+                            raise OSError
+                        offset += sendfile(sink_fd, self.spill_fd, offset, size - offset)
+                    except (BrokenPipeError, ConnectionResetError):
+                        return
+                    except OSError:
+                        sendfile = None
+                        offset += os.write(
+                            sink_fd, os.pread(self.spill_fd, size - offset, offset))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            os.close(sink_fd)
+
+    async def run(self):
+        '''
+        Copy until the source is closed and
+        every sink has everything or is closed.
+        '''
+        import threading
+        loop = asyncio.get_running_loop()
+        finished = [loop.create_future() for _ in range(1 + len(self.sink_fds))]
+
+        def thread(target, future, *args):
+            try:
+                target(*args)
+            finally:
+                try:
+                    loop.call_soon_threadsafe(future.set_result, None)
+                except RuntimeError:
+                    # The loop was closed without waiting.
+                    pass
+
+        # Dedicated threads, since a pool of too few threads
+        # could run the sinks waiting on a fill that never runs.
+        threading.Thread(target=thread, args=(self._fill, finished[0]), daemon=True).start()
+        for sink_fd, future in zip(self.sink_fds, finished[1:]):
+            threading.Thread(target=thread, args=(self._drain, future, sink_fd), daemon=True).start()
+        await asyncio.gather(*finished)
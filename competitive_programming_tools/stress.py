@@ -7,13 +7,13 @@ import click
 from .auto_path import AutoPath
 
 
-def get_range(range_str):
+def parse_range(range_str):
     '''
-    Converts a string in range format
-    to a function returning a random
-    integer in the range.
+    Converts a string in range format, [start..stop]
+    (stop excluded) or [start...stop] (stop included),
+    to the start and the excluded stop,
+    or None if the string is not in range format.
     '''
-    import random
     import re
     match = re.compile(r'^\[(\d+)(\.\.\.?)(\d+)\]$').match(range_str)
     if match is None:
@@ -28,6 +28,21 @@ def get_range(range_str):
     if mid == '...':
         stop += 1
 
+    return start, stop
+
+
+def get_range(range_str):
+    '''
+    Converts a string in range format
+    to a function returning a random
+    integer in the range.
+    '''
+    import random
+    bounds = parse_range(range_str)
+    if bounds is None:
+        return None
+
+    start, stop = bounds
     return lambda: str(random.randint(start, stop - 1))
 
 
@@ -49,89 +64,397 @@ class ProcessedArg:
         )
 
 
-def search(func, timeout, processes):
+class WorstCaseSearch:
+    '''
+    Evolutionary search over the values of the ranges
+    in a generator pattern, for the inputs that maximize
+    a cost of running the solution on them.
+
+    New candidates are mostly mutations of the costliest
+    ones found so far, and sometimes entirely random.
+    '''
+    POPULATION = 16
+    FRESH_RATE = 0.2
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.bounds = {
+            index: parse_range(token)
+            for index, token in enumerate(tokens)
+            if parse_range(token) is not None
+        }
+        self.population = []
+        '''(cost, values, generator argv, input), costliest first.'''
+
+    def propose(self):
+        '''
+        Get the values of the ranges to try next,
+        by index in the pattern.
+        '''
+        import random
+
+        if not self.population or random.random() < self.FRESH_RATE:
+            return {index: random.randrange(*bounds) for index, bounds in self.bounds.items()}
+
+        # The costlier of two random candidates is mutated.
+        _, parent, _, _ = min(
+            random.sample(self.population, min(2, len(self.population))),
+            key=lambda candidate: candidate[0],
+        )
+        values = dict(parent)
+        forced = random.choice(list(self.bounds)) if self.bounds else None
+        for index, (start, stop) in self.bounds.items():
+            if index != forced and random.random() >= 1 / len(self.bounds):
+                continue
+            if random.random() < 0.5:
+                values[index] = random.randrange(start, stop)
+            else:
+                step = max(1, round(abs(random.gauss(0, (stop - start) * 0.05))))
+                values[index] = min(stop - 1, max(start, values[index] + random.choice((-step, step))))
+        return values
+
+    def argv(self, values):
+        '''Get the generator command for the given range values.'''
+        return [
+            str(values[index]) if index in values else token
+            for index, token in enumerate(self.tokens)
+        ]
+
+    def add(self, cost, values, gen_argv, input_data):
+        '''Record the cost of running the solution on a candidate.'''
+        for index, (old_cost, _, old_argv, _) in enumerate(self.population):
+            if old_argv == gen_argv:
+                if -cost < old_cost:
+                    del self.population[index]
+                    break
+                return
+        # Costs are negated, so the costliest sort first.
+        self.population.append((-cost, values, gen_argv, input_data))
+        self.population.sort(key=lambda candidate: candidate[0])
+        del self.population[self.POPULATION:]
+
+    def worst(self, count):
+        '''Get the `count` costliest (cost, generator argv, input) found.'''
+        return [
+            (-cost, gen_argv, input_data)
+            for cost, _, gen_argv, input_data in self.population[:count]
+        ]
+
+
+def is_python_generator(token):
+    '''
+    Whether a pattern token names a python generator
+    function as `module:function`, rather than a command.
+    '''
+    import os
+    import re
+    return (re.fullmatch(r'[A-Za-z_][\w.]*:[A-Za-z_]\w*', token) is not None
+            and not os.path.exists(token))
+
+
+def load_generator(spec):
+    '''Import the function of a `module:function` generator.'''
+    import importlib
+    module_name, function_name = spec.split(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+_generators = {}
+'''The generators imported into this (worker) process, by spec.'''
+
+
+def _init_generator(spec, directory):
+    import sys
+    sys.path.insert(0, directory)
+    _generators[spec] = load_generator(spec)
+
+
+def _generate(spec, seed, args):
+    import random
+    data = _generators[spec](random.Random(seed), *args)
+    return data.encode() if isinstance(data, str) else bytes(data)
+
+
+def save_worst(worst, cost_name, testset, check_exe):
+    '''
+    Save the tests found by :py:class:`WorstCaseSearch`
+    as '{testset}_worst{i}.in', with answers from
+    `check_exe` if it is given, and show them.
+    '''
+    import asyncio
+    import os
+    import shlex
+    from .run import format_count
+    from .utils import ensure_dir
+
+    if not worst:
+        return
+
+    ensure_dir(os.path.dirname(testset) or '.')
+    click.secho(f'The tests with the most {cost_name}:', bold=True)
+    for rank, (cost, gen_argv, input_data) in enumerate(worst, 1):
+        input_path = f'{testset}_worst{rank}.in'
+        with open(input_path, 'wb') as file:
+            file.write(input_data)
+        if check_exe is not None:
+            ans, _, _ = asyncio.run(silent_run(input_data, check_exe, None))
+            with open(f'{testset}_worst{rank}.ans', 'wb') as file:
+                file.write(ans)
+        cost_str = f'{1000 * cost:.0f} ms' if cost_name == 'time' else format_count(cost)
+        click.echo(f'  {cost_str:>10}  {input_path}  ' +
+                   click.style(shlex.join(gen_argv), fg='yellow'))
+
+
+class Telemetry:
+    '''
+    Statistics of the runs of a stress test: the throughput,
+    the latency of the solution, and how the time splits
+    between the generator, the solution and the reference.
+    '''
+    PHASES = ('gen', 'soln', 'ref')
+
+    def __init__(self):
+        import collections
+        import time
+        self.start_time = time.monotonic()
+        self.tests = 0
+        self.cpu_time = 0.0
+        self.phase_times = dict.fromkeys(self.PHASES, 0.0)
+        self.latencies = collections.deque(maxlen=1000)
+        '''The wall times of the latest solution runs.'''
+
+    def record(self, phase, wall_time, cpu_time):
+        '''Record a run of the generator, solution or reference.'''
+        self.phase_times[phase] += wall_time
+        self.cpu_time += cpu_time
+        if phase == 'soln':
+            self.tests += 1
+            self.latencies.append(wall_time)
+
+    def record_usage(self, phase, usage):
+        '''Record a run from its :py:class:`Usage`.'''
+        self.record(phase, usage.wall_time, usage.cpu_time)
+
+    def postfix(self):
+        '''Format the statistics for the progress bar.'''
+        import time
+        from .bench import percentile
+        elapsed = time.monotonic() - self.start_time
+        parts = [f'{self.tests / elapsed if elapsed else 0.0:.1f} tests/s']
+        if self.latencies:
+            parts.append(
+                f'p50 {1000 * percentile(self.latencies, 0.5):.0f} ms '
+                f'p99 {1000 * percentile(self.latencies, 0.99):.0f} ms')
+        total = sum(self.phase_times.values())
+        if total:
+            parts.append(' '.join(
+                f'{phase} {100 * time / total:.0f}%'
+                for phase, time in self.phase_times.items() if time))
+        return ', '.join(parts)
+
+
+def search(func, timeout, processes, postfix=None, max_tests=None, busy_time=None):
     '''
     Run :py:func:`func` until
     it it raises an exception,
-    or for `timeout` seconds.
+    for `timeout` seconds,
+    or `max_tests` times if given.
+    If `postfix` is given, the string it
+    returns is shown after the progress bar.
+
+    If `processes` is None, how many calls run at once is
+    adapted to how busy the cpus are, as measured by
+    `busy_time`, which returns the cpu time used so far.
     '''
     import asyncio
+    import os
     import time
     import tqdm
 
     start_time = time.time()
+    cpus = os.cpu_count() or 1
+    workers = cpus if processes is None else processes
+    active = {}
+    '''The running loops by index, which also keeps their tasks alive.'''
+    started = 0
+    failure = None
+
+    def finished():
+        return (failure is not None or time.time() - start_time >= timeout
+                or (max_tests is not None and started >= max_tests))
+
+    async def loop(index, stop) -> None:
+        nonlocal started, failure
+        try:
+            while not finished() and index < workers:
+                started += 1
+                await func()
+        except Exception as exc:  # pylint: disable=broad-except
+            if failure is None:
+                failure = exc
+            stop.set()
+        finally:
+            del active[index]
+
+    def progress():
+        fraction = (time.time() - start_time) / timeout
+        if max_tests is not None:
+            fraction = max(fraction, started / max_tests)
+        return min(1000, int(1000 * fraction))
+
+    def scale(busy):
+        '''
+        Add workers while the cpus are not busy, as the runs are waiting on
+        something else, and remove the extra ones once they are saturated.
+        '''
+        nonlocal workers
+        if busy < 0.75 * cpus and workers < 4 * cpus and len(active) == workers:
+            workers += max(1, workers // 4)
+        elif busy > 0.95 * cpus and workers > cpus:
+            workers -= 1
 
-    async def loop() -> None:
-        while time.time() - start_time < timeout:
-            await func()
-
-    with tqdm.tqdm(total=1000) as pbar:
-        async def update_bar() -> None:
-            last_prog = 0
-            while last_prog < 1000:
-                await asyncio.sleep(0.5)
-                end_time = time.time()
-                prog = int(1000*(end_time-start_time)/timeout)
-                pbar.update(prog-last_prog)
-                last_prog = prog
-
+    with tqdm.tqdm(total=1000, bar_format='{l_bar}{bar}| {elapsed}<{remaining}{postfix}') as pbar:
         async def run_all() -> None:
-            await asyncio.gather(
-                update_bar(),
-                *(loop() for _ in range(processes)),
-            )
+            stop = asyncio.Event()
+            last_time = time.monotonic()
+            last_busy = 0.0 if busy_time is None else busy_time()
+            while True:
+                for index in range(workers):
+                    if index not in active and not finished():
+                        active[index] = asyncio.ensure_future(loop(index, stop))
+                if not active:
+                    break
+                try:
+                    await asyncio.wait_for(stop.wait(), 0.5)
+                except asyncio.TimeoutError:
+                    pass
+                if failure is not None:
+                    raise failure
+
+                now = time.monotonic()
+                if processes is None and busy_time is not None:
+                    busy = busy_time()
+                    scale((busy - last_busy) / (now - last_time))
+                    last_time, last_busy = now, busy
+                if postfix is not None:
+                    pbar.set_postfix_str(', '.join(filter(None, (
+                        postfix(), f'{workers} workers' if processes is None else None,
+                    ))), refresh=False)
+                pbar.update(progress() - pbar.n)
 
         asyncio.run(run_all())
 
-        pbar.update(1000)
+        pbar.update(1000 - pbar.n)
 
 
-async def silent_run(input_data, solution, interactor):
+async def silent_run(input_data, solution, interactor, limits=None, counters=False):
     '''
-    Run `solution` with `input_data` fed to stdin
-    without any output forwarded to stdout.
+    Run `solution` (an argument list) with `input_data`
+    fed to stdin without any output forwarded to stdout.
+    `input_data` can also be a file opened in binary mode,
+    which is then the stdin itself (from its position).
+    If `interactor` (an argument list) is given,
+    it is fed `input_data` and talks with `solution` instead.
+
+    Returns the output, the exit code,
+    and the :py:class:`Usage` of `solution`,
+    with hardware event counts if `counters` is set.
     '''
     import asyncio
+    from .spawn import DEVNULL, PIPE, spawn
 
-    proc = await asyncio.create_subprocess_shell(
+    from_file = not isinstance(input_data, (bytes, type(None)))
+    proc = await spawn(
         solution,
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.DEVNULL,
+        stdin=input_data if from_file else PIPE,
+        stdout=PIPE,
+        stderr=DEVNULL,
+        limits=limits,
+        counters=counters,
     )
 
     if interactor is None:
-        stdout, _ = await proc.communicate(input_data)
-        return stdout, await proc.wait()
+        stdout, _ = await proc.communicate(None if from_file else input_data)
+        return stdout, proc.returncode, proc.usage
 
-    interactor_proc = await asyncio.create_subprocess_shell(
+    interactor_proc = await spawn(
         interactor,
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.DEVNULL,
+        stdin=PIPE,
+        stdout=PIPE,
+        stderr=DEVNULL,
     )
 
     interactor_proc.stdin.write(input_data)
 
     async def forward(src, dst):
         while (line_bytes := (await src.readline())):
-            line = line_bytes.decode()
             dst.write(line_bytes)
 
     await asyncio.gather(
-        forward(
-            cast(asyncio.StreamReader, proc.stdout),
-            cast(asyncio.StreamWriter, interactor_proc.stdin),
-        ),
-        forward(
-            cast(asyncio.StreamReader, interactor_proc.stdout),
-            cast(asyncio.StreamWriter, proc.stdin),
-        )
+        forward(proc.stdout, interactor_proc.stdin),
+        forward(interactor_proc.stdout, proc.stdin),
     )
 
-    return b'', (await proc.wait()) | (await interactor_proc.wait())
+    exit_code = (await proc.wait()) | (await interactor_proc.wait())
+    return b'', exit_code, proc.usage
+
+
+async def streamed_run(gen_argv, spill_fd, consumers):
+    '''
+    Run the generator `gen_argv`, feeding its output to each of
+    `consumers` (argument lists, limits and whether to count
+    hardware events) while it is produced, and to `spill_fd`.
+
+    Returns the exit code and :py:class:`Usage` of the generator,
+    and the output, exit code and :py:class:`Usage` of each consumer.
+    '''
+    import asyncio
+    import os
+    from .spawn import DEVNULL, PIPE, Tee, spawn
 
+    gen_read_fd, gen_write_fd = os.pipe()
+    try:
+        gen_proc = await spawn(gen_argv, stdin=DEVNULL, stdout=gen_write_fd, stderr=DEVNULL)
+    finally:
+        os.close(gen_write_fd)
 
+    procs = []
+    sink_fds = []
+    try:
+        for argv, limits, counters in consumers:
+            read_fd, write_fd = os.pipe()
+            sink_fds.append(write_fd)
+            try:
+                procs.append(await spawn(
+                    argv, stdin=read_fd, stdout=PIPE, stderr=DEVNULL,
+                    limits=limits, counters=counters))
+            finally:
+                os.close(read_fd)
+    except BaseException:
+        for fd in sink_fds:
+            os.close(fd)
+        os.close(gen_read_fd)
+        gen_proc.kill()
+        raise
+
+    tee = asyncio.ensure_future(Tee(gen_read_fd, spill_fd, sink_fds).run())
+    try:
+        results = await asyncio.gather(*(proc.communicate() for proc in procs))
+        await tee
+    except BaseException:
+        # The copying threads only stop once their pipes are
+        # closed, and the descriptors are only closed after that.
+        for proc in (gen_proc, *procs):
+            proc.kill()
+        await asyncio.shield(tee)
+        raise
+    finally:
+        os.close(gen_read_fd)
+    await gen_proc.wait()
+    return gen_proc.returncode, gen_proc.usage, [
+        (stdout, proc.returncode, proc.usage)
+        for (stdout, _), proc in zip(results, procs)
+    ]
 
 
 @click.argument('source', type=AutoPath())
@@ -154,35 +477,145 @@ async def silent_run(input_data, solution, interactor):
 @click.option('-e', '--extra-flags', default='')
 @click.option('-ca', '--check-against', type=AutoPath())
 @click.option('-t', '--timeout', default=10.0)
-@click.option('-p', '--processes', default=4)
-def stress(source, pattern, debug_level, force_recompile, interactor, extra_flags, check_against, timeout, processes):
+@click.option('-p', '--processes', type=click.IntRange(1),
+              help=('How many tests to run at once, the default is to start '
+                    'with one per cpu and adapt to how busy the cpus are.'))
+@click.option('-n', '--max-tests', type=click.IntRange(1),
+              help='Stop after this many tests, even before the timeout.')
+@click.option('-tl', '--time-limit', type=click.IntRange(1),
+              help=('Time limit in milliseconds of cpu time, '
+                    'tests making the solution exceed it are countertests. '
+                    'The default is the limit saved by `cpt listen`, if any.'))
+@click.option('-ml', '--memory-limit', type=click.IntRange(1),
+              help=('Memory limit in megabytes, '
+                    'tests making the solution exceed it are countertests. '
+                    'The default is the limit saved by `cpt listen`, if any.'))
+@click.option('--maximize', type=click.Choice(['time', 'instructions']),
+              help=('Instead of random tests, search the values of the ranges '
+                    'in the pattern for the tests on which the solution takes '
+                    'the most cpu time or instructions, and save the worst ones '
+                    'next to the samples.'))
+@click.option('-k', '--keep', type=click.IntRange(1), default=3,
+              help='How many of the worst tests to save when maximizing.')
+@click.option('-st', '--shrink-time', type=click.FloatRange(0), default=10.0,
+              help=('How many seconds to spend shrinking a countertest once '
+                    'one is found, by lowering the ranges in the pattern '
+                    '(0 to not shrink).'))
+@click.option('--shrink-lines', is_flag=True,
+              help='When shrinking, also try removing lines from the input.')
+@click.option('--cache/--no-cache', default=False, envvar='CPT_CACHE',
+              help=('Remember the outputs of `check_against` by input, '
+                    'so it is not run again on inputs it was run on before '
+                    '(in this run or earlier ones), instead of streaming '
+                    'each test into it as it is generated. '
+                    'Can also be enabled by setting CPT_CACHE=1.'))
+def stress(source, pattern, debug_level, force_recompile, interactor, extra_flags, check_against, timeout, processes,
+           max_tests, time_limit, memory_limit, maximize, keep, shrink_time, shrink_lines, cache):
     '''
     Run `source` repeatedly with input from
     generated by the pattern
-    (which should expand to something runnable in the shell).
-    Stops after `timeout` seconds, or when a test causing
-    the solution to crash is found, or, if `check_against`
-    is given, `check_against` returns a different answer
-    from `source`.
-    '''
-    from .get_executable import get_executable
-    from .utils import error
-
-    soln_exe = get_executable(
-        source_path=source,
-        debug_level=debug_level,
-        force_recompile=force_recompile,
-        extra_flags=extra_flags,
-    )
+    (which should expand to a command, it is split
+    like in the shell but not run by one).
+    Stops after `timeout` seconds (or `max_tests` tests), or when a test causing
+    the solution to crash or exceed the limits is found, or,
+    if `check_against` is given, `check_against` returns
+    a different answer from `source`.
+
+    The pattern may instead start with a python generator
+    function as `module:function` (imported from the current
+    directory), which is called in worker processes with a
+    seeded `random.Random` and the rest of the pattern
+    (ranges as integers), and returns the test as bytes or
+    a string. Failing tests are then saved with their seed
+    as '{testset}_seed{seed}.in'. Otherwise, without an
+    interactor, the failing test is saved as '{testset}_stress.in'.
+
+    A countertest found is then shrunk, and the smallest failing
+    test found is saved as '{testset}_shrunk.in', with the answer
+    from `check_against` if it is given, to run with `run`.
+
+    With `--cache`, the outputs of `check_against` are
+    cached by input, so inputs that were generated
+    before do not run it again.
+
+    With `maximize`, the tests found to be the slowest are
+    saved as '{testset}_worst{i}.in', with answers from
+    `check_against` if it is given.
+    '''
+    import asyncio
+    import contextlib
+    import hashlib
+    import os
+    import random
+    import shlex
+    import sys
+    import tempfile
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+    from .get_executable import CompileError, get_executables
+    from .limits import default_testset, load_limits
+    from .reference_cache import ReferenceCache
+    from .run import format_usage
+    from .spawn import split_command
+    from .utils import TMP_DIR, ensure_dir, error, warn
+    from .verdict_cache import stream_digest
 
-    check_exe = get_executable(
-        source_path=check_against,
-        debug_level=debug_level,
-        force_recompile=force_recompile,
-        extra_flags=extra_flags,
-    ) if check_against is not None else None
+    limits = load_limits((default_testset(source),), time_limit, memory_limit)
 
-    processed_args = tuple(map(ProcessedArg, pattern))
+    try:
+        executables = get_executables([
+            dict(
+                source_path=build_source,
+                debug_level=debug_level,
+                force_recompile=force_recompile,
+                extra_flags=extra_flags,
+            )
+            for build_source in (source, check_against) if build_source is not None
+        ])
+    except CompileError:
+        error('failed compiling.')
+        return
+    soln_exe = split_command(executables[0])
+    check_exe = split_command(executables[1]) if check_against is not None else None
+
+    if interactor is not None:
+        interactor = split_command(interactor)
+
+    reference_cache = None
+    if cache and check_exe is not None:
+        reference_cache = ReferenceCache(shlex.join(check_exe),
+                                         None if interactor is None else shlex.join(interactor))
+
+    # Without a fixed number of processes, the
+    # python generators and shrinking use one per cpu.
+    workers = processes or os.cpu_count() or 1
+    telemetry = Telemetry()
+
+    tokens = [token for arg in pattern for token in split_command(arg)]
+    processed_args = tuple(map(ProcessedArg, tokens))
+    range_indices = {index for index, token in enumerate(tokens) if parse_range(token) is not None}
+
+    generator_pool = None
+    if tokens and is_python_generator(tokens[0]):
+        sys.path.insert(0, os.getcwd())
+        try:
+            load_generator(tokens[0])
+        except (ImportError, AttributeError, ValueError) as exc:
+            error(f'cannot load the generator {tokens[0]!r} ({exc}).')
+            return
+        generator_pool = ProcessPoolExecutor(
+            workers, initializer=_init_generator, initargs=(tokens[0], os.getcwd()))
+
+    worst_case = None
+    if maximize is not None:
+        if maximize == 'instructions':
+            from .cost import instruction_counter
+            if instruction_counter() != 'perf':
+                error('maximizing instructions needs perf events, which are not available.')
+                return
+        worst_case = WorstCaseSearch(tokens)
+        if not worst_case.bounds:
+            warn('the pattern has no ranges to search, the tests are only rerun.')
 
     total_tests = 0
 
@@ -191,21 +624,164 @@ def stress(source, pattern, debug_level, force_recompile, interactor, extra_flag
         Exception raised when a
         a countertest is found.
         '''
+        failing = None
+        '''The range values, seed and input of the test, once they are known.'''
+
+    def generator_crashed(test_gen_command, genr_exit_code):
+        return CountertestFound(
+            'The command:',
+            click.style(test_gen_command, bold=True, fg='red'),
+            f'resulted in the generator crashing ({genr_exit_code=})',
+        )
+
+    async def generate(test_gen_argv, test_gen_command, seed=None):
+        '''
+        Generate a test, with the python generator seeded
+        with `seed` if there is one, or by running `test_gen_argv`.
+        '''
+        if generator_pool is None:
+            input_data, genr_exit_code, genr_usage = await silent_run(None, test_gen_argv, None)
+            telemetry.record_usage('gen', genr_usage)
+            if genr_exit_code:
+                raise generator_crashed(test_gen_command, genr_exit_code)
+            return input_data
+
+        args = [
+            int(arg) if index in range_indices else arg
+            for index, arg in enumerate(test_gen_argv[1:], 1)
+        ]
+        start_time = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                generator_pool, _generate, test_gen_argv[0], seed, args)
+        except Exception as exc:  # pylint: disable=broad-except
+            raise CountertestFound(
+                'The generator call:',
+                click.style(test_gen_command, bold=True, fg='red'),
+                f'resulted in the generator raising {exc!r}',
+            ) from exc
+        finally:
+            # The generator runs in a busy worker, so its cpu time is about its wall time.
+            elapsed = time.perf_counter() - start_time
+            telemetry.record('gen', elapsed, elapsed)
 
     async def run_single() -> None:
         nonlocal total_tests
         total_tests += 1
-        test_gen_command = ' '.join(arg.get() for arg in processed_args)
-        input_data, genr_exit_code = await silent_run(None, test_gen_command, None)
+        values = None
+        if worst_case is None:
+            test_gen_argv = [arg.get() for arg in processed_args]
+        else:
+            values = worst_case.propose()
+            test_gen_argv = worst_case.argv(values)
+        test_gen_command = shlex.join(test_gen_argv)
+
+        with contextlib.ExitStack() as stack:
+            results = spill = seed = None
+            if generator_pool is not None:
+                seed = random.getrandbits(64)
+                test_gen_command += f' (seed {seed})'
+                failing_path = f'{default_testset(source)}_seed{seed}.in'
+                input_data = await generate(test_gen_argv, test_gen_command, seed)
+            elif interactor is None:
+                # The generated test is streamed into the solutions while it
+                # is generated, and only kept in a file to save it on failure.
+                spill = stack.enter_context(tempfile.TemporaryFile(dir=TMP_DIR))
+                failing_path = f'{default_testset(source)}_stress.in'
+                genr_exit_code, genr_usage, results = await streamed_run(
+                    test_gen_argv, spill.fileno(), [
+                        (soln_exe, limits, maximize == 'instructions'),
+                        # Memoized references run after the whole input is known.
+                        *([(check_exe, None, False)]
+                          if check_exe is not None and reference_cache is None else []),
+                    ])
+                telemetry.record_usage('gen', genr_usage)
+                if genr_exit_code:
+                    raise generator_crashed(test_gen_command, genr_exit_code)
+                input_data = None
+            else:
+                failing_path = None
+                input_data = await generate(test_gen_argv, test_gen_command)
+
+            if input_data is None and worst_case is not None:
+                spill.seek(0)
+                input_data = spill.read()
+
+            try:
+                await check(test_gen_command, test_gen_argv, values, input_data, results, spill)
+            except CountertestFound as exc:
+                if input_data is None:
+                    spill.seek(0)
+                    input_data = spill.read()
+                failing = (
+                    {index: int(test_gen_argv[index]) for index in range_indices},
+                    seed, input_data,
+                )
+                if failing_path is not None:
+                    ensure_dir(os.path.dirname(failing_path) or '.')
+                    with open(failing_path, 'wb') as file:
+                        file.write(input_data)
+                    exc = CountertestFound(*exc.args, f'The test is saved as {failing_path!r}.')
+                exc.failing = failing
+                raise exc
+
+    async def run_reference(input_data, spill):
+        '''
+        Run `check_exe` on a test (given as bytes, or as the
+        spill file if `input_data` is None), or get its output
+        and exit code from the cache if it ran on the same input.
+        '''
+        if reference_cache is None:
+            key = None
+        else:
+            if input_data is None:
+                spill.seek(0)
+                input_digest = stream_digest(spill)
+            else:
+                input_digest = hashlib.sha256(input_data).hexdigest()
+            key = reference_cache.key(input_digest)
+            cached = reference_cache.get(key)
+            if cached is not None:
+                return cached
+
+        if input_data is None:
+            spill.seek(0)
+        ans, check_exit_code, check_usage = await silent_run(
+            spill if input_data is None else input_data, check_exe, interactor)
+        telemetry.record_usage('ref', check_usage)
+        if key is not None:
+            reference_cache.put(key, ans, check_exit_code)
+        return ans, check_exit_code
+
+    async def check(test_gen_command, test_gen_argv, values, input_data,
+                    results=None, spill=None) -> None:
+        '''
+        Run the solutions on a test, unless their `results`
+        are given, and raise :py:class:`CountertestFound` if
+        the solution fails.
+        '''
+        if results is None:
+            results = [await silent_run(
+                input_data, soln_exe, interactor, limits, counters=maximize == 'instructions')]
+        out, soln_exit_code, soln_usage = results[0]
+        telemetry.record_usage('soln', soln_usage)
+
+        if worst_case is not None:
+            worst_case.add(
+                soln_usage.cpu_time if maximize == 'time'
+                else (soln_usage.counters or {}).get('instructions', 0),
+                values, test_gen_argv, input_data,
+            )
 
-        if genr_exit_code:
+        limit_verdict = limits.exceeded(soln_usage)
+        if limit_verdict is not None:
             raise CountertestFound(
                 'The command:',
                 click.style(test_gen_command, bold=True, fg='red'),
-                f'resulted in the generator crashing ({genr_exit_code=})',
+                f'resulted in the solution exceeding the limits ({limit_verdict}, '
+                f'{format_usage(soln_usage)})',
             )
 
-        out, soln_exit_code = await silent_run(input_data, soln_exe, interactor)
         if soln_exit_code:
             raise CountertestFound(
                 'The command:',
@@ -214,7 +790,11 @@ def stress(source, pattern, debug_level, force_recompile, interactor, extra_flag
             )
 
         if check_exe is not None:
-            ans, check_exit_code = await silent_run(input_data, check_exe, interactor)
+            if len(results) == 1:
+                ans, check_exit_code = await run_reference(input_data, spill)
+            else:
+                ans, check_exit_code, check_usage = results[1]
+                telemetry.record_usage('ref', check_usage)
             if check_exit_code:
                 raise CountertestFound(
                     'The command:',
@@ -231,12 +811,152 @@ def stress(source, pattern, debug_level, force_recompile, interactor, extra_flag
                     'from the checked against code.',
                 )
 
+    def shrink(values, seed, input_data):
+        '''
+        Look for smaller tests failing like the one found, for
+        `shrink_time` seconds, and save the smallest as a sample.
+
+        The ranges are lowered toward their starts with fresh
+        seeds, and then, with `shrink_lines`, lines are removed
+        from the input by delta debugging, keeping the variants
+        that still fail, a batch of them in parallel at a time.
+        '''
+        import math
+
+        deadline = time.monotonic() + shrink_time
+        bounds = {index: parse_range(tokens[index]) for index in range_indices}
+        best = [values, seed, input_data, None]
+
+        def new_seed():
+            return None if generator_pool is None else random.getrandbits(64)
+
+        async def attempt(semaphore, candidate_values, candidate_seed, candidate_input=None):
+            '''Get the input and failure of a candidate, or None if it passes.'''
+            argv = [
+                str(candidate_values[index]) if index in candidate_values else arg.get()
+                for index, arg in enumerate(processed_args)
+            ]
+            command = shlex.join(argv)
+            if candidate_seed is not None:
+                command += f' (seed {candidate_seed})'
+            async with semaphore:
+                if time.monotonic() >= deadline:
+                    return None
+                try:
+                    if candidate_input is None:
+                        candidate_input = await generate(argv, command, candidate_seed)
+                except CountertestFound:
+                    return None
+                try:
+                    await check(command, argv, None, candidate_input)
+                except CountertestFound as exc:
+                    return candidate_input, exc.args
+            return None
+
+        async def minimize():
+            semaphore = asyncio.Semaphore(workers)
+            misses = 0
+            while time.monotonic() < deadline and misses < 3:
+                candidates = []
+                for index, (start, _) in bounds.items():
+                    current = best[0][index]
+                    for target in sorted({start, (start + current) // 2, current - 1}):
+                        if start <= target < current:
+                            candidates.append({**best[0], index: target})
+                if not candidates:
+                    break
+                # The generator is random, so each candidate is tried with
+                # a few fresh seeds, filling the workers.
+                batch = [
+                    (candidate, new_seed())
+                    for candidate in candidates * math.ceil(workers / len(candidates))
+                ]
+                outcomes = await asyncio.gather(*(
+                    attempt(semaphore, *candidate) for candidate in batch))
+                failing = [
+                    (len(outcome[0]), index)
+                    for index, outcome in enumerate(outcomes) if outcome is not None
+                ]
+                if not failing:
+                    misses += 1
+                    continue
+                misses = 0
+                _, index = min(failing)
+                best[:] = *batch[index], *outcomes[index]
+
+            lines = best[2].splitlines(keepends=True)
+            chunks = 2
+            while shrink_lines and len(lines) >= 2 and time.monotonic() < deadline:
+                size = math.ceil(len(lines) / chunks)
+                complements = [
+                    lines[:start] + lines[start + size:]
+                    for start in range(0, len(lines), size)
+                ]
+                outcomes = await asyncio.gather(*(
+                    attempt(semaphore, best[0], best[1], b''.join(complement))
+                    for complement in complements))
+                for complement, outcome in zip(complements, outcomes):
+                    if outcome is not None:
+                        lines = complement
+                        best[2:] = outcome
+                        chunks = max(chunks - 1, 2)
+                        break
+                else:
+                    if chunks >= len(lines):
+                        break
+                    chunks = min(len(lines), 2 * chunks)
+
+        click.secho(f'Shrinking the countertest for up to {shrink_time:g} s ...', err=True)
+        asyncio.run(minimize())
+        _, _, input_data, failure = best
+        if failure is not None:
+            print(*failure, sep='\n')
+
+        testset = default_testset(source)
+        input_path = f'{testset}_shrunk.in'
+        ensure_dir(os.path.dirname(input_path) or '.')
+        with open(input_path, 'wb') as file:
+            file.write(input_data)
+        if check_exe is not None:
+            ans, check_exit_code = asyncio.run(run_reference(input_data, None))
+            if not check_exit_code:
+                with open(f'{testset}_shrunk.ans', 'wb') as file:
+                    file.write(ans)
+        click.secho(
+            f'The smallest failing test found ({len(input_data)} bytes) '
+            f'is saved as {input_path!r}.',
+            bold=True,
+        )
+
+    found = None
     try:
-        search(run_single, timeout, processes)
-    except CountertestFound as exc:
-        print(*exc.args, sep='\n')
-        return
+        try:
+            search(
+                run_single, timeout, processes,
+                postfix=lambda: ', '.join(filter(None, (
+                    telemetry.postfix(),
+                    None if reference_cache is None else reference_cache.hit_rate(),
+                ))),
+                max_tests=max_tests,
+                busy_time=lambda: telemetry.cpu_time,
+            )
+        except CountertestFound as exc:
+            print(*exc.args, sep='\n')
+            found = exc
+        finally:
+            print(f'Ran {total_tests} tests.')
+        if found is not None and found.failing is not None and worst_case is None and shrink_time:
+            shrink(*found.failing)
     finally:
-        print(f'Ran {total_tests} tests.')
+        if generator_pool is not None:
+            generator_pool.shutdown(cancel_futures=True)
+        if reference_cache is not None:
+            from .reference_cache import evict
+            evict()
+
+    if worst_case is None:
+        if found is None:
+            error('Could not find a counter test.')
+        return
 
-    error('Could not find a counter test.')
+    save_worst(worst_case.worst(keep), maximize, default_testset(source), check_exe)
@@ -2,7 +2,10 @@
 General utilities.
 '''
 
+import contextlib
+import io
 import os
+import sys
 import tempfile
 
 import click
@@ -43,3 +46,65 @@ def time_func(func, *args, **kwargs):
     res = func(*args, **kwargs)
     end_time = time.perf_counter()
     return (end_time-start_time), res
+
+
+class _RecordingStream(io.TextIOBase):
+    '''
+    Text stream that appends everything written
+    to it to a shared list of chunks, tagged with
+    the name of the stream it replaces.
+    '''
+
+    def __init__(self, chunks, name):
+        super().__init__()
+        self.chunks = chunks
+        self.name = name
+        self.tty = getattr(sys, name).isatty()
+
+    @property
+    def encoding(self):
+        return 'utf-8'
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return self.tty
+
+    def write(self, text):
+        if not isinstance(text, str):
+            raise TypeError(f'write() argument must be str, not {type(text).__name__}')
+        if self.chunks and self.chunks[-1][0] == self.name:
+            self.chunks[-1][1].append(text)
+        else:
+            self.chunks.append((self.name, [text]))
+        return len(text)
+
+
+@contextlib.contextmanager
+def capture_output():
+    '''
+    Record everything written to stdout and stderr,
+    in order, instead of writing it.
+    The recording can be written later with
+    :py:func:`replay_output`.
+    '''
+    chunks = []
+    old_streams = sys.stdout, sys.stderr
+    sys.stdout = _RecordingStream(chunks, 'stdout')
+    sys.stderr = _RecordingStream(chunks, 'stderr')
+    try:
+        yield chunks
+    finally:
+        sys.stdout, sys.stderr = old_streams
+
+
+def replay_output(chunks):
+    '''
+    Write output recorded by :py:func:`capture_output`
+    to the streams it was originally meant for.
+    '''
+    for name, texts in chunks:
+        stream = getattr(sys, name)
+        stream.write(''.join(texts))
+        stream.flush()
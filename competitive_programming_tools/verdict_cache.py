@@ -0,0 +1,142 @@
+'''
+Provides :py:class:`VerdictCache`, which remembers
+the verdicts of tests so unchanged tests are not run again.
+'''
+
+import os
+
+from .utils import TMP_DIR
+
+CACHE_DIR = os.path.join(TMP_DIR, 'verdicts')
+MAX_SIZE = 1 << 22
+'''Bytes the cache may use, the least recently used entries are evicted.'''
+VERSION = 2
+'''Changed whenever the verdicts given for the same test change.'''
+
+
+def stream_digest(file):
+    '''Get a hash of the rest of the content of a binary file.'''
+    import hashlib
+    digest = hashlib.sha256()
+    while chunk := file.read(1 << 20):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_digest(path):
+    '''
+    Get a hash of the content of the file at `path`,
+    or None if there is no such file.
+    '''
+    try:
+        with open(path, 'rb') as file:
+            return stream_digest(file)
+    except FileNotFoundError:
+        return None
+
+
+def command_digest(command):
+    '''
+    Get a hash of a command, including the
+    content of all the files it names.
+    '''
+    import hashlib
+    from .spawn import split_command
+    digest = hashlib.sha256()
+    for token in split_command(command):
+        digest.update(token.encode() + b'\0')
+        if os.path.isfile(token):
+            digest.update(file_digest(token).encode())
+    return digest.hexdigest()
+
+
+class VerdictCache:
+    '''
+    Verdicts of the tests of one executable,
+    run with the same arguments, interactor and :py:class:`Limits`,
+    and with or without hardware event counters.
+
+    Entries are keyed by the hashes of all of these, of the
+    input and answer files, and of how the output is checked.
+    '''
+
+    def __init__(self, executable, interactor, argv, limits, counters=False):
+        import hashlib
+        import json
+        self.prefix = hashlib.sha256(json.dumps([
+            VERSION,
+            command_digest(executable),
+            None if interactor is None else command_digest(interactor),
+            list(argv),
+            list(limits),
+            counters,
+        ]).encode()).hexdigest()
+        self.interactive = interactor is not None
+
+    def key(self, input_path, answer_path):
+        '''
+        Get the key of the test with the given files.
+        The answer is ignored if the test is interactive.
+        '''
+        import hashlib
+        return hashlib.sha256(' '.join((
+            self.prefix,
+            'interactor' if self.interactive else 'lenient',
+            str(file_digest(input_path)),
+            '' if self.interactive else str(file_digest(answer_path)),
+        )).encode()).hexdigest()
+
+    @staticmethod
+    def get(key):
+        '''
+        Get the verdict string and :py:class:`Usage`
+        stored for `key`, or None if there is none.
+        '''
+        import json
+        from .spawn import Usage
+        path = os.path.join(CACHE_DIR, f'{key}.json')
+        try:
+            with open(path, encoding='utf-8') as file:
+                verdict_str, usage = json.load(file)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return verdict_str, Usage(*usage)
+
+    @staticmethod
+    def put(key, verdict_str, usage):
+        '''Store the verdict string and :py:class:`Usage` for `key`.'''
+        import json
+        from .utils import ensure_dir
+        ensure_dir(CACHE_DIR)
+        path = os.path.join(CACHE_DIR, f'{key}.json')
+        partial_path = f'{path}.{os.getpid()}.partial'
+        with open(partial_path, 'w', encoding='utf-8') as file:
+            json.dump([verdict_str, list(usage)], file)
+        os.replace(partial_path, path)
+
+
+def evict(max_size=MAX_SIZE, cache_dir=CACHE_DIR, suffix='.json'):
+    '''
+    Remove the least recently used entries of a cache (by default
+    the cached verdicts), the files in `cache_dir` ending with
+    `suffix`, until they take at most `max_size` bytes.
+    '''
+    entries = []
+    try:
+        with os.scandir(cache_dir) as scan:
+            for entry in scan:
+                if entry.name.endswith(suffix):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
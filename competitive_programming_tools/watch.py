@@ -0,0 +1,208 @@
+'''
+Provides :py:func:`watch`, for re-running
+something whenever a source file or its includes change.
+'''
+
+import os
+import struct
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CLOEXEC = os.O_CLOEXEC
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    '''
+    Reports changes to a set of files, using inotify.
+
+    The directories of the files are watched rather than
+    the files themselves, since many editors save by
+    replacing the file with a new one.
+    '''
+
+    def __init__(self):
+        import ctypes
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs = {}
+        self.paths = set()
+
+    def watch(self, paths):
+        '''Report changes to `paths` (and only them) from now on.'''
+        import ctypes
+        self.paths = {os.path.realpath(path) for path in paths}
+        for directory in {os.path.dirname(path) for path in self.paths}:
+            if directory in self.dirs.values():
+                continue
+            descriptor = self.libc.inotify_add_watch(
+                self.fd, directory.encode(), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if descriptor < 0:
+                raise OSError(ctypes.get_errno(), f'cannot watch {directory!r}')
+            self.dirs[descriptor] = directory
+
+    def read(self, timeout=None):
+        '''
+        Wait up to `timeout` seconds (forever if None)
+        for changes, and return the changed paths.
+        Changes to other files in the same directories
+        are skipped, without returning.
+        '''
+        import select
+        import time
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if not select.select([self.fd], [], [], remaining)[0]:
+                return set()
+            data = os.read(self.fd, 1 << 16)
+            changed = set()
+            offset = 0
+            while offset < len(data):
+                descriptor, _, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0').decode(errors='replace')
+                offset += length
+                if descriptor in self.dirs:
+                    path = os.path.join(self.dirs[descriptor], name)
+                    if path in self.paths:
+                        changed.add(path)
+            if changed:
+                return changed
+
+    def close(self):
+        '''Stop watching.'''
+        os.close(self.fd)
+
+
+class Poller:
+    '''
+    Reports changes to a set of files by
+    checking their modification times,
+    for systems without inotify.
+    '''
+    INTERVAL = 0.25
+
+    def __init__(self):
+        self.mtimes = {}
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def watch(self, paths):
+        '''Report changes to `paths` (and only them) from now on.'''
+        self.mtimes = {
+            path: self.mtimes.get(path, self._mtime(path))
+            for path in map(os.path.realpath, paths)
+        }
+
+    def read(self, timeout=None):
+        '''
+        Wait up to `timeout` seconds (forever if None)
+        for changes, and return the changed paths.
+        '''
+        import time
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = set()
+            for path, mtime in self.mtimes.items():
+                new_mtime = self._mtime(path)
+                if new_mtime != mtime:
+                    self.mtimes[path] = new_mtime
+                    changed.add(path)
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.INTERVAL if deadline is None
+                       else max(0, min(self.INTERVAL, deadline - time.monotonic())))
+
+    def close(self):
+        '''Stop watching.'''
+
+
+def _interrupt(*_):
+    raise KeyboardInterrupt
+
+
+def _run_in_group(func, changed):
+    import signal
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_DFL)
+    func(changed)
+
+
+def watch(source, func, debounce=0.1):
+    '''
+    Call `func` now, and again whenever `source`
+    or a file it includes changes, until interrupted.
+    It is passed the set of changed paths (empty the first time).
+
+    Each call happens in a forked process of its own, with
+    everything imported so far already loaded, and is killed
+    together with everything it started when a new change arrives.
+    Changes are collected until none arrive for `debounce` seconds.
+    '''
+    import multiprocessing
+    import signal
+    import click
+    from .expand import included_paths
+
+    try:
+        watcher = Inotify()
+    except (OSError, AttributeError):
+        watcher = Poller()
+
+    context = multiprocessing.get_context('fork')
+    process = None
+    changed = set()
+
+    def stop():
+        if process is None:
+            return
+        if process.is_alive():
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                process.kill()
+        process.join()
+
+    # The calls run in process groups of their own, which
+    # signals from the terminal do not reach, so they are
+    # stopped whenever the watcher is.
+    signal.signal(signal.SIGTERM, _interrupt)
+    signal.signal(signal.SIGHUP, _interrupt)
+
+    try:
+        while True:
+            watcher.watch({source, *included_paths(source)})
+
+            stop()
+            process = context.Process(target=_run_in_group, args=(func, changed))
+            process.start()
+            try:
+                os.setpgid(process.pid, process.pid)
+            except (ProcessLookupError, PermissionError):
+                pass
+
+            changed = watcher.read()
+            while more := watcher.read(debounce):
+                changed |= more
+
+            click.echo(err=True)
+            click.secho(
+                'Changed: ' + ', '.join(map(os.path.relpath, sorted(changed))),
+                fg='blue', bold=True, err=True,
+            )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop()
+        watcher.close()
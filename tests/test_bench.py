@@ -0,0 +1,83 @@
+'''
+Tests for the statistics and comparisons of cpt bench.
+'''
+import importlib
+import math
+
+import pytest
+
+from competitive_programming_tools.bench import compare, percentile, sign_test, summarize
+from competitive_programming_tools.spawn import Usage
+
+# The package exports the command functions under the names of their modules.
+bench_module = importlib.import_module('competitive_programming_tools.bench')
+MB = 1 << 20
+
+
+def test_percentile():
+    values = [5, 1, 4, 2, 3]
+    assert percentile(values, 0) == 1
+    assert percentile(values, 0.2) == 1
+    assert percentile(values, 0.5) == 3
+    assert percentile(values, 0.95) == 5
+    assert percentile(values, 1) == 5
+    assert percentile(list(range(1, 101)), 0.95) == 95
+    assert percentile([7], 0.5) == 7
+
+
+def test_sign_test():
+    # No differences give no evidence either way.
+    assert sign_test([]) == 1.0
+    assert sign_test([(1, 1)] * 10) == 1.0
+    # Ties are left out, and the test is two-sided.
+    assert sign_test([(1, 2)] * 10 + [(3, 3)] * 5) == pytest.approx(2 / 2**10)
+    assert sign_test([(2, 1)] * 10) == sign_test([(1, 2)] * 10)
+    # Half wins and half losses is as likely as anything.
+    assert sign_test([(1, 2), (2, 1)] * 5) == 1.0
+    assert sign_test([(1, 2)] * 8 + [(2, 1)] * 2) == pytest.approx(
+        2 * sum(math.comb(10, k) for k in range(3)) / 2**10)
+
+
+def test_summarize():
+    minimum, median, p95, stdev = summarize([0.001, 0.002, 0.003])
+    assert (minimum, median, p95) == pytest.approx((1, 2, 3))
+    assert stdev == pytest.approx(1)
+    assert summarize([0.5])[3] == 0.0
+
+
+def fake_time_test(counts):
+    '''Time "executables" named by their instruction counts, with `counts` runs.'''
+    def time_test(executable, argv, input_path, counters=False):
+        counts.append(counters)
+        return 0, Usage(0.1, 0.01 * int(executable), MB,
+                        counters={'instructions': int(executable)} if counters else None), b'1\n'
+    return time_test
+
+
+@pytest.fixture
+def tests(tmp_path):
+    for name in ('a', 'b'):
+        (tmp_path / f'{name}.in').write_text('', encoding='utf-8')
+        (tmp_path / f'{name}.ans').write_text('1\n', encoding='utf-8')
+    return str(tmp_path), ['a', 'b']
+
+
+def test_compare_counters(tests, monkeypatch, capsys):
+    counts = []
+    monkeypatch.setattr(bench_module, 'time_test', fake_time_test(counts))
+    compare(['1000', '1500'], (), *tests, runs=3, warmup=1, counters=True)
+    assert all(counts) and len(counts) == 2 * 2 * 4
+    out = capsys.readouterr().out
+    assert 'instructions' in out
+    assert out.count('+50.0%') == 2
+
+
+def test_compare_without_counters(tests, monkeypatch, capsys):
+    counts = []
+    monkeypatch.setattr(bench_module, 'time_test', fake_time_test(counts))
+    compare(['1000', '1500'], (), *tests, runs=3, warmup=1)
+    assert not any(counts)
+    out = capsys.readouterr().out
+    assert 'instructions' not in out
+    # B takes 1.5 times as long as A in every round.
+    assert out.count('1.500x') == 3
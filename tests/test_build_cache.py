@@ -0,0 +1,142 @@
+'''
+Tests for evicting builds from the build cache.
+'''
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from competitive_programming_tools import build_cache, get_executable as get_executable_module
+from competitive_programming_tools.get_executable import get_executable
+from competitive_programming_tools.languages import C
+
+
+@pytest.fixture
+def build_dir(tmp_path, monkeypatch):
+    '''Keep the builds in a temporary directory.'''
+    build_dir = tmp_path / 'builds'
+    build_dir.mkdir()
+    monkeypatch.setattr(get_executable_module, 'TMP_DIR', str(tmp_path))
+    monkeypatch.setattr(build_cache, 'TMP_DIR', str(tmp_path))
+    monkeypatch.setattr(build_cache, 'BUILD_DIR', str(build_dir))
+    monkeypatch.setattr(build_cache, 'STATS_PATH', str(build_dir / 'stats.json'))
+    monkeypatch.setattr(build_cache, 'TOKEN_DIR', str(build_dir / 'tokens'))
+    return build_dir
+
+
+def add_build(build_dir, name, size, last_use, link_to=None):
+    '''Add a build of `size` bytes, or a hard link to `link_to`, last used at `last_use`.'''
+    path = build_dir / f'{name}.exe'
+    if link_to is None:
+        path.write_bytes(b'x' * size)
+    else:
+        os.link(build_dir / f'{link_to}.exe', path)
+    (build_dir / f'{name}.json').write_text('{"links": []}', encoding='utf-8')
+    return path, last_use
+
+
+def set_uses(*builds):
+    for path, last_use in builds:
+        os.utime(path, (last_use, last_use))
+
+
+def remaining(build_dir):
+    return sorted(path.stem for path in build_dir.glob('*.exe'))
+
+
+def test_evict_least_recently_used(build_dir):
+    set_uses(
+        add_build(build_dir, 'a', 100, 1),
+        add_build(build_dir, 'b', 100, 2),
+        add_build(build_dir, 'c', 100, 3),
+    )
+    build_cache.evict(size=250)
+    assert remaining(build_dir) == ['b', 'c']
+    assert not (build_dir / 'a.json').exists()
+    build_cache.evict(size=300)
+    assert remaining(build_dir) == ['b', 'c']
+
+
+def test_evict_keep(build_dir):
+    set_uses(
+        add_build(build_dir, 'a', 100, 1),
+        add_build(build_dir, 'b', 100, 2),
+    )
+    build_cache.evict(size=100, keep=str(build_dir / 'a.exe'))
+    assert remaining(build_dir) == ['a']
+
+
+def test_evict_counts_hard_links_once(build_dir):
+    # Two names of one 100 byte build take 100 bytes, so they fit.
+    set_uses(
+        add_build(build_dir, 'a', 100, 1),
+        add_build(build_dir, 'b', 0, 2, link_to='a'),
+        add_build(build_dir, 'c', 100, 3),
+    )
+    build_cache.evict(size=200)
+    assert remaining(build_dir) == ['a', 'b', 'c']
+
+    # Removing one name frees nothing, so both go before the newer build.
+    build_cache.evict(size=150)
+    assert remaining(build_dir) == ['c']
+
+
+def test_evict_token_entries(build_dir):
+    set_uses(
+        add_build(build_dir, 'a', 100, 1),
+        add_build(build_dir, 'b', 100, 2),
+    )
+    build_cache.record_tokens('ta', str(build_dir / 'a.exe'))
+    build_cache.record_tokens('tb', str(build_dir / 'b.exe'))
+    build_cache.evict(size=100)
+    assert build_cache.equivalent_build('ta') is None
+    assert build_cache.equivalent_build('tb') == str(build_dir / 'b.exe')
+    assert sorted(os.listdir(build_cache.TOKEN_DIR)) == ['tb']
+
+
+def test_evict_legacy_files(build_dir):
+    tmp_dir = build_dir.parent
+    legacy_source = tmp_dir / f'{"1" * 16}-{"2" * 16}.src'
+    legacy_executable = tmp_dir / f'{"1" * 16}-{"3" * 16}.exe'
+    other = tmp_dir / 'notes.src'
+    for path in (legacy_source, legacy_executable, other):
+        path.write_bytes(b'x')
+    build_cache.evict()
+    assert not legacy_source.exists()
+    assert not legacy_executable.exists()
+    assert other.exists()
+
+
+def test_evict_keeps_copied_executable(build_dir, monkeypatch):
+    # Where hard links fail, the executable is a copy of the build,
+    # which is named like the legacy executables.
+    def fail_link(*_):
+        raise OSError('no hard links here')
+    monkeypatch.setattr(os, 'link', fail_link)
+    monkeypatch.delenv('CPT_TOKEN_CACHE', raising=False)
+
+    source_path = build_dir.parent / 'solution.c'
+    source_path.write_text('int main() { return 7; }\n', encoding='utf-8')
+    executable_path = get_executable(source_path=str(source_path), debug_level=0,
+                                     extra_flags='', force_recompile=False)
+    assert os.stat(executable_path).st_nlink == 1
+    build_cache.evict()
+    assert os.path.exists(executable_path)
+    assert os.spawnv(os.P_WAIT, executable_path, [executable_path]) == 7
+
+
+def count_uses(count):
+    for _ in range(count):
+        build_cache.record_use('missing.exe', C, 0, False)
+
+
+def test_record_use_from_several_processes(build_dir):
+    processes = [multiprocessing.get_context('fork').Process(target=count_uses, args=(50,))
+                 for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    with open(build_cache.STATS_PATH, encoding='utf-8') as file:
+        assert json.load(file)['C 0'] == [0, 200]
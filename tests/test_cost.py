@@ -0,0 +1,93 @@
+'''
+Tests for counting the instructions of tests and comparing them against a baseline.
+'''
+import json
+import os
+import sys
+
+import click
+from click.testing import CliRunner
+
+from competitive_programming_tools import cost, main
+
+# Reports the size of the input as the instruction count, like cachegrind reports it.
+VALGRIND = f'''\
+#!{sys.executable}
+import sys
+count = 1000 * len(sys.stdin.buffer.read())
+print(f'==1== I   refs:      {{count:,}}', file=sys.stderr)
+'''
+
+
+def fake_valgrind(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    (bin_dir / 'valgrind').write_text(VALGRIND, encoding='utf-8')
+    (bin_dir / 'valgrind').chmod(0o755)
+    monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+
+
+def test_cachegrind_instructions(tmp_path, monkeypatch):
+    fake_valgrind(tmp_path, monkeypatch)
+    input_path = tmp_path / 'test.in'
+    input_path.write_text('x' * 1234, encoding='utf-8')
+    assert cost.cachegrind_instructions('true', (), str(input_path)) == 1234000
+
+
+def test_baseline(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    assert cost.baseline_path('samples/a') == 'samples/a.cost.json'
+    assert cost.load_baseline('a') == {}
+    cost.save_baseline('a', {'a_1': 10, 'a_2': 20})
+    assert cost.load_baseline('a') == {'a_1': 10, 'a_2': 20}
+
+
+def test_format_change():
+    assert click.unstyle(cost.format_change(101, 100)) == '  +1.00%'
+    assert click.unstyle(cost.format_change(50, 100, width=0)) == '-50.00%'
+    assert click.unstyle(cost.format_change(5, None)) == '   (new)'
+    # Changes below half a percent are not colored.
+    assert cost.format_change(1001, 1000) == click.style('  +0.10%')
+    assert cost.format_change(1100, 1000) == click.style(' +10.00%', fg='red')
+    assert cost.format_change(900, 1000) == click.style(' -10.00%', fg='green')
+
+
+def run_cost(tmp_path, *options):
+    result = CliRunner().invoke(main, [
+        'run', 'main.c', '-T', 'samples/main', '--cost=instructions', *options])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_run_cost(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('CPT_CACHE', raising=False)
+    fake_valgrind(tmp_path, monkeypatch)
+    monkeypatch.setattr(cost, 'instruction_counter', lambda: 'cachegrind')
+    (tmp_path / 'main.c').write_text('int main() {}\n', encoding='utf-8')
+    (tmp_path / 'samples').mkdir()
+    for name, size in (('main_1', 1), ('main_2', 2)):
+        (tmp_path / 'samples' / f'{name}.in').write_text('x' * size, encoding='utf-8')
+
+    output = run_cost(tmp_path)
+    assert '1.00k instr    (new)' in output
+    assert '2.00k instr    (new)' in output
+    baseline_path = tmp_path / 'samples' / 'main.cost.json'
+    assert json.loads(baseline_path.read_text(encoding='utf-8')) == {'main_1': 1000, 'main_2': 2000}
+
+    (tmp_path / 'samples' / 'main_2.in').write_text('x' * 3, encoding='utf-8')
+    output = run_cost(tmp_path)
+    assert '3.00k instr  +50.00%' in output
+    assert 'Instructions against the baseline: +33.33%' in click.unstyle(output)
+    # The baseline is only replaced when asked.
+    assert json.loads(baseline_path.read_text(encoding='utf-8'))['main_2'] == 2000
+    run_cost(tmp_path, '--save-baseline')
+    assert json.loads(baseline_path.read_text(encoding='utf-8'))['main_2'] == 3000
+
+
+def test_run_cost_needs_compiled_language(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'solution.py').write_text('', encoding='utf-8')
+    result = CliRunner().invoke(main, [
+        'run', 'solution.py', '-T', 'samples/solution', '--cost=instructions'])
+    assert 'unsupported for' in result.output
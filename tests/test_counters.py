@@ -0,0 +1,59 @@
+'''
+Tests for counting hardware events of programs.
+'''
+import asyncio
+import sys
+
+from click.testing import CliRunner
+
+from competitive_programming_tools import main
+from competitive_programming_tools.run import format_count, format_usage
+from competitive_programming_tools.spawn import COUNTER_NAMES, DEVNULL, Usage, spawn
+
+LOOP = 'for _ in range(10**6): pass\n'
+
+
+def usage_of(code, counters):
+    async def run_async():
+        proc = await spawn([sys.executable, '-c', code], stdout=DEVNULL, counters=counters)
+        await proc.wait()
+        return proc.usage
+    return asyncio.run(run_async())
+
+
+def test_counters_only_when_asked():
+    assert usage_of('pass', False).counters is None
+    counters = usage_of('pass', True).counters
+    # Empty where perf events are not permitted.
+    assert counters is not None and set(counters) <= set(COUNTER_NAMES)
+
+
+def test_counters_grow_with_work():
+    few = usage_of('pass', True).counters
+    many = usage_of(LOOP, True).counters
+    if 'instructions' in few and 'instructions' in many:
+        assert many['instructions'] > few['instructions'] + 10**7
+
+
+def test_format_counts():
+    assert format_count(999) == '999'
+    assert format_count(1234) == '1.23k'
+    assert format_count(5 * 10**6) == '5.00M'
+    assert format_count(2 * 10**9) == '2.00G'
+    usage = Usage(0.5, 0.25, 3 << 20, counters={'instructions': 1500, 'cycles': 10})
+    assert format_usage(usage) == '500 ms wall, 250 ms cpu, 3.0 MB, 1.50k instructions, 10 cycles'
+
+
+def test_run_with_counters(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('CPT_CACHE', raising=False)
+    (tmp_path / 'solution.py').write_text(LOOP, encoding='utf-8')
+    (tmp_path / 'samples').mkdir()
+    (tmp_path / 'samples' / 'solution_1.in').write_text('', encoding='utf-8')
+    result = CliRunner().invoke(main, ['run', 'solution.py', '-d', '1', '--counters'])
+    assert result.exit_code == 0, result.output
+    counted = usage_of('pass', True).counters
+    if counted:
+        assert ' instructions' in result.output
+    else:
+        assert 'no hardware events could be counted' in result.output
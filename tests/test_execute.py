@@ -0,0 +1,76 @@
+'''
+Tests for echoing the output of programs.
+'''
+import pytest
+
+from competitive_programming_tools import utils
+from competitive_programming_tools.execute import OutputCapture, OutputEcho
+
+
+@pytest.fixture(autouse=True)
+def tmp_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, 'TMP_DIR', str(tmp_path))
+    return tmp_path
+
+
+def echo(chunks, **kwargs):
+    output = OutputEcho(False, **kwargs)
+    for stream, data in chunks:
+        output.write(stream, data)
+    output.finish()
+    return output
+
+
+def test_echoes_whole_lines(capsys):
+    output = OutputEcho(False)
+    output.write('stdout', b'ab')
+    assert capsys.readouterr().out == ''
+    output.write('stdout', b'c\nde')
+    assert capsys.readouterr().out == 'abc\n'
+    output.write('stderr', b'err\n')
+    output.finish()
+    captured = capsys.readouterr()
+    assert captured.out == 'de'
+    assert captured.err == 'err\n'
+
+
+def test_echoes_huge_lines(capsys):
+    output = OutputEcho(False)
+    output.write('stdout', b'x' * (OutputEcho.CHUNK_SIZE + 1))
+    assert capsys.readouterr().out == 'x' * (OutputEcho.CHUNK_SIZE + 1)
+
+
+def test_styles_stderr(capsys):
+    output = OutputEcho(True)
+    output.write('stderr', b'a\nb\n')
+    output.finish()
+    lines = capsys.readouterr().err.splitlines()
+    assert lines[0].endswith('STDERR | a') and lines[1].endswith('       | b')
+
+
+def test_preview(tmp_dir, capsys):
+    lines = [f'{index}\n'.encode() for index in range(100)]
+    echo([('stdout', b''.join(lines[:50])), ('stderr', b'oops\n'),
+          ('stdout', b''.join(lines[50:]))], preview_lines=3, name='test')
+    captured = capsys.readouterr()
+    assert captured.out == '0\n1\n2\n97\n98\n99\n'
+    assert '... 95 lines omitted ...' in captured.err
+    assert 'stdout: 290 bytes, 100 lines; stderr: 5 bytes, 1 lines' in captured.err
+    assert (tmp_dir / 'output' / 'test.out').read_bytes() == b''.join(lines)
+    assert (tmp_dir / 'output' / 'test.err').read_bytes() == b'oops\n'
+
+
+def test_short_preview(capsys):
+    echo([('stdout', b'1\n2\n')], preview_lines=3)
+    captured = capsys.readouterr()
+    assert captured.out == '1\n2\n'
+    assert 'omitted' not in captured.err
+
+
+def test_capture():
+    capture = OutputCapture()
+    capture.write('stdout', b'a')
+    capture.write('stderr', b'b')
+    capture.write('stdout', b'c')
+    capture.finish()
+    assert capture.stdout == b'ac'
@@ -0,0 +1,237 @@
+'''
+Tests for keying builds on their content and reusing them.
+'''
+import asyncio
+import json
+import os
+
+import pytest
+
+from competitive_programming_tools import build_cache, get_executable as get_executable_module
+from competitive_programming_tools.get_executable import (
+    get_executable, get_executables, normalize_tokens, records_lines, token_key,
+)
+from competitive_programming_tools.languages import C, CPP
+
+PROGRAM = '''\
+#include <stdio.h>
+int main() {
+    printf("%d\\n", 1 + 2);
+}
+'''
+
+REFORMATTED = '''\
+#include <stdio.h>
+// Prints 3.
+int main(){printf("%d\\n",1+2);
+}
+'''
+
+CHANGED = '''\
+#include <stdio.h>
+int main() {
+    printf("%d\\n", 1 + 3);
+}
+'''
+
+
+def test_normalize_tokens():
+    assert normalize_tokens(b'int  main(){\n\treturn 0;}') == b'int main ( ) { return 0 ; }'
+    assert normalize_tokens(b'a+++b') == normalize_tokens(b'a ++ + b')
+    assert normalize_tokens(b'a+++b') != normalize_tokens(b'a + ++b')
+    assert normalize_tokens(b'"a  b"') == b'"a  b"'
+    assert normalize_tokens(b'R"x( a  b )x"') == b'R"x( a  b )x"'
+    assert normalize_tokens(b"1'000 1.5e-3 0x1p+4") == b"1'000 1.5e-3 0x1p+4"
+    assert normalize_tokens(b'x<<=1') == b'x <<= 1'
+
+
+def test_records_lines():
+    for lang, expected in ((C, [False, True, True, True]), (CPP, [False, False, True, True])):
+        assert [
+            records_lines(lang.get_compile_command_gen(debug_level=debug_level, extra_flags=''))
+            for debug_level in range(len(lang.debug_levels))
+        ] == expected
+    command = CPP.get_compile_command_gen(debug_level=0, extra_flags='-g')
+    assert records_lines(command)
+    command = CPP.get_compile_command_gen(debug_level=0, extra_flags='-pg')
+    assert records_lines(command)
+
+
+def key_of(tmp_path, code, debug_level=0, extra_flags=''):
+    source_path = tmp_path / f'source{abs(hash(code))}.c'
+    source_path.write_text(code, encoding='utf-8')
+    command = C.get_compile_command_gen(debug_level=debug_level, extra_flags=extra_flags)
+    return asyncio.run(token_key(command, str(source_path)))
+
+
+def test_token_key(tmp_path):
+    key = key_of(tmp_path, PROGRAM)
+    assert key is not None
+    assert key_of(tmp_path, REFORMATTED) == key
+    assert key_of(tmp_path, CHANGED) != key
+    assert key_of(tmp_path, PROGRAM, extra_flags='-DX') != key
+    assert key_of(tmp_path, '#include "missing.h"\n') is None
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    '''Keep the builds in a temporary directory, with the token cache enabled.'''
+    build_dir = tmp_path / 'builds'
+    monkeypatch.setattr(get_executable_module, 'TMP_DIR', str(tmp_path))
+    monkeypatch.setattr(build_cache, 'TMP_DIR', str(tmp_path))
+    monkeypatch.setattr(build_cache, 'BUILD_DIR', str(build_dir))
+    monkeypatch.setattr(build_cache, 'STATS_PATH', str(build_dir / 'stats.json'))
+    monkeypatch.setattr(build_cache, 'TOKEN_DIR', str(build_dir / 'tokens'))
+    monkeypatch.setenv('CPT_TOKEN_CACHE', '1')
+    return tmp_path
+
+
+def build_twice(cache_dir, debug_level):
+    '''Build PROGRAM and REFORMATTED, and get the hits and misses.'''
+    for name, code in (('first.c', PROGRAM), ('second.c', REFORMATTED)):
+        source_path = cache_dir / name
+        source_path.write_text(code, encoding='utf-8')
+        get_executable(source_path=str(source_path), debug_level=debug_level,
+                       extra_flags='', force_recompile=False)
+    with open(build_cache.STATS_PATH, encoding='utf-8') as file:
+        return json.load(file)[f'C {debug_level}']
+
+
+def test_token_cache_reuses_build(cache_dir):
+    assert build_twice(cache_dir, 0) == [1, 1]
+
+
+def test_token_cache_skips_debug_info(cache_dir):
+    # The line numbers in the debug info of the first build
+    # would be wrong for the second source.
+    assert build_twice(cache_dir, 1) == [0, 2]
+
+
+def build_and_run(source_path, force_recompile=False):
+    '''Build a source at -d 0, and get the exit code of running it.'''
+    executable_path = get_executable(source_path=str(source_path), debug_level=0,
+                                     extra_flags='', force_recompile=force_recompile)
+    return os.spawnv(os.P_WAIT, executable_path, [executable_path])
+
+
+def uses(debug_level=0):
+    with open(build_cache.STATS_PATH, encoding='utf-8') as file:
+        return json.load(file)[f'C {debug_level}']
+
+
+def test_builds_keyed_on_headers(cache_dir):
+    source_path = cache_dir / 'main.c'
+    header_path = cache_dir / 'value.h'
+    source_path.write_text('#include "value.h"\nint main() { return VALUE; }\n', encoding='utf-8')
+    header_path.write_text('#define VALUE 1\n', encoding='utf-8')
+    assert build_and_run(source_path) == 1
+
+    header_path.write_text('#define VALUE 2\n', encoding='utf-8')
+    assert build_and_run(source_path) == 2
+    assert uses() == [0, 2]
+
+    # The first build is still there.
+    header_path.write_text('#define VALUE 1\n', encoding='utf-8')
+    assert build_and_run(source_path) == 1
+    assert uses() == [1, 2]
+
+
+def test_builds_shared_by_copies(cache_dir):
+    for directory in ('a', 'b'):
+        (cache_dir / directory).mkdir()
+        (cache_dir / directory / 'main.c').write_text('int main() { return 3; }\n', encoding='utf-8')
+        assert build_and_run(cache_dir / directory / 'main.c') == 3
+    assert uses() == [1, 1]
+
+    assert build_and_run(cache_dir / 'a' / 'main.c', force_recompile=True) == 3
+    assert uses() == [1, 2]
+
+
+def test_watch_does_not_force_recompiles(tmp_path, monkeypatch):
+    from competitive_programming_tools import watch as watch_module
+    from competitive_programming_tools.run import run
+
+    source_path = tmp_path / 'main.c'
+    header_path = tmp_path / 'value.h'
+    source_path.write_text('#include "value.h"\nint main() {}\n', encoding='utf-8')
+    header_path.write_text('', encoding='utf-8')
+    (tmp_path / 'samples').mkdir()
+
+    forced = []
+
+    def fake_get_executable(**build):
+        forced.append(build['force_recompile'])
+        raise get_executable_module.CompileError(1)
+
+    def fake_watch(_, func):
+        func(set())
+        func({str(header_path)})
+
+    monkeypatch.setattr(get_executable_module, 'get_executable', fake_get_executable)
+    monkeypatch.setattr(watch_module, 'watch', fake_watch)
+    run(str(source_path), (), 0, False, '', str(tmp_path / 'samples' / 'main'), None,
+        False, 1, None, None, None, False, watch=True)
+    assert forced == [False, False]
+
+
+def counted_compiles(monkeypatch):
+    '''Slow down compiles, and count them and how many ran at once.'''
+    from competitive_programming_tools import spawn
+
+    run_command = spawn.run_command
+    compiles = {'count': 0, 'running': 0, 'most_running': 0}
+
+    async def slow_run_command(argv, capture=False):
+        compiles['count'] += 1
+        compiles['running'] += 1
+        compiles['most_running'] = max(compiles['most_running'], compiles['running'])
+        try:
+            await asyncio.sleep(0.2)
+            return await run_command(argv, capture)
+        finally:
+            compiles['running'] -= 1
+
+    monkeypatch.setattr(spawn, 'run_command', slow_run_command)
+    return compiles
+
+
+def builds_of(cache_dir, codes):
+    builds = []
+    for index, code in enumerate(codes):
+        source_path = cache_dir / f'main{index}.c'
+        source_path.write_text(code, encoding='utf-8')
+        builds.append(dict(source_path=str(source_path), debug_level=0,
+                           extra_flags='', force_recompile=False))
+    return builds
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_get_executables(cache_dir, monkeypatch, jobs):
+    compiles = counted_compiles(monkeypatch)
+    builds = builds_of(cache_dir, [f'int main() {{ return {code}; }}\n' for code in range(3)])
+    executable_paths = get_executables(builds, jobs)
+    assert [os.spawnv(os.P_WAIT, path, [path]) for path in executable_paths] == [0, 1, 2]
+    assert compiles == {'count': 3, 'running': 0, 'most_running': jobs}
+
+
+def test_get_executables_same_source(cache_dir, monkeypatch):
+    compiles = counted_compiles(monkeypatch)
+    builds = builds_of(cache_dir, [PROGRAM])
+    assert len(set(get_executables(builds * 2, 2))) == 1
+    assert compiles['count'] == 1
+
+
+def test_get_executables_failing(cache_dir, monkeypatch, capsys):
+    counted_compiles(monkeypatch)
+    builds = builds_of(cache_dir, [PROGRAM, 'int main() { error_here }\n', CHANGED])
+    with pytest.raises(get_executable_module.CompileError):
+        get_executables(builds, 2)
+    # The other builds are finished and cached.
+    assert uses() == [0, 3]
+    assert len(list((cache_dir / 'builds').glob('*.exe'))) == 2
+
+    # The diagnostics come right after the build they are about.
+    blocks = capsys.readouterr().err.split('Compiling ')[1:]
+    assert len(blocks) == 3
+    for block in blocks:
+        assert ('error_here' in block) == ('main1.c' in block.splitlines()[0])
@@ -0,0 +1,102 @@
+'''
+Tests for the checkers and the verdicts depending on them.
+'''
+import sys
+
+import click
+import pytest
+
+from competitive_programming_tools.lenient_checker import LenientChecker, StreamingChecker
+from competitive_programming_tools.limits import Limits
+from competitive_programming_tools.run import run_test
+
+CASES = [
+    ('1 2 3\n', '1 2 3\n'),
+    ('1 2 3', '1 2 3\n'),
+    ('1  2\n3\n', '1 2 3\n'),
+    ('\n1 2 3\n\n', '1 2 3\n'),
+    ('YES\n', 'yes\n'),
+    ('0.3333\n', '0.333333\n'),
+    ('0.5\n', '0.7\n'),
+    ('1 2\n', '1 2 3\n'),
+    ('1 2 3 4\n', '1 2 3\n'),
+    ('', '\n'),
+    ('', ''),
+    ('\n', ''),
+    ('a\tb\r\n', 'a b\n'),
+    ('héllo wörld\n', 'héllo wörld\n'),
+    ('héllo\n', 'hello\n'),
+]
+
+
+def streaming_result(tmp_path, output, answer, chunk_size):
+    '''Check `output` fed to a StreamingChecker `chunk_size` bytes at a time.'''
+    answer_path = tmp_path / 'answer.ans'
+    answer_path.write_text(answer, encoding='utf-8')
+    checker = StreamingChecker(str(answer_path))
+    data = output.encode()
+    for start in range(0, len(data), chunk_size):
+        if not checker.feed(data[start:start + chunk_size]):
+            break
+    return checker.finish()
+
+
+@pytest.mark.parametrize('output, answer', CASES)
+@pytest.mark.parametrize('chunk_size', [1, 2, 1 << 20])
+def test_streaming_matches_lenient(tmp_path, monkeypatch, output, answer, chunk_size):
+    monkeypatch.setattr(StreamingChecker, 'CHUNK_SIZE', chunk_size)
+    expected = LenientChecker(output, answer)
+    result = streaming_result(tmp_path, output, answer, chunk_size)
+    assert result.accept == expected.accept
+    if expected.accept:
+        assert result.ignored_properties == expected.ignored_properties
+        assert result.warnings.keys() == expected.warnings.keys()
+
+
+def test_streaming_rejects_early(tmp_path, monkeypatch):
+    monkeypatch.setattr(StreamingChecker, 'CHUNK_SIZE', 1)
+    answer_path = tmp_path / 'answer.ans'
+    answer_path.write_text('1\n' * 10, encoding='utf-8')
+    checker = StreamingChecker(str(answer_path))
+    assert checker.feed(b'1\n')
+    assert not checker.feed(b'2\n')
+    assert checker.rejected
+    assert not checker.finish().accept
+
+
+def verdict(tmp_path, program, answer):
+    '''Get the verdict of a python program on a test with `answer`.'''
+    source_path = tmp_path / 'solution.py'
+    source_path.write_text(program, encoding='utf-8')
+    (tmp_path / 'test.in').write_text('', encoding='utf-8')
+    (tmp_path / 'test.ans').write_text(answer, encoding='utf-8')
+    verdict_str, _ = run_test(
+        f'{sys.executable} {source_path}', None, (), True,
+        str(tmp_path), 'test', Limits(time=10), None,
+    )
+    return click.unstyle(verdict_str)
+
+
+@pytest.mark.parametrize('lines', [10, 100000])
+def test_crash_after_wrong_output_is_re(tmp_path, lines):
+    assert verdict(tmp_path, (
+        'import sys\n'
+        f'sys.stdout.write("2\\n" * {lines})\n'
+        'sys.stdout.flush()\n'
+        'sys.exit(3)\n'
+    ), '1\n' * lines) == 'RE'
+
+
+def test_wrong_output_is_wa(tmp_path):
+    assert verdict(tmp_path, 'print(2)\n', '1\n') == 'WA'
+
+
+def test_endless_wrong_output_is_wa(tmp_path):
+    assert verdict(tmp_path, (
+        'while True:\n'
+        '    print(2)\n'
+    ), '1\n') == 'WA'
+
+
+def test_right_output_is_ac(tmp_path):
+    assert verdict(tmp_path, 'print(1)\n', '1\n') == 'AC'
@@ -0,0 +1,68 @@
+'''
+Tests for enforcing the limits and the verdicts of exceeding them.
+'''
+import asyncio
+import sys
+
+from competitive_programming_tools.limits import Limits
+from competitive_programming_tools.spawn import DEVNULL, Usage, get_runner, spawn
+
+MB = 1 << 20
+
+
+def test_exceeded():
+    limits = Limits(time=1.0, memory=256 * MB)
+    assert limits.exceeded(Usage(0.5, 0.5, 10 * MB)) is None
+    assert limits.exceeded(Usage(1.5, 1.01, 10 * MB)) == 'TLE'
+    assert limits.exceeded(Usage(limits.wall_time, 0.1, 10 * MB)) == 'TLE'
+    assert limits.exceeded(Usage(0.5, 0.5, 257 * MB)) == 'MLE'
+    assert Limits().exceeded(Usage(100.0, 100.0, 1 << 40)) is None
+
+
+def test_exceeded_when_killed():
+    # The measured usage may be just under the limits the runner enforced.
+    limits = Limits(time=1.0, memory=256 * MB)
+    assert limits.exceeded(Usage(1.0, 0.99, 10 * MB, killed='TLE')) == 'TLE'
+    assert limits.exceeded(Usage(0.5, 0.5, 255 * MB, killed='MLE')) == 'MLE'
+
+
+def run(code, limits):
+    async def run_async():
+        proc = await spawn([sys.executable, '-c', code],
+                           stdout=DEVNULL, stderr=DEVNULL, limits=limits)
+        return await proc.wait(), proc.usage
+    return asyncio.run(run_async())
+
+
+def test_runner_kills_for_memory():
+    assert get_runner() is not None
+    limits = Limits(time=10.0, memory=64 * MB)
+    returncode, usage = run(
+        'import time\nb = b"x" * (512 << 20)\ntime.sleep(10)\n', limits)
+    assert returncode == -9
+    assert usage.killed == 'MLE'
+    assert limits.exceeded(usage) == 'MLE'
+
+
+def test_runner_kills_for_cpu_time():
+    limits = Limits(time=0.3)
+    returncode, usage = run('while True: pass\n', limits)
+    assert returncode == -9
+    assert usage.killed == 'TLE'
+    assert 0.3 <= usage.cpu_time < 0.5
+    assert limits.exceeded(usage) == 'TLE'
+
+
+def test_runner_kills_for_wall_time():
+    limits = Limits(time=0.2)
+    returncode, usage = run('import time\ntime.sleep(10)\n', limits)
+    assert returncode == -9
+    assert usage.killed == 'TLE'
+    assert limits.exceeded(usage) == 'TLE'
+
+
+def test_runner_reports_usage():
+    returncode, usage = run('import sys\nsys.exit(3)\n', Limits(time=10.0, memory=1 << 30))
+    assert returncode == 3
+    assert usage.killed is None
+    assert 0 < usage.cpu_time < 10 and usage.max_rss > MB
@@ -0,0 +1,116 @@
+'''
+Tests for precompiling headers and using them in builds.
+'''
+import importlib
+import json
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from competitive_programming_tools import build_cache, main
+from competitive_programming_tools import get_executable as get_executable_module
+from competitive_programming_tools.get_executable import get_executable
+from competitive_programming_tools.mkpch import included_headers, pch_flags, pch_identity
+
+# The package exports the mkpch command under the name of the module.
+mkpch_module = importlib.import_module('competitive_programming_tools.mkpch')
+
+
+@pytest.fixture
+def pch_dir(tmp_path, monkeypatch):
+    '''Keep the precompiled headers and builds in a temporary directory.'''
+    build_dir = tmp_path / 'builds'
+    monkeypatch.setattr(mkpch_module, 'TMP_DIR', str(tmp_path))
+    monkeypatch.setattr(mkpch_module, 'PCH_DIR', str(tmp_path / 'include'))
+    monkeypatch.setattr(get_executable_module, 'TMP_DIR', str(tmp_path))
+    monkeypatch.setattr(build_cache, 'TMP_DIR', str(tmp_path))
+    monkeypatch.setattr(build_cache, 'BUILD_DIR', str(build_dir))
+    monkeypatch.setattr(build_cache, 'STATS_PATH', str(build_dir / 'stats.json'))
+    monkeypatch.setattr(build_cache, 'TOKEN_DIR', str(build_dir / 'tokens'))
+    return tmp_path / 'include'
+
+
+@pytest.fixture
+def rebuilds(monkeypatch):
+    '''Record the headers rebuilt in the background, instead of rebuilding them.'''
+    headers = []
+    monkeypatch.setattr(mkpch_module, 'rebuild_in_background', headers.append)
+    return headers
+
+
+def test_included_headers(tmp_path, monkeypatch):
+    monkeypatch.delenv('CPT_EXPAND_PATH', raising=False)
+    (tmp_path / 'local.h').write_text('#include <map>\n#include "missing.h"\n', encoding='utf-8')
+    source_path = tmp_path / 'main.cpp'
+    source_path.write_text(
+        '#include <vector>\n#include "local.h"\n  #include <bits/stdc++.h>  \n'
+        '// #include <set>\nint main() {}\n',
+        encoding='utf-8',
+    )
+    assert included_headers(str(source_path)) == {'vector', 'map', 'bits/stdc++.h'}
+
+
+def test_pch_flags(tmp_path, pch_dir, rebuilds):
+    source_path = tmp_path / 'main.cpp'
+    source_path.write_text('#include <vector>\nint main() {}\n', encoding='utf-8')
+    assert pch_flags(str(source_path), 0) == ''
+
+    # Variants built with other flags are rebuilt.
+    (pch_dir / 'vector.gch').mkdir(parents=True)
+    assert pch_flags(str(source_path), 0) == f'-I {pch_dir}'
+    assert rebuilds == ['vector']
+
+    metadata_path = pch_dir / 'vector.gch.json'
+    metadata_path.write_text(json.dumps({'0': pch_identity(0)}), encoding='utf-8')
+    assert pch_flags(str(source_path), 0) == f'-I {pch_dir}'
+    assert pch_flags(str(source_path), 1) == f'-I {pch_dir}'
+    assert rebuilds == ['vector', 'vector']
+
+    # Unless the compiler failed to build them before.
+    failures_path = pch_dir / 'vector.gch.failed.json'
+    failures_path.write_text(json.dumps([pch_identity(1)['compiler']]), encoding='utf-8')
+    assert pch_flags(str(source_path), 1) == f'-I {pch_dir}'
+    assert rebuilds == ['vector', 'vector']
+
+
+def test_mkpch(tmp_path, pch_dir, rebuilds):
+    result = CliRunner().invoke(main, ['mkpch', 'cstdint'])
+    assert result.exit_code == 0, result.output
+    assert sorted(path.name for path in (pch_dir / 'cstdint.gch').iterdir()) == [
+        f'{debug_level}.gch' for debug_level in range(4)]
+    metadata = json.loads((pch_dir / 'cstdint.gch.json').read_text(encoding='utf-8'))
+    assert metadata == {str(debug_level): pch_identity(debug_level) for debug_level in range(4)}
+    assert json.loads((pch_dir / 'cstdint.gch.failed.json').read_text(encoding='utf-8')) == []
+
+    # The builds use them, without rebuilding them.
+    source_path = tmp_path / 'main.cpp'
+    source_path.write_text('#include <cstdint>\nint main() { return INT8_C(7); }\n', encoding='utf-8')
+    executable_path = get_executable(source_path=str(source_path), debug_level=0,
+                                     extra_flags='', force_recompile=False)
+    assert os.spawnv(os.P_WAIT, executable_path, [executable_path]) == 7
+    assert rebuilds == []
+
+
+def test_mkpch_failing(pch_dir, rebuilds):
+    result = CliRunner().invoke(main, ['mkpch', 'no_such_header'])
+    assert 'failed compiling' in result.output
+    failed = json.loads((pch_dir / 'no_such_header.gch.failed.json').read_text(encoding='utf-8'))
+    assert failed == [pch_identity(0)['compiler']]
+    assert not (pch_dir / 'no_such_header.gch.json').exists()
+
+
+def test_mkpch_background_skips_when_locked(pch_dir):
+    import fcntl
+
+    (pch_dir / 'cstdint.gch').mkdir(parents=True)
+    lock_fd = os.open(pch_dir / 'cstdint.gch.lock', os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX)
+        assert mkpch_module.is_locked('cstdint')
+        result = CliRunner().invoke(main, ['mkpch', '--background', 'cstdint'])
+        assert result.exit_code == 0, result.output
+        assert list((pch_dir / 'cstdint.gch').iterdir()) == []
+    finally:
+        os.close(lock_fd)
+    assert not mkpch_module.is_locked('cstdint')
@@ -0,0 +1,100 @@
+'''
+Tests for profiling solutions.
+'''
+import shutil
+import sys
+
+import pytest
+from click.testing import CliRunner
+
+from competitive_programming_tools import main, utils
+from competitive_programming_tools.profiler import (
+    GPROF_ROW, PERF_ROW, parse_rows, profiled_command,
+)
+
+PYTHON_SOLUTION = '''\
+def hot():
+    return sum(i * i for i in range(2 * 10**6))
+
+
+def cold():
+    return 1
+
+
+print(hot() + cold())
+'''
+
+C_SOLUTION = '''\
+#include <stdio.h>
+
+static volatile unsigned long long sink;
+
+__attribute__((noinline)) void hot(void) {
+    for (unsigned long long i = 0; i < 400000000ULL; ++i) sink += i * i;
+}
+
+int main(void) {
+    hot();
+    printf("%llu\\n", sink);
+}
+'''
+
+
+def test_parse_perf_rows():
+    report = '''\
+# Overhead       Samples  Symbol
+# ........  ............  ......
+#
+    60.00%           600  [.] hot
+    30.00%           300  [.] main
+    10.00%           100  [k] 0xffffffff
+'''
+    assert parse_rows(PERF_ROW, report, int) == {'hot': 600, 'main': 300, '0xffffffff': 100}
+
+
+def test_parse_gprof_rows():
+    report = '''\
+Flat profile:
+
+Each sample counts as 0.01 seconds.
+  %   cumulative   self              self     total
+ time   seconds   seconds    calls  ms/call  ms/call  name
+ 75.00      0.30     0.30        1   300.00   300.00  hot
+ 25.00      0.40     0.10                             main
+'''
+    assert parse_rows(GPROF_ROW, report, float) == pytest.approx({'hot': 0.3, 'main': 0.1})
+
+
+def test_profiled_command():
+    assert profiled_command('perf', './a b', 'out').startswith('perf record ')
+    assert profiled_command('perf', './a b', 'out').endswith(" -o out -- ./a b")
+    assert profiled_command('gprof', "'./my exe'", 'out') == "env GMON_OUT_PREFIX=out './my exe'"
+    assert profiled_command('cProfile', 'python a.py', 'out') == 'python -m cProfile -o out a.py'
+
+
+def profile(tmp_path, monkeypatch, name, code, *options):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(utils, 'TMP_DIR', str(tmp_path / 'tmp'))
+    (tmp_path / name).write_text(code, encoding='utf-8')
+    (tmp_path / 'samples').mkdir()
+    stem = name.rsplit('.', 1)[0]
+    (tmp_path / 'samples' / f'{stem}_1.in').write_text('', encoding='utf-8')
+    result = CliRunner().invoke(main, ['run', name, '--profile', *options])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_profile_python(tmp_path, monkeypatch):
+    output = profile(tmp_path, monkeypatch, 'solution.py', PYTHON_SOLUTION, '-d', '1')
+    table = output[output.index('Hot functions:'):].splitlines()[1:]
+    # The time is counted in the functions themselves, not their callers.
+    assert table[0].endswith('<genexpr> (solution.py:2)')
+    assert 'hot (solution.py:1)' in output and 'cold (solution.py:5)' in output
+
+
+@pytest.mark.skipif(not shutil.which('gprof'), reason='gprof is not installed')
+def test_profile_c(tmp_path, monkeypatch):
+    output = profile(tmp_path, monkeypatch, 'solution.c', C_SOLUTION, '-d', '0')
+    functions = output[output.index('Hot functions:'):output.index('Hot lines:')]
+    assert functions.splitlines()[1].endswith('hot')
+    assert 'solution.c:' in output[output.index('Hot lines:'):]
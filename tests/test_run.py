@@ -0,0 +1,55 @@
+'''
+Tests for running solutions on their tests.
+'''
+from click.testing import CliRunner
+
+from competitive_programming_tools import main
+
+# The earlier tests take longer, so they finish last when run in parallel.
+SOLUTION = '''\
+import time
+n = int(input())
+time.sleep((3 - n) * 0.2)
+print(n)
+'''
+
+
+def make_tests(tmp_path, solution=SOLUTION, answers=('1', '2', '3')):
+    (tmp_path / 'solution.py').write_text(solution, encoding='utf-8')
+    (tmp_path / 'samples').mkdir()
+    for index, answer in enumerate(answers, 1):
+        (tmp_path / 'samples' / f'solution_{index}.in').write_text(f'{index}\n', encoding='utf-8')
+        (tmp_path / 'samples' / f'solution_{index}.ans').write_text(f'{answer}\n', encoding='utf-8')
+
+
+def run(tmp_path, monkeypatch, *options):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('CPT_CACHE', raising=False)
+    result = CliRunner().invoke(main, ['run', 'solution.py', '-d', '1', *options])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_parallel_output_in_order(tmp_path, monkeypatch):
+    make_tests(tmp_path)
+    output = run(tmp_path, monkeypatch, '-j', '3')
+    positions = [output.index(f"Running test 'solution_{index}'") for index in (1, 2, 3)]
+    assert positions == sorted(positions)
+    # The output of each test comes right after it starts.
+    for index, position in enumerate(positions, 1):
+        assert output[position:].split('\n')[1] == str(index)
+    summary = output[output.index('Summary:'):].splitlines()[1:]
+    assert [line.split()[:2] for line in summary] == [
+        [f'[solution_{index}]', 'AC'] for index in (1, 2, 3)]
+
+
+def test_parallel_matches_serial(tmp_path, monkeypatch):
+    make_tests(tmp_path, answers=('1', '5', '3'))
+
+    def verdicts(output):
+        summary = output[output.index('Summary:'):].splitlines()[1:]
+        return [line.split()[:2] for line in summary]
+
+    serial = verdicts(run(tmp_path, monkeypatch))
+    assert serial == [['[solution_1]', 'AC'], ['[solution_2]', 'WA'], ['[solution_3]', 'AC']]
+    assert verdicts(run(tmp_path, monkeypatch, '-j', '2')) == serial
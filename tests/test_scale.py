@@ -0,0 +1,47 @@
+'''
+Tests for fitting complexity models to run times.
+'''
+import math
+
+import pytest
+
+from competitive_programming_tools.scale import MODELS, fit
+
+SIZES = [1 << shift for shift in range(10, 21)]
+
+
+def best_model(sizes, times):
+    '''Get the name of the model fitting the times best.'''
+    return min(MODELS, key=lambda model: fit(sizes, times, model[1])[2])[0]
+
+
+@pytest.mark.parametrize('name, growth', MODELS[3:])
+def test_fit_recovers_model(name, growth):
+    startup, scale = 2e-3, 1e-3 / growth(SIZES[0])
+    times = [startup + scale * growth(size) for size in SIZES]
+    a, c, err = fit(SIZES, times, growth)
+    assert a == pytest.approx(startup)
+    assert c == pytest.approx(scale)
+    assert err == pytest.approx(0, abs=1e-9)
+    assert best_model(SIZES, times) == name
+
+
+def test_fit_with_noise():
+    growth = dict(MODELS)['n log n']
+    times = [
+        1e-3 + 1e-8 * growth(size) * (1 + 0.03 * math.sin(index))
+        for index, size in enumerate(SIZES)
+    ]
+    assert best_model(SIZES, times) == 'n log n'
+    _, _, err = fit(SIZES, times, growth)
+    assert err < 0.05
+
+
+def test_fit_is_nonnegative():
+    # Decreasing times would fit a negative slope.
+    times = [1.0 / (index + 1) for index in range(len(SIZES))]
+    a, c, _ = fit(SIZES, times, float)
+    assert a >= 0 and c >= 0
+    # A constant fits with no slope.
+    a, c, err = fit(SIZES, [0.5] * len(SIZES), float)
+    assert (a, c, err) == pytest.approx((0.5, 0, 0), abs=1e-12)
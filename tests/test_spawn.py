@@ -0,0 +1,159 @@
+'''
+Tests for spawning programs and measuring their usage.
+'''
+import asyncio
+import signal
+import sys
+
+from click.testing import CliRunner
+
+from competitive_programming_tools import main
+from competitive_programming_tools.spawn import DEVNULL, PIPE, spawn, split_command
+
+MB = 1 << 20
+
+
+def run(argv, input_data=None, **kwargs):
+    '''Run a program, and get its exit code, usage and output.'''
+    async def run_async():
+        proc = await spawn(argv, stdin=PIPE if input_data is not None else DEVNULL,
+                           stdout=PIPE, stderr=DEVNULL, **kwargs)
+        stdout, _ = await proc.communicate(input_data)
+        return proc.returncode, proc.usage, stdout
+    return asyncio.run(run_async())
+
+
+def python(code, *args, **kwargs):
+    return run([sys.executable, '-c', code, *args], **kwargs)
+
+
+def test_cpu_time():
+    returncode, usage, _ = python(
+        'import time\nend = time.process_time() + 0.3\n'
+        'while time.process_time() < end: pass\n')
+    assert returncode == 0
+    assert 0.3 <= usage.cpu_time < 0.6
+    assert usage.wall_time >= usage.cpu_time * 0.9
+
+
+def test_wall_time():
+    _, usage, _ = python('import time\ntime.sleep(0.3)\n')
+    assert usage.wall_time >= 0.3
+    assert usage.cpu_time < 0.2
+
+
+def test_peak_memory():
+    _, usage, _ = python('b = b"x" * (100 << 20)\n')
+    assert 100 * MB <= usage.max_rss < 200 * MB
+    # The program does not start out with the peak memory of python.
+    _, usage, _ = run(['true'])
+    assert usage.max_rss < 8 * MB
+
+
+def test_exit_codes():
+    assert python('import sys\nsys.exit(3)\n')[0] == 3
+    assert python('import os\nos.kill(os.getpid(), 9)\n')[0] == -signal.SIGKILL
+    assert run(['no-such-program-anywhere'])[0] == 127
+
+
+def test_pipes():
+    returncode, _, stdout = python('print(input()[::-1])\n', input_data=b'abc\n')
+    assert (returncode, stdout) == (0, b'cba\n')
+
+
+def test_split_command():
+    assert split_command('g++ -O2 "my file.cpp" -o a\\ b') == ['g++', '-O2', 'my file.cpp', '-o', 'a b']
+    # Each call gets a list of its own.
+    split_command('a b').append('c')
+    assert split_command('a b') == ['a', 'b']
+
+
+def test_arguments_are_not_expanded():
+    args = ['a b', '$HOME', '*', ';', 'echo hi', '"', '`true`']
+    _, _, stdout = python('import sys\nprint(sys.argv[1:])\n', *args)
+    assert stdout == f'{args}\n'.encode()
+
+
+def test_run_without_shell(tmp_path, monkeypatch):
+    # The source and the arguments would be mangled by a shell.
+    directory = tmp_path / 'a $dir; b'
+    (directory / 'samples').mkdir(parents=True)
+    (directory / 'solution.py').write_text('import sys\nprint(*sys.argv[1:])\n', encoding='utf-8')
+    (directory / 'samples' / 'solution_1.in').write_text('', encoding='utf-8')
+    (directory / 'samples' / 'solution_1.ans').write_text('* $HOME a;b\n', encoding='utf-8')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('CPT_CACHE', raising=False)
+    result = CliRunner().invoke(main, [
+        'run', str(directory / 'solution.py'), '-d', '1', '--', '*', '$HOME', 'a;b'])
+    assert result.exit_code == 0, result.output
+    assert 'with AC (exact)' in result.output
+
+
+def tee(data, sink_count=2, read_limits=None):
+    '''
+    Copy `data` through a Tee into `sink_count` pipes, the readers of which
+    stop after the bytes in `read_limits`, and get what they and the spill file got.
+    '''
+    import os
+    import tempfile
+    import threading
+    from competitive_programming_tools.spawn import Tee
+
+    read_limits = read_limits or [None] * sink_count
+    source_read_fd, source_write_fd = os.pipe()
+    sinks = [os.pipe() for _ in range(sink_count)]
+    received = [bytearray() for _ in range(sink_count)]
+
+    def write():
+        with open(source_write_fd, 'wb') as file:
+            file.write(data)
+
+    def read(index):
+        with open(sinks[index][0], 'rb', buffering=0) as file:
+            limit = read_limits[index]
+            while limit is None or len(received[index]) < limit:
+                chunk = file.read(1 << 16 if limit is None else limit - len(received[index]))
+                if not chunk:
+                    break
+                received[index] += chunk
+
+    threads = [threading.Thread(target=write)] + [
+        threading.Thread(target=read, args=(index,)) for index in range(sink_count)]
+    for thread in threads:
+        thread.start()
+    with tempfile.TemporaryFile() as spill:
+        asyncio.run(Tee(source_read_fd, spill.fileno(), [write_fd for _, write_fd in sinks]).run())
+        for thread in threads:
+            thread.join()
+        os.close(source_read_fd)
+        spill.seek(0)
+        return [bytes(sink_data) for sink_data in received], spill.read()
+
+
+DATA = bytes(range(256)) * (3 * MB // 256) + b'end'
+
+
+def test_tee():
+    received, spilled = tee(DATA)
+    assert received == [DATA, DATA]
+    assert spilled == DATA
+    assert tee(b'') == ([b'', b''], b'')
+
+
+def test_tee_sink_closed_early():
+    received, spilled = tee(DATA, 3, [None, 1000, 0])
+    assert received == [DATA, DATA[:1000], b'']
+    assert spilled == DATA
+
+
+def test_tee_without_splice_or_sendfile(monkeypatch):
+    import os
+
+    def unsupported(*_):
+        raise OSError('unsupported')
+
+    monkeypatch.delattr(os, 'splice', raising=False)
+    monkeypatch.setattr(os, 'sendfile', unsupported)
+    received, spilled = tee(DATA, 2, [None, 1000])
+    assert received == [DATA, DATA[:1000]]
+    assert spilled == DATA
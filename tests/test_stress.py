@@ -0,0 +1,287 @@
+'''
+Tests for the ranges of stress patterns and shrinking countertests.
+'''
+import random
+import sys
+
+from click.testing import CliRunner
+
+from competitive_programming_tools import main, reference_cache
+from competitive_programming_tools.stress import ProcessedArg, parse_range
+
+
+def test_parse_range():
+    assert parse_range('[1..5]') == (1, 5)
+    assert parse_range('[1...5]') == (1, 6)
+    assert parse_range('[0...0]') == (0, 1)
+    assert parse_range('[12..12]') == (12, 12)
+    for not_range in ('5', '[1.5]', '[1....5]', '[-1..5]', '[a..b]', ' [1..5]', '[1..5]x'):
+        assert parse_range(not_range) is None
+
+
+def test_processed_arg():
+    random.seed(0)
+    arg = ProcessedArg('[3...5]')
+    assert {arg.get() for _ in range(100)} == {'3', '4', '5'}
+    assert ProcessedArg('-n').get() == '-n'
+
+
+GENERATOR = '''\
+def make(rng, count, max_value):
+    return ''.join(f'{rng.randint(0, max_value)}\\n' for _ in range(count))
+'''
+
+SOLUTION = '''\
+import sys
+values = list(map(int, sys.stdin.read().split()))
+print(sum(values) + any(value >= 7 for value in values))
+'''
+
+REFERENCE = '''\
+import sys
+print(sum(map(int, sys.stdin.read().split())))
+'''
+
+
+def test_shrink(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / 'gen.py').write_text(GENERATOR, encoding='utf-8')
+    (tmp_path / 'solution.py').write_text(SOLUTION, encoding='utf-8')
+    (tmp_path / 'reference.py').write_text(REFERENCE, encoding='utf-8')
+
+    result = CliRunner().invoke(main, [
+        'stress', 'solution.py', 'gen:make', '[20...50]', '[50...100]',
+        '-ca', 'reference.py', '-d', '1', '-t', '30', '-p', '1',
+        '-st', '20', '--shrink-lines', '--no-cache',
+    ])
+    assert result.exit_code == 0, result.output
+
+    shrunk = (tmp_path / 'samples' / 'solution_shrunk.in').read_text(encoding='utf-8')
+    # The counts are lowered to 20, and the lines that do not matter removed.
+    assert len(shrunk.split()) == 1
+    assert 7 <= int(shrunk) <= 100
+    answer = (tmp_path / 'samples' / 'solution_shrunk.ans').read_text(encoding='utf-8')
+    assert answer == shrunk
+
+
+def test_shrink_lowers_ranges(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'solution.py').write_text('import sys\nsys.exit(1)\n', encoding='utf-8')
+    (tmp_path / 'gen.py').write_text(
+        'import sys\nprint(int(sys.argv[1]) * "x")\n', encoding='utf-8')
+
+    result = CliRunner().invoke(main, [
+        'stress', 'solution.py', f'{sys.executable} gen.py [10...1000]',
+        '-d', '1', '-t', '30', '-p', '1', '-st', '20', '--no-cache',
+    ])
+    assert result.exit_code == 0, result.output
+    assert 'crashing' in result.output
+
+    # Every test crashes, so the smallest count is reached.
+    shrunk = (tmp_path / 'samples' / 'solution_shrunk.in').read_text(encoding='utf-8')
+    assert shrunk == 10 * 'x' + '\n'
+
+
+def run_correct(tmp_path, *options):
+    '''Stress a correct solution on three tests, and get the output.'''
+    (tmp_path / 'solution.py').write_text(REFERENCE, encoding='utf-8')
+    (tmp_path / 'reference.py').write_text(REFERENCE, encoding='utf-8')
+    (tmp_path / 'gen.py').write_text('print(1, 2)\n', encoding='utf-8')
+    result = CliRunner().invoke(main, [
+        'stress', 'solution.py', f'{sys.executable} gen.py', '-ca', 'reference.py',
+        '-d', '1', '-n', '3', '-p', '1', *options,
+    ])
+    assert 'Ran 3 tests.' in result.output, result.output
+    return result.output
+
+
+def test_reference_cache_is_opt_in(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv('CPT_CACHE', raising=False)
+    cache_dir = tmp_path / 'references'
+    monkeypatch.setattr(reference_cache, 'CACHE_DIR', str(cache_dir))
+
+    run_correct(tmp_path)
+    assert not cache_dir.exists()
+
+    run_correct(tmp_path, '--cache')
+    assert len(list(cache_dir.glob('*.out'))) == 1
+
+    for path in cache_dir.iterdir():
+        path.unlink()
+    monkeypatch.setenv('CPT_CACHE', '1')
+    run_correct(tmp_path)
+    assert len(list(cache_dir.glob('*.out'))) == 1
+
+
+def test_worst_case_search():
+    from competitive_programming_tools.stress import WorstCaseSearch
+
+    random.seed(0)
+    search = WorstCaseSearch(['gen', '[1..100]', '-n', '[5...7]'])
+    assert search.bounds == {1: (1, 100), 3: (5, 8)}
+    assert search.argv({1: 42, 3: 6}) == ['gen', '42', '-n', '6']
+
+    for cost in range(40):
+        values = search.propose()
+        assert 1 <= values[1] < 100 and 5 <= values[3] < 8
+        search.add(cost, values, search.argv(values), b'')
+    assert len(search.population) == WorstCaseSearch.POPULATION
+    assert [cost for cost, _, _ in search.worst(3)] == [39, 38, 37]
+
+    # A candidate tried again only keeps its highest cost.
+    argv = search.worst(1)[0][1]
+    search.add(100, {}, argv, b'')
+    search.add(50, {}, argv, b'')
+    assert [cost for cost, _, _ in search.worst(2)] == [100, 38]
+
+
+def test_maximize_time(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'solution.py').write_text(
+        'for _ in range(int(input()) * 200000): pass\n', encoding='utf-8')
+    (tmp_path / 'gen.py').write_text('import sys\nprint(sys.argv[1])\n', encoding='utf-8')
+
+    result = CliRunner().invoke(main, [
+        'stress', 'solution.py', f'{sys.executable} gen.py [1..10]', '-ca', 'solution.py',
+        '-d', '1', '-n', '15', '-p', '1', '--maximize', 'time', '-k', '2', '--no-cache',
+    ])
+    assert result.exit_code == 0, result.output
+    assert 'The tests with the most time:' in result.output
+    worst = [
+        int((tmp_path / 'samples' / f'solution_worst{rank}.in').read_text(encoding='utf-8'))
+        for rank in (1, 2)
+    ]
+    assert worst[0] >= 8 and worst[0] != worst[1]
+    assert (tmp_path / 'samples' / 'solution_worst1.ans').read_text(encoding='utf-8') == ''
+    assert not (tmp_path / 'samples' / 'solution_worst3.in').exists()
+
+
+def test_is_python_generator(tmp_path, monkeypatch):
+    from competitive_programming_tools.stress import is_python_generator
+
+    monkeypatch.chdir(tmp_path)
+    assert is_python_generator('gen:make')
+    assert is_python_generator('gens.trees:random_tree')
+    for command in ('gen.py', './gen', 'gen:make:x', 'gen:', ':make', 'python3'):
+        assert not is_python_generator(command)
+    (tmp_path / 'a:b').write_text('', encoding='utf-8')
+    assert not is_python_generator('a:b')
+
+
+def test_generate_in_process(tmp_path, monkeypatch):
+    from competitive_programming_tools.stress import _generate, _init_generator
+
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / 'gen_in_process.py').write_text(
+        GENERATOR + '\ndef raw(rng):\n    return bytes([rng.randrange(256)])\n', encoding='utf-8')
+    _init_generator('gen_in_process:make', str(tmp_path))
+    _init_generator('gen_in_process:raw', str(tmp_path))
+    data = _generate('gen_in_process:make', 5, (3, 9))
+    assert len(data.split()) == 3 and all(0 <= int(value) <= 9 for value in data.split())
+    # The same seed gives the same test.
+    assert _generate('gen_in_process:make', 5, (3, 9)) == data
+    assert len(_generate('gen_in_process:raw', 1, ())) == 1
+
+
+def test_failing_test_saved_by_seed(tmp_path, monkeypatch):
+    import re
+    from competitive_programming_tools.stress import _generate, _init_generator
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / 'gen_seeded.py').write_text(GENERATOR, encoding='utf-8')
+    (tmp_path / 'solution.py').write_text(SOLUTION, encoding='utf-8')
+    (tmp_path / 'reference.py').write_text(REFERENCE, encoding='utf-8')
+
+    result = CliRunner().invoke(main, [
+        'stress', 'solution.py', 'gen_seeded:make', '[5...5]', '[100...100]',
+        '-ca', 'reference.py', '-d', '1', '-t', '30', '-p', '1', '-st', '0', '--no-cache',
+    ])
+    assert result.exit_code == 0, result.output
+    saved = re.search(r"saved as '(samples/solution_seed(\d+)\.in)'", result.output)
+    assert saved is not None, result.output
+    assert list((tmp_path / 'samples').iterdir()) == [tmp_path / saved[1]]
+
+    _init_generator('gen_seeded:make', str(tmp_path))
+    assert (tmp_path / saved[1]).read_bytes() == _generate('gen_seeded:make', int(saved[2]), (5, 100))
+
+
+def test_solution_not_reading_its_input(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'solution.py').write_text('print(0)\n', encoding='utf-8')
+    (tmp_path / 'reference.py').write_text(
+        'import sys\nprint(len(sys.stdin.read()) * 0)\n', encoding='utf-8')
+    # Much more than fits in a pipe.
+    (tmp_path / 'gen.py').write_text('print("x" * (1 << 22))\n', encoding='utf-8')
+    result = CliRunner().invoke(main, [
+        'stress', 'solution.py', f'{sys.executable} gen.py', '-ca', 'reference.py',
+        '-d', '1', '-n', '3', '-p', '1', '--no-cache',
+    ])
+    assert result.exit_code == 0, result.output
+    assert 'Ran 3 tests.' in result.output
+    assert not (tmp_path / 'samples').exists()
+
+
+def run_search(processes, busy_time=None, max_tests=None, timeout=2, fail_at=None):
+    '''Search with calls sleeping a little, and get how many ran and at most at once.'''
+    import asyncio
+    from competitive_programming_tools.stress import search
+
+    calls = running = most_running = 0
+
+    async def func():
+        nonlocal calls, running, most_running
+        calls += 1
+        if calls == fail_at:
+            raise ValueError(calls)
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+
+    search(func, timeout, processes, max_tests=max_tests, busy_time=busy_time)
+    return calls, most_running
+
+
+def test_search_max_tests():
+    assert run_search(2, max_tests=7) == (7, 2)
+
+
+def test_search_failure():
+    import pytest
+    with pytest.raises(ValueError, match='5'):
+        run_search(1, fail_at=5)
+
+
+def test_search_adds_workers_while_idle():
+    import os
+    cpus = os.cpu_count() or 1
+    _, most_running = run_search(None, busy_time=lambda: 0.0)
+    assert cpus < most_running <= 4 * cpus
+
+
+def test_search_keeps_workers_when_busy():
+    import os
+    import time
+    cpus = os.cpu_count() or 1
+    start_time = time.monotonic()
+    _, most_running = run_search(None, busy_time=lambda: 2 * cpus * (time.monotonic() - start_time))
+    assert most_running == cpus
+
+
+def test_telemetry(monkeypatch):
+    import time
+    from competitive_programming_tools.stress import Telemetry
+
+    telemetry = Telemetry()
+    assert telemetry.postfix().endswith('tests/s')
+    for wall_time in (0.01, 0.02, 0.03):
+        telemetry.record('gen', 0.01, 0.01)
+        telemetry.record('soln', wall_time, wall_time)
+        telemetry.record('ref', 0.04, 0.02)
+    monkeypatch.setattr(time, 'monotonic', lambda: telemetry.start_time + 2)
+    assert telemetry.tests == 3
+    assert round(telemetry.cpu_time, 6) == 0.15
+    assert telemetry.postfix() == '1.5 tests/s, p50 20 ms p99 30 ms, gen 14% soln 29% ref 57%'
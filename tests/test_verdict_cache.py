@@ -0,0 +1,66 @@
+'''
+Tests for reusing the verdicts of unchanged tests.
+'''
+import sys
+
+import click
+import pytest
+
+from competitive_programming_tools import verdict_cache
+from competitive_programming_tools.limits import Limits
+from competitive_programming_tools.run import run_test
+from competitive_programming_tools.verdict_cache import VerdictCache
+
+# Counts its runs in a file next to it.
+PROGRAM = '''\
+import os, sys, time
+with open(os.path.join(os.path.dirname(__file__), 'runs'), 'a') as file:
+    file.write('x')
+{body}
+'''
+
+
+@pytest.fixture
+def test_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(verdict_cache, 'CACHE_DIR', str(tmp_path / 'verdicts'))
+    (tmp_path / 'test.in').write_text('', encoding='utf-8')
+    (tmp_path / 'test.ans').write_text('1\n', encoding='utf-8')
+    return tmp_path
+
+
+def run_twice(test_dir, body, limits=Limits(time=10)):
+    '''Run a program on the test twice with the cache, and get its verdicts and runs.'''
+    source_path = test_dir / 'solution.py'
+    source_path.write_text(PROGRAM.format(body=body), encoding='utf-8')
+    executable = f'{sys.executable} {source_path}'
+    cache = VerdictCache(executable, None, (), limits)
+    verdicts = [
+        click.unstyle(run_test(executable, None, (), True, str(test_dir), 'test',
+                               limits, None, cache)[0])
+        for _ in range(2)
+    ]
+    return verdicts, len((test_dir / 'runs').read_text(encoding='utf-8'))
+
+
+def test_reuses_verdicts(test_dir):
+    assert run_twice(test_dir, 'print(1)') == (['AC', 'AC'], 1)
+
+
+def test_reuses_wrong_answers(test_dir):
+    assert run_twice(test_dir, 'print(2)') == (['WA', 'WA'], 1)
+
+
+def test_reruns_exceeded_limits(test_dir):
+    verdicts, runs = run_twice(test_dir, 'time.sleep(5)', Limits(time=0.1))
+    assert verdicts == ['TLE', 'TLE'] and runs == 2
+
+
+def test_key_depends_on_the_test(test_dir):
+    cache = VerdictCache(f'{sys.executable} -c pass', None, (), Limits(time=1))
+    input_path, answer_path = test_dir / 'test.in', test_dir / 'test.ans'
+    key = cache.key(input_path, answer_path)
+    assert cache.key(input_path, answer_path) == key
+    answer_path.write_text('2\n', encoding='utf-8')
+    assert cache.key(input_path, answer_path) != key
+    other_limits = VerdictCache(f'{sys.executable} -c pass', None, (), Limits(time=2))
+    assert other_limits.key(input_path, answer_path) != cache.key(input_path, answer_path)
@@ -0,0 +1,54 @@
+'''
+Tests for detecting changes to the watched files.
+'''
+import threading
+
+import pytest
+
+from competitive_programming_tools.watch import Inotify, Poller
+
+
+@pytest.fixture(params=[Inotify, Poller])
+def watcher(request):
+    watcher = request.param()
+    yield watcher
+    watcher.close()
+
+
+def write_later(path, delay=0.3):
+    timer = threading.Timer(delay, path.write_text, ('changed\n',))
+    timer.start()
+    return timer
+
+
+def test_reads_changes(tmp_path, watcher):
+    source = tmp_path / 'a.cpp'
+    source.write_text('', encoding='utf-8')
+    watcher.watch({str(source)})
+    write_later(source).join()
+    assert watcher.read(5) == {str(source)}
+
+
+def test_skips_other_files(tmp_path, watcher):
+    source = tmp_path / 'a.cpp'
+    source.write_text('', encoding='utf-8')
+    watcher.watch({str(source)})
+    (tmp_path / 'other.txt').write_text('x', encoding='utf-8')
+    assert watcher.read(0.5) == set()
+
+    # Without a timeout, it waits for a change to a watched file.
+    (tmp_path / 'other.txt').write_text('y', encoding='utf-8')
+    timer = write_later(source)
+    assert watcher.read() == {str(source)}
+    timer.join()
+
+
+def test_replaced_file(tmp_path, watcher):
+    # Editors often save by renaming a new file over the old one.
+    source = tmp_path / 'a.cpp'
+    source.write_text('', encoding='utf-8')
+    watcher.watch({str(source)})
+    new = tmp_path / 'a.cpp.swp'
+    new.write_text('new\n', encoding='utf-8')
+    threading.Timer(0.3, new.replace, (source,)).start()
+    assert watcher.read(5) == {str(source)}